@@ -0,0 +1,110 @@
+"""
+Compare proximity queries on the spatial index against scanning every entity
+
+    cd src && python -m benchmarks.spatial_index
+
+Entities are spread over a world that grows with the entity count so density stays the same,
+like a level that gets bigger as more things are put in it.
+The grid query time should stay about flat while the scan time grows with the entity count.
+
+The index also costs something every tick to keep up to date, "refresh" is that upkeep when a few percent
+of the entities moved, and "refresh all" is the worst case of every entity having moved.
+"far nearest" looks from well outside the world, where the rings are mostly empty
+"""
+
+import random
+import timeit
+
+from pygame import Rect
+
+from onepointsix.spatial import SpatialGrid, SpatialIndex
+
+
+ENTITY_COUNTS = [1_000, 10_000, 50_000]
+ENTITIES_PER_CELL = 4
+CELL_SIZE = 256
+QUERY_RADIUS = 300
+QUERIES = 200
+MOVING_FRACTION = 0.02
+
+
+class Entity:
+    """Stands in for an entity, the index only needs its id and position"""
+
+    def __init__(self, entity_id: str, position: tuple):
+        self.id = entity_id
+        self.position = position
+
+    def get_position(self) -> tuple:
+        return self.position
+
+
+def scan_radius(positions: dict, position: tuple, radius: float) -> list:
+    x, y = position
+
+    return [
+        entity_id for entity_id, (entity_x, entity_y) in positions.items() if (entity_x - x) ** 2 + (entity_y - y) ** 2 <= radius * radius
+    ]
+
+
+def scan_nearest(positions: dict, position: tuple):
+    x, y = position
+
+    return min(positions, key=lambda entity_id: (positions[entity_id][0] - x) ** 2 + (positions[entity_id][1] - y) ** 2)
+
+
+def benchmark(entity_count: int):
+
+    random.seed(entity_count)
+
+    world_size = int((entity_count / ENTITIES_PER_CELL) ** 0.5 * CELL_SIZE)
+
+    grid = SpatialIndex(None, CELL_SIZE)
+
+    entities = [Entity(str(entity_number), (random.uniform(0, world_size), random.uniform(0, world_size))) for entity_number in range(entity_count)]
+
+    for entity in entities:
+        grid.entity_changed(entity)
+
+    grid.refresh()
+
+    moving = random.sample(entities, int(entity_count * MOVING_FRACTION))
+
+    def refresh(changed: list):
+        for entity in changed:
+            entity.position = (entity.position[0] + 10, entity.position[1])
+            grid.entity_changed(entity)
+
+        grid.refresh()
+
+    query_points = [(random.uniform(0, world_size), random.uniform(0, world_size)) for _ in range(QUERIES)]
+
+    query_rects = [Rect(int(x), int(y), 640, 360) for x, y in query_points]
+
+    far_points = [(-world_size * 2, random.uniform(0, world_size)) for _ in range(QUERIES)]
+
+    def per_query(statement) -> float:
+        return timeit.timeit(statement, number=1) / QUERIES * 1_000_000
+
+    results = {
+        "grid radius": per_query(lambda: [grid.query_radius(point, QUERY_RADIUS) for point in query_points]),
+        "scan radius": per_query(lambda: [scan_radius(grid.positions, point, QUERY_RADIUS) for point in query_points]),
+        "grid rect": per_query(lambda: [grid.query_rect(rect) for rect in query_rects]),
+        "grid nearest": per_query(lambda: [grid.nearest(point) for point in query_points]),
+        "scan nearest": per_query(lambda: [scan_nearest(grid.positions, point) for point in query_points]),
+        "far nearest": per_query(lambda: [grid.nearest(point) for point in far_points])
+    }
+
+    # once per tick rather than per query
+    upkeep = {
+        "refresh": timeit.timeit(lambda: refresh(moving), number=1) * 1_000_000,
+        "refresh all": timeit.timeit(lambda: refresh(entities), number=1) * 1_000_000
+    }
+
+    print(f"{entity_count:>7} entities: " + ", ".join(f"{name} {microseconds:8.1f}us" for name, microseconds in results.items()))
+    print(" " * 18 + ", ".join(f"{name} {microseconds:8.1f}us per tick" for name, microseconds in upkeep.items()))
+
+
+if __name__ == "__main__":
+    for entity_count in ENTITY_COUNTS:
+        benchmark(entity_count)
@@ -0,0 +1,126 @@
+"""
+Measure what the server allocates while loading a network tick of client updates
+
+    cd src && python -m benchmarks.update_ingestion
+
+"before" deep copies the incoming updates first, which is what load_updates used to do,
+"after" is the current load_updates that reads the same dicts that get relayed
+"""
+
+import os
+import time
+import tracemalloc
+from copy import deepcopy
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from onepointsix.entity import Entity
+from onepointsix.gamemode_server import GamemodeServer
+
+
+CLIENT_COUNTS = [4, 16, 64]
+ENTITIES_PER_CLIENT = 50
+TICKS = 20
+
+
+class BenchmarkEntity(Entity):
+
+    def __init__(self, game, updater, position=None, stats=None, id=None):
+        super().__init__(game, updater, id)
+
+        self.position = position
+        self.stats = stats
+
+    def serialize(self):
+
+        data_dict = Entity.serialize(self)
+
+        data_dict.update(
+            {
+                "position": self.position,
+                "stats": self.stats
+            }
+        )
+
+        return data_dict
+
+    def update(self, update_data):
+        Entity.update(self, update_data)
+
+        for attribute_name, attribute_value in update_data.items():
+            match attribute_name:
+                case "position":
+                    self.position = attribute_value
+                case "stats":
+                    self.stats = attribute_value
+
+
+def make_updates(client_count: int, tick: int) -> list:
+    """One network tick worth of updates, every entity moved and had a nested field change"""
+
+    return [
+        {
+            "update_type": "update",
+            "entity_id": f"{client_number}-{entity_number}",
+            "entity_type": None,
+            "data": {
+                "position": [tick, entity_number],
+                "stats": {"health": 100 - tick, "effects": {"speed": [1.0, tick], "armor": [2.0, tick]}}
+            }
+        }
+        for client_number in range(client_count) for entity_number in range(ENTITIES_PER_CLIENT)
+    ]
+
+
+def measure(server: GamemodeServer, client_count: int, copy_first: bool) -> tuple:
+
+    ticks = [make_updates(client_count, tick) for tick in range(TICKS)]
+
+    peak_total = 0
+    elapsed = 0.0
+
+    for updates in ticks:
+
+        tracemalloc.start()
+
+        start = time.perf_counter()
+
+        server.updates_to_load = deepcopy(updates) if copy_first else updates
+
+        server.load_updates(None)
+
+        elapsed += time.perf_counter() - start
+
+        peak_total += tracemalloc.get_traced_memory()[1]
+
+        tracemalloc.stop()
+
+    return peak_total / TICKS, elapsed / TICKS
+
+
+def benchmark(client_count: int):
+
+    server = GamemodeServer(server_ip="127.0.0.1")
+
+    server.entity_type_map["benchmark"] = BenchmarkEntity
+
+    for client_number in range(client_count):
+        for entity_number in range(ENTITIES_PER_CLIENT):
+            BenchmarkEntity(server, str(client_number), position=[0, 0], stats={}, id=f"{client_number}-{entity_number}")
+
+    before_bytes, before_time = measure(server, client_count, copy_first=True)
+    after_bytes, after_time = measure(server, client_count, copy_first=False)
+
+    print(
+        f"{client_count:>3} clients, {client_count * ENTITIES_PER_CLIENT:>5} updates/tick: "
+        f"before {before_bytes / 1024:8.1f}KiB {before_time * 1000:6.2f}ms, "
+        f"after {after_bytes / 1024:8.1f}KiB {after_time * 1000:6.2f}ms"
+    )
+
+    server.socket.close()
+
+
+if __name__ == "__main__":
+    for client_count in CLIENT_COUNTS:
+        benchmark(client_count)
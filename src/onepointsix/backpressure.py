@@ -0,0 +1,178 @@
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+from rich import print
+
+if TYPE_CHECKING:
+    from onepointsix.gamemode_server import GamemodeServer
+
+
+SLOW_CLIENT_POLICIES = ["compact", "drop", "disconnect"]
+
+
+class ClientSendState:
+
+    def __init__(self):
+
+        self.congested = False
+        self.times_congested = 0
+        self.peak_pending_bytes = 0
+        self.dropped_updates = 0
+
+        # entities we threw updates away for, they are sent whole once the client catches up
+        self.dropped_entity_ids: Set[str] = set()
+
+
+class Backpressure:
+    """
+    Stops one slow client from holding up the server or using unbounded memory
+
+    A client is congested once more than high_watermark bytes are waiting in its connection's send buffer,
+    and stays congested until that drains to low_watermark. Nothing new is written to a congested client,
+    and what is queued for it is handled by the policy:
+
+    - "compact" merges everything into one backlog, so it gets the latest state of each entity once it catches up
+    - "drop" throws entity updates away but keeps creates and deletes, and resends the entities it dropped updates for once it catches up
+    - "disconnect" disconnects it
+
+    Snapshot clients always just lose their queued snapshots, the next one they get is a delta from whatever they acked
+    """
+
+    def __init__(self, game: "GamemodeServer", high_watermark: int = 1024 * 1024, low_watermark: int = 256 * 1024, policy: str = "compact"):
+
+        if policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"slow client policy must be one of {SLOW_CLIENT_POLICIES}, not {policy}")
+
+        if low_watermark > high_watermark:
+            raise ValueError("the low watermark cant be above the high watermark")
+
+        self.game = game
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policy = policy
+
+        self.clients: Dict[str, ClientSendState] = {}
+
+    def remove_client(self, client_uuid: str):
+        self.clients.pop(client_uuid, None)
+
+    def hold(self, client_uuid: str, connection) -> bool:
+        """Whether what is queued for a client should stay queued this tick instead of being sent"""
+
+        client_state = self.clients.setdefault(client_uuid, ClientSendState())
+
+        pending_bytes = connection.pending_bytes
+
+        client_state.peak_pending_bytes = max(client_state.peak_pending_bytes, pending_bytes)
+
+        if client_state.congested and pending_bytes <= self.low_watermark:
+            client_state.congested = False
+
+            self.resync(client_uuid, client_state)
+
+        elif not client_state.congested and pending_bytes > self.high_watermark:
+            client_state.congested = True
+            client_state.times_congested += 1
+
+            print(f"{client_uuid} is congested with {pending_bytes} bytes waiting to be sent")
+
+        if not client_state.congested:
+            return False
+
+        if self.policy == "disconnect":
+            self.game.disconnect_client(client_uuid)
+
+        elif connection.replication == "snapshot":
+            self.game.update_queue.take(client_uuid)
+
+            self.game.snapshots.forget_unsent(client_uuid)
+
+        elif self.policy == "drop":
+            self.drop_updates(client_uuid, client_state)
+
+        elif client_uuid not in self.game.update_queue.backlogs:
+            self.game.update_queue.compact(client_uuid)
+
+        return True
+
+    def drop_updates(self, client_uuid: str, client_state: ClientSendState):
+        """Throw away every entity update queued for a client and keep the rest queued"""
+
+        essential_updates: List[dict] = []
+
+        # batches can be shared with other clients, so we make a new one instead of filtering them
+        for batch in self.game.update_queue.take(client_uuid):
+            for update in batch.decoded_updates():
+
+                if update["update_type"] == "update":
+                    client_state.dropped_updates += 1
+                    client_state.dropped_entity_ids.add(update["entity_id"])
+
+                    continue
+
+                essential_updates.append(update)
+
+        self.game.update_queue.queue(essential_updates, [client_uuid])
+
+    def resync(self, client_uuid: str, client_state: ClientSendState):
+        """Queue the whole current state of every entity a client missed updates for"""
+
+        updates = []
+
+        for entity_id in client_state.dropped_entity_ids:
+
+            data = self.current_data(entity_id)
+
+            # the client's own entities are more up to date on its end than ours
+            if data is None or data.get("updater") == client_uuid:
+                continue
+
+            updates.append({
+                "update_type": "update",
+                "entity_id": entity_id,
+                "entity_type": None,
+                "data": data
+            })
+
+        client_state.dropped_entity_ids.clear()
+
+        self.game.update_queue.queue(updates, [client_uuid])
+
+    def current_data(self, entity_id: str) -> Optional[dict]:
+
+        entity = self.game.entities.get(entity_id)
+
+        if entity is not None:
+            return entity.serialize()
+
+        # relaying servers only know entities as the updates clients sent
+        if self.game.relay_cache:
+
+            self.game.relay_cache.fold()
+
+            state = self.game.relay_cache.states.get(entity_id)
+
+            if state is not None:
+                return state["data"]
+
+        return None
+
+    def get_stats(self) -> Dict[str, dict]:
+        """Queue depth and congestion for every connected client"""
+
+        stats = {}
+
+        for client_uuid, connection in self.game.client_sockets.items():
+
+            client_state = self.clients.get(client_uuid, ClientSendState())
+
+            stats[client_uuid] = {
+                "pending_bytes": connection.pending_bytes,
+                "queued_batches": len(self.game.update_queue.queues.get(client_uuid, [])),
+                "backlogged": client_uuid in self.game.update_queue.backlogs,
+                "congested": client_state.congested,
+                "times_congested": client_state.times_congested,
+                "peak_pending_bytes": client_state.peak_pending_bytes,
+                "dropped_updates": client_state.dropped_updates
+            }
+
+        return stats
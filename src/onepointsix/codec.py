@@ -0,0 +1,345 @@
+import json
+import struct
+import sys
+from typing import Dict, Type, Union
+
+
+class UnknownCodec(Exception):
+    pass
+
+
+class CodecError(Exception):
+    pass
+
+
+class Codec:
+    """Turns a list of updates into bytes and back"""
+
+    name: str = ""
+
+    def encode(self, updates: list) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, data: Union[bytes, memoryview]) -> list:
+        raise NotImplementedError()
+
+
+class JsonCodec(Codec):
+    """Human readable codec, mostly useful for debugging"""
+
+    name = "json"
+
+    def encode(self, updates: list) -> bytes:
+        return bytes(json.dumps(updates), "utf-8")
+
+    def decode(self, data: Union[bytes, memoryview]) -> list:
+        return json.loads(bytes(data))
+
+
+# type tags for the binary codec
+NONE = 0x00
+FALSE = 0x01
+TRUE = 0x02
+INT8 = 0x03
+INT16 = 0x04
+INT32 = 0x05
+INT64 = 0x06
+BIG_INT = 0x07
+FLOAT = 0x08
+SHORT_STR = 0x09
+STR = 0x0A
+SHORT_LIST = 0x0B
+LIST = 0x0C
+SHORT_DICT = 0x0D
+DICT = 0x0E
+INTERNED_STR = 0x0F
+LONG_BIG_INT = 0x10
+
+BINARY_CODEC_VERSION = 1
+
+# strings that show up in almost every update get sent as a single index byte
+# only ever append to this tuple, both ends need to agree on the indices
+INTERNED_STRINGS = (
+    "update_type",
+    "entity_id",
+    "entity_type",
+    "data",
+    "create",
+    "update",
+    "delete",
+    "updater",
+    "draw_layer",
+    "active_sprite",
+    "scale",
+)
+
+INTERNED_INDICES = {string: index for index, string in enumerate(INTERNED_STRINGS)}
+
+U8 = struct.Struct(">B")
+U32 = struct.Struct(">I")
+I8 = struct.Struct(">b")
+I16 = struct.Struct(">h")
+I32 = struct.Struct(">i")
+I64 = struct.Struct(">q")
+F64 = struct.Struct(">d")
+
+
+class BinaryCodec(Codec):
+    """
+    Compact typed binary format
+
+    Every value is a one byte type tag followed by its payload. Strings, lists and dicts are length prefixed.
+    Supports None, bools, ints, floats, strings, lists (and tuples) and dicts, which is everything serialize() produces
+    """
+
+    name = "binary"
+
+    def encode(self, updates: list) -> bytes:
+
+        out = bytearray(U8.pack(BINARY_CODEC_VERSION))
+
+        self._encode_value(updates, out)
+
+        return bytes(out)
+
+    def _encode_value(self, value, out: bytearray):
+
+        value_type = type(value)
+
+        if value_type is str:
+
+            index = INTERNED_INDICES.get(value)
+
+            if index is not None:
+                out.append(INTERNED_STR)
+                out.append(index)
+                return
+
+            encoded_string = value.encode("utf-8")
+
+            if len(encoded_string) < 256:
+                out.append(SHORT_STR)
+                out.append(len(encoded_string))
+            else:
+                out.append(STR)
+                out += U32.pack(len(encoded_string))
+
+            out += encoded_string
+
+        elif value is None:
+            out.append(NONE)
+
+        elif value_type is bool:
+            out.append(TRUE if value else FALSE)
+
+        elif value_type is int:
+
+            if -128 <= value <= 127:
+                out.append(INT8)
+                out += I8.pack(value)
+
+            elif -32768 <= value <= 32767:
+                out.append(INT16)
+                out += I16.pack(value)
+
+            elif -2147483648 <= value <= 2147483647:
+                out.append(INT32)
+                out += I32.pack(value)
+
+            elif -9223372036854775808 <= value <= 9223372036854775807:
+                out.append(INT64)
+                out += I64.pack(value)
+
+            else:
+                # arbitrarily large ints are sent as their decimal representation
+                try:
+                    digits = str(value).encode("utf-8")
+
+                except ValueError as exception:
+                    # python refuses to turn ints past sys.get_int_max_str_digits() into strings
+                    raise CodecError(f"Cannot encode an int this large, it has more than {sys.get_int_max_str_digits()} digits") from exception
+
+                if len(digits) < 256:
+                    out.append(BIG_INT)
+                    out.append(len(digits))
+                else:
+                    out.append(LONG_BIG_INT)
+                    out += U32.pack(len(digits))
+
+                out += digits
+
+        elif value_type is float:
+            out.append(FLOAT)
+            out += F64.pack(value)
+
+        elif value_type is dict:
+
+            if len(value) < 256:
+                out.append(SHORT_DICT)
+                out.append(len(value))
+            else:
+                out.append(DICT)
+                out += U32.pack(len(value))
+
+            for key, item in value.items():
+                self._encode_value(key, out)
+                self._encode_value(item, out)
+
+        elif value_type is list or value_type is tuple:
+
+            if len(value) < 256:
+                out.append(SHORT_LIST)
+                out.append(len(value))
+            else:
+                out.append(LIST)
+                out += U32.pack(len(value))
+
+            for item in value:
+                self._encode_value(item, out)
+
+        # subclasses of the builtin types (IntEnum and friends) are handled last
+        elif isinstance(value, bool):
+            self._encode_value(bool(value), out)
+
+        elif isinstance(value, int):
+            self._encode_value(int(value), out)
+
+        elif isinstance(value, float):
+            self._encode_value(float(value), out)
+
+        elif isinstance(value, str):
+            self._encode_value(str(value), out)
+
+        else:
+            raise CodecError(f"Cannot encode value of type {value_type}")
+
+    def decode(self, data: Union[bytes, memoryview]) -> list:
+
+        view = memoryview(data)
+
+        if len(view) == 0:
+            raise CodecError("Cannot decode empty payload")
+
+        if view[0] != BINARY_CODEC_VERSION:
+            raise CodecError(f"Unsupported binary codec version {view[0]}")
+
+        try:
+            value, offset = self._decode_value(view, 1)
+
+        except (IndexError, struct.error) as exception:
+            raise CodecError("Payload ended unexpectedly") from exception
+
+        # bad utf-8 in a string, or a big int that isnt a number
+        except ValueError as exception:
+            raise CodecError(f"Payload has a malformed value: {exception}") from exception
+
+        if offset != len(view):
+            raise CodecError(f"Payload has {len(view) - offset} trailing bytes")
+
+        return value
+
+    def _decode_value(self, view: memoryview, offset: int):
+
+        tag = view[offset]
+        offset += 1
+
+        if tag == INTERNED_STR:
+            return INTERNED_STRINGS[view[offset]], offset + 1
+
+        elif tag == SHORT_STR:
+            length = view[offset]
+            offset += 1
+            return str(view[offset:offset + length], "utf-8"), offset + length
+
+        elif tag == SHORT_DICT or tag == DICT:
+
+            if tag == SHORT_DICT:
+                length = view[offset]
+                offset += 1
+            else:
+                length = U32.unpack_from(view, offset)[0]
+                offset += 4
+
+            value = {}
+
+            for _ in range(length):
+                key, offset = self._decode_value(view, offset)
+                item, offset = self._decode_value(view, offset)
+                value[key] = item
+
+            return value, offset
+
+        elif tag == SHORT_LIST or tag == LIST:
+
+            if tag == SHORT_LIST:
+                length = view[offset]
+                offset += 1
+            else:
+                length = U32.unpack_from(view, offset)[0]
+                offset += 4
+
+            value = []
+
+            for _ in range(length):
+                item, offset = self._decode_value(view, offset)
+                value.append(item)
+
+            return value, offset
+
+        elif tag == INT8:
+            return I8.unpack_from(view, offset)[0], offset + 1
+
+        elif tag == FLOAT:
+            return F64.unpack_from(view, offset)[0], offset + 8
+
+        elif tag == NONE:
+            return None, offset
+
+        elif tag == TRUE:
+            return True, offset
+
+        elif tag == FALSE:
+            return False, offset
+
+        elif tag == INT16:
+            return I16.unpack_from(view, offset)[0], offset + 2
+
+        elif tag == INT32:
+            return I32.unpack_from(view, offset)[0], offset + 4
+
+        elif tag == INT64:
+            return I64.unpack_from(view, offset)[0], offset + 8
+
+        elif tag == BIG_INT or tag == LONG_BIG_INT:
+
+            if tag == BIG_INT:
+                length = view[offset]
+                offset += 1
+            else:
+                length = U32.unpack_from(view, offset)[0]
+                offset += 4
+
+            return int(str(view[offset:offset + length], "utf-8")), offset + length
+
+        elif tag == STR:
+            length = U32.unpack_from(view, offset)[0]
+            offset += 4
+            return str(view[offset:offset + length], "utf-8"), offset + length
+
+        raise CodecError(f"Unknown type tag {tag}")
+
+
+CODECS: Dict[str, Type[Codec]] = {
+    JsonCodec.name: JsonCodec,
+    BinaryCodec.name: BinaryCodec
+}
+
+
+def get_codec(name: str) -> Codec:
+    """Create the codec registered under name"""
+
+    try:
+        return CODECS[name]()
+
+    except KeyError:
+        raise UnknownCodec(f"Codec {name} does not exist, options are {list(CODECS.keys())}")
@@ -0,0 +1,153 @@
+import time
+import zlib
+from typing import Dict, Type, Union
+
+
+class UnknownCompressionMode(Exception):
+    pass
+
+
+class CompressionStats:
+    """Running totals for one connection, used to tune the compression level under load"""
+
+    def __init__(self):
+        self.uncompressed_bytes_out = 0
+        self.compressed_bytes_out = 0
+        self.compressed_bytes_in = 0
+        self.uncompressed_bytes_in = 0
+        self.compress_time: float = 0 # cpu seconds
+        self.decompress_time: float = 0 # cpu seconds
+
+    @property
+    def ratio(self) -> float:
+        """Outgoing compressed size divided by uncompressed size, lower is better"""
+
+        if self.uncompressed_bytes_out == 0:
+            return 1
+
+        return self.compressed_bytes_out / self.uncompressed_bytes_out
+
+    def as_dict(self) -> dict:
+        return {
+            "ratio": self.ratio,
+            "uncompressed_bytes_out": self.uncompressed_bytes_out,
+            "compressed_bytes_out": self.compressed_bytes_out,
+            "uncompressed_bytes_in": self.uncompressed_bytes_in,
+            "compressed_bytes_in": self.compressed_bytes_in,
+            "compress_time": self.compress_time,
+            "decompress_time": self.decompress_time
+        }
+
+
+class Compression:
+    """Compresses payloads for a single connection"""
+
+    name: str = ""
+
+    # whether the same input always compresses to the same output, so one result can be sent on several connections
+    shareable: bool = True
+
+    def __init__(self, level: int = zlib.Z_BEST_SPEED):
+        self.level = level
+        self.stats = CompressionStats()
+
+    def compress(self, data: Union[bytes, memoryview]) -> bytes:
+
+        start = time.thread_time()
+
+        compressed_data = self._compress(data)
+
+        self.stats.compress_time += time.thread_time() - start
+        self.stats.uncompressed_bytes_out += len(data)
+        self.stats.compressed_bytes_out += len(compressed_data)
+
+        return compressed_data
+
+    def record_shared(self, uncompressed_size: int, compressed_size: int):
+        """Count a payload that was compressed once for another connection and reused for this one"""
+
+        self.stats.uncompressed_bytes_out += uncompressed_size
+        self.stats.compressed_bytes_out += compressed_size
+
+    def decompress(self, data: Union[bytes, memoryview]) -> bytes:
+
+        start = time.thread_time()
+
+        decompressed_data = self._decompress(data)
+
+        self.stats.decompress_time += time.thread_time() - start
+        self.stats.compressed_bytes_in += len(data)
+        self.stats.uncompressed_bytes_in += len(decompressed_data)
+
+        return decompressed_data
+
+    def _compress(self, data: Union[bytes, memoryview]) -> bytes:
+        raise NotImplementedError()
+
+    def _decompress(self, data: Union[bytes, memoryview]) -> bytes:
+        raise NotImplementedError()
+
+
+class NoCompression(Compression):
+
+    name = "none"
+
+    def _compress(self, data: Union[bytes, memoryview]) -> bytes:
+        return bytes(data)
+
+    def _decompress(self, data: Union[bytes, memoryview]) -> bytes:
+        return bytes(data)
+
+
+class OneShotCompression(Compression):
+    """Every payload is compressed on its own. This is what legacy clients expect"""
+
+    name = "oneshot"
+
+    def _compress(self, data: Union[bytes, memoryview]) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def _decompress(self, data: Union[bytes, memoryview]) -> bytes:
+        return zlib.decompress(data)
+
+
+class StreamCompression(Compression):
+    """
+    One zlib stream per connection, flushed after every payload
+
+    Consecutive ticks tend to be very similar, so keeping the compression window between payloads
+    makes them a lot smaller than compressing each one alone.
+    Payloads must be decompressed in the same order they were compressed
+    """
+
+    name = "stream"
+    shareable = False
+
+    def __init__(self, level: int = zlib.Z_BEST_SPEED):
+        super().__init__(level)
+
+        self.compressor = zlib.compressobj(level)
+        self.decompressor = zlib.decompressobj()
+
+    def _compress(self, data: Union[bytes, memoryview]) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _decompress(self, data: Union[bytes, memoryview]) -> bytes:
+        return self.decompressor.decompress(data)
+
+
+COMPRESSION_MODES: Dict[str, Type[Compression]] = {
+    NoCompression.name: NoCompression,
+    OneShotCompression.name: OneShotCompression,
+    StreamCompression.name: StreamCompression
+}
+
+
+def get_compression(name: str, level: int = zlib.Z_BEST_SPEED) -> Compression:
+    """Create a fresh compression context for a connection"""
+
+    try:
+        return COMPRESSION_MODES[name](level)
+
+    except KeyError:
+        raise UnknownCompressionMode(f"Compression mode {name} does not exist, options are {list(COMPRESSION_MODES.keys())}")
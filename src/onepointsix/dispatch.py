@@ -0,0 +1,394 @@
+from collections import defaultdict
+from collections.abc import MutableSequence
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Set, Type, Union
+
+if TYPE_CHECKING:
+    from onepointsix.events import Event
+    from onepointsix.gamemode_client import GamemodeClient
+    from onepointsix.gamemode_server import GamemodeServer
+
+
+class ListenerList(MutableSequence):
+    """
+    The listeners for one event type
+
+    Works like a normal list, but tells its EventSubscriptions whenever it changes so the dispatch table stays up to date.
+    Listeners are stored in an insertion ordered dict keyed by a slot number, so one can be removed without
+    looking through or shifting all the others
+    """
+
+    def __init__(self, subscriptions: "EventSubscriptions", event_type: Type["Event"], listeners: Iterable[Callable] = ()):
+
+        self.subscriptions = subscriptions
+        self.event_type = event_type
+
+        # slot -> listener, slots only ever go up so dict order is list order
+        self.slots: Dict[int, Callable] = {}
+
+        # listener -> its slots in order, so remove() can find the first one
+        self.listener_slots: Dict[Callable, List[int]] = {}
+
+        # the subscriptions find out about these all at once from whoever is creating us
+        for listener in listeners:
+            self.add_slot(self.subscriptions.new_slot(), listener)
+
+    def add_slot(self, slot: int, listener: Callable):
+
+        self.slots[slot] = listener
+
+        self.listener_slots.setdefault(listener, []).append(slot)
+
+    def discard_slot(self, slot: int) -> Callable:
+
+        listener = self.slots.pop(slot)
+
+        slots = self.listener_slots[listener]
+
+        slots.remove(slot)
+
+        if not slots:
+            del self.listener_slots[listener]
+
+        return listener
+
+    def append(self, listener: Callable):
+
+        slot = self.subscriptions.new_slot()
+
+        self.add_slot(slot, listener)
+
+        self.subscriptions.listener_added(self.event_type, slot, listener)
+
+    def remove(self, listener: Callable):
+
+        try:
+            slot = self.listener_slots[listener][0]
+
+        except KeyError:
+            raise ValueError(f"{listener} is not subscribed to {self.event_type.__name__}")
+
+        self.discard_slot(slot)
+
+        self.subscriptions.listener_removed(self.event_type, slot, listener)
+
+    def __iadd__(self, listeners: Iterable[Callable]):
+
+        self.extend(listeners)
+
+        return self
+
+    def __add__(self, listeners: Iterable[Callable]) -> List[Callable]:
+        return list(self) + list(listeners)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __iter__(self) -> Iterator[Callable]:
+        # a copy, so listeners can unsubscribe while someone loops over us
+        return iter(list(self.slots.values()))
+
+    def __contains__(self, listener) -> bool:
+        return listener in self.listener_slots
+
+    def __getitem__(self, index):
+        return list(self.slots.values())[index]
+
+    def __repr__(self) -> str:
+        return f"ListenerList({list(self.slots.values())!r})"
+
+    # anything that can reorder or replace listeners just rebuilds the whole table entry
+
+    def replace(self, listeners: List[Callable]):
+
+        self.subscriptions.forget_owners(self.event_type)
+
+        self.slots.clear()
+        self.listener_slots.clear()
+
+        for listener in listeners:
+            self.add_slot(self.subscriptions.new_slot(), listener)
+
+        self.subscriptions.listeners_replaced(self.event_type)
+
+    def insert(self, index, listener: Callable):
+
+        listeners = list(self.slots.values())
+
+        listeners.insert(index, listener)
+
+        self.replace(listeners)
+
+    def __setitem__(self, index, value):
+
+        listeners = list(self.slots.values())
+
+        listeners[index] = value
+
+        self.replace(listeners)
+
+    def __delitem__(self, index):
+
+        listeners = list(self.slots.values())
+
+        del listeners[index]
+
+        self.replace(listeners)
+
+    def clear(self):
+        self.replace([])
+
+    def sort(self, *args, **kwargs):
+        self.replace(sorted(self.slots.values(), *args, **kwargs))
+
+    def reverse(self):
+        self.replace(list(reversed(self.slots.values())))
+
+
+class EventSubscriptions(defaultdict):
+    """
+    Maps event types to their listeners, and keeps a dispatch table of only the listeners that should run locally
+
+    A listener runs locally if it doesn't belong to an entity, or if it belongs to an entity we are the updater of.
+    The table for an event type is built the first time that event is triggered, then kept up to date in place
+    as listeners are added and removed and as entities change updater, so dispatch() never has to check anything
+
+    It also remembers the slots each object's listeners are in, so removing all of an entity's listeners
+    only deletes those slots, no matter how many other listeners there are
+    """
+
+    def __init__(self, game: Union["GamemodeClient", "GamemodeServer"]):
+        super().__init__()
+
+        self.game = game
+
+        # event type -> slot -> listener, for the listeners that run locally
+        self.local_listeners: Dict[Type["Event"], Dict[int, Callable]] = {}
+
+        # id of listener owner -> event type -> slots of its listeners for that event type
+        self.owner_slots: Dict[int, Dict[Type["Event"], Set[int]]] = {}
+
+        self.next_slot = 0
+
+    def __missing__(self, event_type: Type["Event"]) -> ListenerList:
+
+        listeners = ListenerList(self, event_type)
+
+        dict.__setitem__(self, event_type, listeners)
+
+        return listeners
+
+    def __setitem__(self, event_type: Type["Event"], listeners: Iterable[Callable]):
+
+        # += hands us back the same list, anything else gets wrapped so we hear about future changes
+        if isinstance(listeners, ListenerList) and listeners.subscriptions is self and listeners.event_type is event_type:
+            dict.__setitem__(self, event_type, listeners)
+
+            return
+
+        self.forget_owners(event_type)
+
+        dict.__setitem__(self, event_type, ListenerList(self, event_type, listeners))
+
+        self.listeners_replaced(event_type)
+
+    def __delitem__(self, event_type: Type["Event"]):
+
+        self.forget_owners(event_type)
+
+        dict.__delitem__(self, event_type)
+
+        self.rebuild(event_type)
+
+    def new_slot(self) -> int:
+
+        slot = self.next_slot
+
+        self.next_slot += 1
+
+        return slot
+
+    def is_local(self, listener: Callable) -> bool:
+
+        owner = getattr(listener, "__self__", None)
+
+        # the game object and anything else without an updater always runs
+        if owner is None or not hasattr(owner, "updater"):
+            return True
+
+        return owner.updater == self.game.uuid
+
+    def get_local_listeners(self, event_type: Type["Event"]) -> Dict[int, Callable]:
+
+        try:
+            return self.local_listeners[event_type]
+
+        except KeyError:
+
+            local_listeners = {
+                slot: listener for slot, listener in self[event_type].slots.items() if self.is_local(listener)
+            }
+
+            self.local_listeners[event_type] = local_listeners
+
+            return local_listeners
+
+    def dispatch(self, event: "Event"):
+        """
+        Call every local listener of the event's type, in the order they subscribed
+
+        Like looping over a plain list, listeners that subscribe during the dispatch are called at the end of it,
+        and listeners that are removed before their turn, like those of an entity killed by an earlier listener, aren't called
+        """
+
+        local_listeners = self.get_local_listeners(type(event))
+
+        pending = list(local_listeners.items())
+
+        while pending:
+
+            for slot, listener in pending:
+
+                if slot in local_listeners:
+                    listener(event)
+
+            last_slot = pending[-1][0]
+
+            # new slots are always higher than old ones, so anything added while we were calling is at the end
+            pending = []
+
+            for slot in reversed(local_listeners):
+
+                if slot <= last_slot:
+                    break
+
+                pending.append((slot, local_listeners[slot]))
+
+            pending.reverse()
+
+    def listener_added(self, event_type: Type["Event"], slot: int, listener: Callable):
+
+        self.add_owner(event_type, slot, listener)
+
+        if event_type in self.local_listeners and self.is_local(listener):
+            self.local_listeners[event_type][slot] = listener
+
+    def listener_removed(self, event_type: Type["Event"], slot: int, listener: Callable):
+
+        self.remove_owner(event_type, slot, listener)
+
+        if event_type in self.local_listeners:
+            self.local_listeners[event_type].pop(slot, None)
+
+    def listeners_replaced(self, event_type: Type["Event"]):
+        """The list was changed in a way we cant follow, so count its owners from scratch"""
+
+        self.count_owners(event_type)
+
+        self.rebuild(event_type)
+
+    def rebuild(self, event_type: Type["Event"]):
+
+        if event_type not in self.local_listeners:
+            return
+
+        local_listeners = self.local_listeners[event_type]
+
+        listeners = dict.get(self, event_type)
+
+        # update in place so a dispatch() that is currently looping over this table sees the change
+        local_listeners.clear()
+
+        if listeners is not None:
+            local_listeners.update(
+                (slot, listener) for slot, listener in listeners.slots.items() if self.is_local(listener)
+            )
+
+    def owner_changed(self, owner: object):
+        """Rebuild the tables that contain listeners of an entity whose updater changed"""
+
+        for event_type in list(self.owner_slots.get(id(owner), {})):
+            self.rebuild(event_type)
+
+    def add_owner(self, event_type: Type["Event"], slot: int, listener: Callable):
+
+        owner = getattr(listener, "__self__", None)
+
+        if owner is None:
+            return
+
+        self.owner_slots.setdefault(id(owner), {}).setdefault(event_type, set()).add(slot)
+
+    def remove_owner(self, event_type: Type["Event"], slot: int, listener: Callable):
+
+        owner = getattr(listener, "__self__", None)
+
+        if owner is None:
+            return
+
+        event_slots = self.owner_slots.get(id(owner))
+
+        if event_slots is None or event_type not in event_slots:
+            return
+
+        event_slots[event_type].discard(slot)
+
+        if not event_slots[event_type]:
+            del event_slots[event_type]
+
+        if not event_slots:
+            del self.owner_slots[id(owner)]
+
+    def forget_owners(self, event_type: Type["Event"]):
+        """Drop every owner entry for an event type before its list is replaced"""
+
+        listeners = dict.get(self, event_type)
+
+        if listeners is None:
+            return
+
+        for slot, listener in listeners.slots.items():
+            self.remove_owner(event_type, slot, listener)
+
+    def count_owners(self, event_type: Type["Event"]):
+
+        listeners = dict.get(self, event_type)
+
+        if listeners is None:
+            return
+
+        for slot, listener in listeners.slots.items():
+            self.add_owner(event_type, slot, listener)
+
+    def subscribe(self, event_type: Type["Event"], listener: Callable):
+        self[event_type].append(listener)
+
+    def unsubscribe(self, event_type: Type["Event"], listener: Callable):
+        self[event_type].remove(listener)
+
+    def unsubscribe_owner(self, owner: object):
+        """Remove every listener that belongs to owner, straight away so not even a dispatch that is running calls them again"""
+
+        self.unsubscribe_owners([owner])
+
+    def unsubscribe_owners(self, owners: Iterable[object]):
+        """Remove every listener belonging to any of the owners, only touching their own slots"""
+
+        for owner in owners:
+
+            event_slots = self.owner_slots.pop(id(owner), None)
+
+            if event_slots is None:
+                continue
+
+            for event_type, slots in event_slots.items():
+
+                # bypass the ListenerList hooks, we are keeping everything up to date ourselves
+                listeners: ListenerList = dict.__getitem__(self, event_type)
+
+                local_listeners = self.local_listeners.get(event_type)
+
+                for slot in slots:
+                    listeners.discard_slot(slot)
+
+                    if local_listeners is not None:
+                        local_listeners.pop(slot, None)
@@ -55,9 +55,9 @@ class DrawableEntity(Entity):
     
     @staticmethod
     def deserialize(entity_data: Dict[str, int | bool | str | list], entity_id: str, game: Union["GamemodeClient", "GamemodeServer"]) -> Dict[str, int | bool | str | list]:
-        
-        entity_data["draw_layer"] = entity_data["draw_layer"]
 
-        entity_data.update(Entity.deserialize(entity_data=entity_data, entity_id=entity_id, game=game))
+        deserialized_data = Entity.deserialize(entity_data=entity_data, entity_id=entity_id, game=game)
+
+        deserialized_data["draw_layer"] = entity_data["draw_layer"]
 
-        return entity_data
+        return deserialized_data
@@ -1,6 +1,6 @@
 import uuid
 import inspect
-from typing import Dict, List, Type, Tuple, Union, TYPE_CHECKING, get_type_hints, Callable, Optional
+from typing import Dict, Iterable, List, Set, Type, Tuple, Union, TYPE_CHECKING, get_type_hints, Callable, Optional
 import json
 from abc import ABC
 
@@ -10,13 +10,48 @@ from rich import print
 
 from onepointsix.unresolved import Unresolved
 from onepointsix.helpers import get_matching_objects, dict_diff
-from onepointsix.events import TickComplete, NetworkTick, NewEntity
+from onepointsix.events import Event, TickComplete, NetworkTick, NewEntity
+from onepointsix.networked_field import NetworkedField
 
 if TYPE_CHECKING:
     from onepointsix.gamemode_client import GamemodeClient
     from onepointsix.gamemode_server import GamemodeServer
     
 class Entity(ABC):
+
+    # attribute name -> serialized key of every NetworkedField the entity declares, filled in automatically
+    networked_fields: Dict[str, str] = {}
+
+    # serialized key -> the NetworkedField for it, so dirty fields can be serialized on their own
+    networked_keys: Dict[str, NetworkedField] = {}
+
+    # entities with networked fields only diff the fields that were assigned since the last checkpoint
+    tracks_changes: bool = False
+
+    # how far past a client's view radius this entity is still relevant, used by area of interest filtering
+    relevance_radius: float = 0
+
+    # clients see the area around the focus entities they are the updater of, like their player
+    interest_focus: bool = False
+
+    # set by the updater setter, the default means "nobody yet" for listeners that are subscribed before it is
+    _updater: Optional[str] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        networked_fields = {}
+        networked_keys = {}
+
+        for klass in reversed(cls.__mro__):
+            for attribute_name, attribute in vars(klass).items():
+                if isinstance(attribute, NetworkedField):
+                    networked_fields[attribute_name] = attribute.key
+                    networked_keys[attribute.key] = attribute
+
+        cls.networked_fields = networked_fields
+        cls.networked_keys = networked_keys
+        cls.tracks_changes = len(networked_fields) != 0
     
     def __init__(
         self,
@@ -27,8 +62,9 @@ class Entity(ABC):
         **kwargs
     ):
 
-        self.updater = updater
+        self.dirty_fields: Set[str] = set()
         self.game = game
+        self.updater = updater
         self.update_checkpoint: dict = {}
 
         if id is None:
@@ -39,8 +75,49 @@ class Entity(ABC):
         # add entity to the game state automatically
         self.game.entities[self.id] = self
 
+        self.game.entity_registry.add(self)
+
+        # anything that was waiting for this entity can point at it now
+        self.game.pending_references.entity_created(self)
+
+        # new entities always get looked at next network tick
+        self.game.dirty_entities[self.id] = self
+
+        # and put in their cell at the start of the next tick, once the subclass has set its position up
+        self.game.spatial_index.entity_changed(self)
+
         self.game.trigger(NewEntity(new_entity=self))
 
+    @property
+    def updater(self) -> str:
+        return self._updater
+
+    @updater.setter
+    def updater(self, updater: str):
+
+        previous_updater = self._updater
+
+        self._updater = updater
+
+        if previous_updater == updater:
+            return
+
+        # our listeners may have started or stopped running locally, including ones subscribed before we had an updater
+        self.game.event_subscriptions.owner_changed(self)
+
+        if previous_updater is not None:
+            self.mark_dirty("updater")
+
+    def mark_dirty(self, key: str):
+        """Check a serialized field for changes next network tick, only matters for entities that track changes"""
+
+        self.dirty_fields.add(key)
+
+        self.game.dirty_entities[self.id] = self
+
+        # the field might be what the position comes from
+        self.game.spatial_index.entity_changed(self)
+
     def kill(self):
         """Remove entity from entity list and remove all event listeners""" 
 
@@ -60,17 +137,57 @@ class Entity(ABC):
         print(f"deleting {self.id} {self.game.tick_count}")
         del self.game.entities[self.id]
 
-        for event, event_listeners in self.game.event_subscriptions.items():
-            for listener in event_listeners.copy():          
-                if listener.__self__ is self:
-                    event_listeners.remove(listener)
+        self.game.dirty_entities.pop(self.id, None)
+
+        self.game.entity_registry.remove(self)
+
+        self.game.pending_references.entity_killed(self)
+
+        self.game.spatial_index.remove(self.id)
+
+        # only touches the event types we actually subscribed to
+        self.game.event_subscriptions.unsubscribe_owner(self)
+
+    def get_position(self) -> Optional[Tuple[float, float]]:
+        """Where the entity is in the world, entities without a position are relevant to every client"""
+
+        return None
+
+    def moved(self):
+        """Update the entity's cell in the spatial index now, positions that dont come from networked fields are only picked up this way"""
+
+        self.game.spatial_index.entity_moved(self)
+
+    def subscribe(self, event_type: Type[Event], listener: Callable):
+        """Listen for an event, the listener is removed automatically when the entity is killed"""
+
+        self.game.event_subscriptions.subscribe(event_type, listener)
+
+    def unsubscribe(self, event_type: Type[Event], listener: Callable):
+
+        self.game.event_subscriptions.unsubscribe(event_type, listener)
 
     def set_update_checkpoint(self):
-        self.update_checkpoint = self.serialize()
+
+        # only the fields that were assigned can have changed
+        if self.tracks_changes and self.update_checkpoint != {}:
+
+            if self.dirty_fields:
+                self.update_checkpoint.update(self.serialize_fields(self.dirty_fields))
+
+        else:
+            self.update_checkpoint = self.serialize()
+
+        self.dirty_fields.clear()
 
     def detect_updates(self):
         """Compare entity state from last tick to this tick to find differences"""
 
+        if self.tracks_changes and self.update_checkpoint != {}:
+            self.detect_dirty_field_updates()
+
+            return
+
         current_tick_dict = self.serialize()
         
         # this indicates that the entity did not exist last tick
@@ -93,19 +210,72 @@ class Entity(ABC):
 
             #print(json.dumps(update_data_dict))
                 
-    def resolve(self):
-        """Convert any of the entity's attributes that are of type 'Unresolved' to the actual entity they are pointing to"""
+    def serialize_fields(self, keys: Iterable[str]) -> dict:
+        """
+        The serialized values of only the given keys
+
+        Networked fields and the updater are serialized on their own, anything else that was marked dirty
+        means serializing the whole entity once
+        """
+
+        networked_keys = type(self).networked_keys
+
+        data_dict = {}
+
+        for key in keys:
 
-        for attribute_name, attribute in self.__dict__.copy().items():
+            if key in networked_keys:
+                data_dict[key] = networked_keys[key].serialize(self)
 
-            if type(attribute) is not Unresolved:
+            elif key == "updater":
+                data_dict[key] = self.updater
+
+            else:
+                current_tick_dict = self.serialize()
+
+                return {key: current_tick_dict[key] for key in keys if key in current_tick_dict}
+
+        return data_dict
+
+    def detect_dirty_field_updates(self):
+        """Only send the assigned fields whose serialized value actually changed"""
+
+        if not self.dirty_fields:
+            return
+
+        current_tick_dict = self.serialize_fields(self.dirty_fields)
+
+        update_data_dict = {}
+
+        for key in self.dirty_fields:
+
+            if key not in current_tick_dict:
                 continue
 
-            resolved_attribute = self.game.entities[
-                attribute.uuid
-            ]
+            value = current_tick_dict[key]
+            checkpoint_value = self.update_checkpoint.get(key)
+
+            if type(value) is dict and type(checkpoint_value) is dict:
+
+                sub_diff_dict = dict_diff(checkpoint_value, value)
+
+                if sub_diff_dict != {}:
+                    update_data_dict[key] = sub_diff_dict
 
-            self.__setattr__(attribute_name, resolved_attribute)
+            elif key not in self.update_checkpoint or value != checkpoint_value:
+                update_data_dict[key] = value
+
+        if update_data_dict:
+            self.game.network_update(update_type="update", entity_id=self.id, data=update_data_dict)
+
+    def resolve(self):
+        """
+        Convert any of the entity's attributes that are of type 'Unresolved' to the actual entity they are pointing to
+
+        Attributes pointing at entities that don't exist yet are resolved as soon as they are created
+        """
+
+        self.game.pending_references.track(self)
 
     def serialize(self) -> Dict[str, Union[int, bool, str, list, None]]:
         """Serialize the entity's data"""
@@ -118,11 +288,18 @@ class Entity(ABC):
 
     @staticmethod
     def deserialize(entity_data: Dict[str, Union[int, bool, str, list]], entity_id: str, game: Union["GamemodeClient", "GamemodeServer"]):
-        """Deserialize a dictionary of entity init arguments into proper objects"""
+        """
+        Deserialize a dictionary of entity init arguments into proper objects
+
+        entity_data is the dict that came off the network, and the server relays that same dict to other clients,
+        so build a new dict instead of changing it
+        """
+
+        deserialized_data = dict(entity_data)
 
-        entity_data["updater"] = entity_data["updater"]    
+        deserialized_data["updater"] = entity_data["updater"]
 
-        return entity_data
+        return deserialized_data
 
     def update(self, update_data):
         """Use serialized entity data to update existing entity"""
@@ -34,6 +34,10 @@ class SentNetworkUpdates(Event):
     """The client has detected and sent entity updates to server"""
     pass
 
+class WorldLoaded(Event):
+    """The client has received every entity the server sent it when it joined"""
+    pass
+
 class ResourcesLoaded(Event):
     """All sprites and sounds have been loaded into GamemodeClient.resources"""
     pass 
@@ -44,6 +48,12 @@ class DisconnectedClient(Event):
 
         self.disconnected_client_uuid = disconnected_client_uuid
 
+class ClientJoined(Event):
+    """A client finished its handshake and has been sent the whole world"""
+    def __init__(self, client_uuid: str):
+
+        self.client_uuid = client_uuid
+
 class TickStart(Event):
     """Triggers before Tick event"""
     pass
@@ -55,6 +65,10 @@ class TickComplete(Event):
 class GameStart(Event):
     pass 
 
+class RenderFrame(Event):
+    """Time to draw a new frame, only used when rendering is decoupled from the game tick"""
+    pass
+
 class ScreenCleared(Event):
     """Screen surface has been cleared for a new frame"""
     pass 
@@ -75,7 +89,7 @@ class NetworkTick(Event):
 
 class NewEntity(Event):
     """A new entity has been initialized"""
-    def __init__(self, new_entity: Entity):
+    def __init__(self, new_entity: "Entity"):
         self.new_entity = new_entity
 
 class KeyA(Event):
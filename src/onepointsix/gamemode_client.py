@@ -4,8 +4,8 @@ import time
 import uuid
 import socket
 import json
-from collections import defaultdict
-from typing import Union, Type, Dict, Literal, List, Optional, Tuple, Callable
+from collections import defaultdict, deque
+from typing import Deque, Union, Type, Dict, Literal, List, Optional, Tuple, Callable
 from types import MethodType
 import zlib
 import pathlib
@@ -14,14 +14,26 @@ import pygame
 from pygame import Rect
 from rich import print
 
-from onepointsix import headered_socket
+from onepointsix import headered_socket, handshake
 from onepointsix.headered_socket import Disconnected
 from onepointsix.entity import Entity
 from onepointsix.helpers import get_matching_objects
 from onepointsix.exceptions import InvalidUpdateType, MalformedUpdate
-from onepointsix.events import StartedTrackingUpdates, FinishedTrackingUpdates, Tick, Event, TickComplete, GameStart, TickStart, ScreenCleared, NetworkTick, ResourcesLoaded, ReceivedNetworkUpdates, SentNetworkUpdates, ParsedNetworkUpdates
+from onepointsix.events import WorldLoaded, StartedTrackingUpdates, FinishedTrackingUpdates, Tick, Event, TickComplete, GameStart, TickStart, ScreenCleared, NetworkTick, ResourcesLoaded, ReceivedNetworkUpdates, SentNetworkUpdates, ParsedNetworkUpdates, RenderFrame
 from onepointsix import events
 from onepointsix.drawable_entity import DrawableEntity
+from onepointsix.codec import get_codec
+from onepointsix.compression import COMPRESSION_MODES, get_compression
+from onepointsix.scheduler import TickScheduler
+from onepointsix.dispatch import EventSubscriptions
+from onepointsix.spatial import SpatialIndex
+from onepointsix.registry import EntityRegistry, EntityTypeMap
+from onepointsix.references import PendingReferences
+from onepointsix.snapshots import REPLICATION_MODES, SnapshotReceiver
+from onepointsix.udp_transport import TRANSPORTS, UdpConnection, UdpEndpoint
+from onepointsix.joining import JOIN_MODES
+from onepointsix.update_queue import UpdateQueue
+from onepointsix.recording import DT, HELLO, NETWORK_TICK, RECEIVED, SENT, TICK, Recorder
 
 
 class GamemodeClient:
@@ -29,34 +41,76 @@ class GamemodeClient:
         self, 
         server_ip: str = socket.gethostname(), 
         server_port: int = 5560, 
-        network_compression: bool = True
+        network_compression: bool = True,
+        network_codec: str = "binary",
+        compression_mode: str = "stream",
+        compression_level: int = zlib.Z_BEST_SPEED,
+        vsync: bool = False,
+        spatial_cell_size: float = 256,
+        transport: str = "tcp",
+        simulated_loss: float = 0,
+        simulated_latency: float = 0,
+        coalesce_updates: bool = True,
+        measure_coalescing: bool = False,
+        update_history_size: int = 256,
+        recording_path: Optional[str] = None
     ): 
         
         pygame.init()
         pygame.mixer.init()
+
+        if transport not in TRANSPORTS:
+            raise ValueError(f"transport must be one of {TRANSPORTS}, not {transport}")
         
-        self.update_history: List[List[dict]] = []
-        self.server = headered_socket.HeaderedSocket(socket.AF_INET, socket.SOCK_STREAM)
+        self.update_history: Deque[List[dict]] = deque(maxlen=update_history_size) # the last few network ticks worth of updates we sent
+        self.recorder: Optional[Recorder] = Recorder(recording_path) if recording_path else None # every frame we send and receive, for replaying later
+        self.transport = transport
+
+        if transport == "udp":
+            # loss and latency are simulated on everything we send, for testing over loopback
+            self.server = UdpConnection(UdpEndpoint(loss=simulated_loss, latency=simulated_latency))
+
+        else:
+            self.server = headered_socket.HeaderedSocket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_ip: str = server_ip
         self.server_port: int = server_port
         self.uuid = str(uuid.uuid4())[0:4]
         self.outgoing_updates_queue: List[dict] = []
         self.incoming_updates_queue: List[dict] = []
-        self.entity_type_map: Dict[str, Type[Entity]] = {}
+        self.entity_type_map = EntityTypeMap()
+        self.entity_registry: EntityRegistry = EntityRegistry() # entities grouped by class
+        self.pending_references: PendingReferences = PendingReferences(self) # entities waiting for the entities they point at to be created
+        self.snapshot_receiver: Optional[SnapshotReceiver] = None # set if the server replicates to us with snapshots
+        self.world_loaded = False # whether we have every entity the server had when we joined
+        self.world_entities_expected = 0 # entities the server said it is sending us when we joined
+        self.world_entities_received = 0
         self.entities: Dict[str, Entity] = {}
-        self.event_subscriptions: defaultdict[Type[Event], list] = defaultdict(list)
+        self.dirty_entities: Dict[str, Entity] = {} # new entities and entities with networked fields that were assigned since the last checkpoint
+        self.event_subscriptions: EventSubscriptions = EventSubscriptions(self)
+        self.spatial_index: SpatialIndex = SpatialIndex(self, spatial_cell_size) # entities with a position, for proximity queries
         self.tick_count: int = 0
         self.last_tick = time.time()
         self.resources: Dict[str, pygame.Surface] = {}
         self.dt = 0.1 # i am initializing this with 0.1 instead of 0 because i think it might break stuff
         self.sent_bytes = 0
+        self.coalesce_updates = coalesce_updates # merge everything queued for an entity into one update before sending it
+        self.coalesced_updates = 0 # updates that coalescing merged away or cancelled
+        self.measure_coalescing = measure_coalescing # count the bytes coalescing saves, which means encoding everything twice
+        self.coalesced_bytes = 0 # encoded bytes that coalescing saved, before compression, only counted when measure_coalescing is set
         self.network_compression = network_compression
+        self.codec = get_codec(network_codec) # the codec we would like to use, the server has the final say during the handshake
+        self.compression_mode = compression_mode
+        self.compression_level = compression_level
         self.adjusted_mouse_pos: Tuple[int, int] = (0,0)
         self.camera_offset: List[int] = [0,0]
+        self.scheduler: Optional[TickScheduler] = None
+        self.fixed_dt: Optional[float] = None # when set, every tick simulates exactly this many seconds
+        self.render_time: float = 0 # seconds the last frame took to draw
         self.screen: pygame.Surface = pygame.display.set_mode(
             [1280, 720],
-            pygame.RESIZABLE
+            pygame.RESIZABLE,
             #pygame.FULLSCREEN
+            vsync=int(vsync)
         )
 
         self.event_subscriptions[TickComplete] += [
@@ -83,6 +137,12 @@ class GamemodeClient:
             self.receive_network_updates, # it doesnt really matter when we receive network updates, they are parsed each network tick
         ]
 
+        if self.recorder:
+            # marks where network ticks happened, so a replay runs them at the same points
+            self.event_subscriptions[NetworkTick] += [
+                self.record_network_tick
+            ]
+
         self.event_subscriptions[NetworkTick] += [
             self.send_network_updates,
             self.detect_entity_updates
@@ -93,9 +153,16 @@ class GamemodeClient:
         ]
         
         self.event_subscriptions[TickStart] += [
-            self.measure_dt
+            self.measure_dt,
+            self.refresh_spatial_index
         ]
 
+        if self.recorder:
+            # after measure_dt, so a replay can simulate each tick with the dt it had
+            self.event_subscriptions[TickStart] += [
+                self.record_tick
+            ]
+
         self.event_subscriptions[FinishedTrackingUpdates] += [
             self.parse_incoming_updates
         ]
@@ -225,27 +292,41 @@ class GamemodeClient:
         if keys[pygame.K_MINUS]:
             self.trigger(events.KeyMinus())
     
+    @property
+    def entity_type_map(self) -> EntityTypeMap:
+        return self._entity_type_map
+
+    @entity_type_map.setter
+    def entity_type_map(self, entity_type_map: Dict[str, Type[Entity]]):
+        # keep the reverse lookup working if a game assigns a plain dict
+        self._entity_type_map = EntityTypeMap(entity_type_map)
+
     def measure_dt(self, event: TickStart):
         """Measure the time since the last tick and update self.dt"""
 
-        self.dt = time.time() - self.last_tick
+        if self.fixed_dt is not None:
+            self.dt = self.fixed_dt
+        else:
+            self.dt = time.time() - self.last_tick
 
         self.last_tick = time.time()
 
+    def refresh_spatial_index(self, event: TickStart):
+        """Move entities that were created, updated or changed networked fields last tick to the cells they ended up in"""
+
+        self.spatial_index.refresh()
+
     def lookup_entity_type_string(self, entity: Union[Type[Entity], Type[type]]) -> Optional[str]:
         """Find entity type's corresponding type string in entity_type_map"""
 
-        entity_type_string = None
+        # this allows looking up an instance of an entity or just the class of an entity
+        entity_type = entity if isinstance(entity, type) else type(entity)
 
-        for possible_entity_type_string, entity_type in self.entity_type_map.items():
-            if type(entity) is entity_type or entity is entity_type: # this allows looking up an instance of an entity or just the class of an entity
-                entity_type_string = possible_entity_type_string
-        
-        if entity_type_string == None:
-            raise KeyError(f"Entity type {type(entity)} does not exist in entity type map")
-    
-        else:
-            return entity_type_string
+        try:
+            return self.entity_type_map.type_strings[entity_type]
+
+        except KeyError:
+            raise KeyError(f"Entity type {entity_type} does not exist in entity type map")
 
     def network_update(self, update_type: Union[Literal["create"], Literal["update"], Literal["delete"]], entity_id: str, data: Optional[dict] = None, entity_type_string: Optional[str] = None) -> None:
 
@@ -277,45 +358,123 @@ class GamemodeClient:
         
         # we must send an updates list even if there are no updates
         # this is because the server will only give US updates if we do first
+
+        if self.coalesce_updates:
+            self.outgoing_updates_queue = self.coalesce_outgoing_updates(self.outgoing_updates_queue)
         
         self.update_history.append(self.outgoing_updates_queue)
+
+        # entity updates go out unreliably over udp, so the connection splits and encodes them itself
+        if self.server.supports_unreliable:
+
+            if self.recorder:
+                self.recorder.record(SENT, self.tick_count, codec_name=self.server.codec.name, payload=self.server.codec.encode(self.outgoing_updates_queue))
+
+            self.sent_bytes += self.server.send_updates(self.outgoing_updates_queue)
+
+            self.outgoing_updates_queue = []
+
+            return
         
-        updates_json = json.dumps(
+        updates_bytes = self.server.codec.encode(
             self.outgoing_updates_queue
         )
-        
-
-        updates_json_bytes = bytes(
-            updates_json, "utf-8"
-        )
 
-        if self.network_compression:
+        if self.recorder:
+            self.recorder.record(SENT, self.tick_count, codec_name=self.server.codec.name, payload=updates_bytes)
 
-            updates_json_bytes = zlib.compress(
-                updates_json_bytes, level=zlib.Z_BEST_COMPRESSION
-            )
+        updates_bytes = self.server.compression.compress(
+            updates_bytes
+        )
 
         self.server.send_headered(
-            updates_json_bytes
+            updates_bytes
         )
 
-        self.sent_bytes += len(updates_json_bytes)
+        self.sent_bytes += len(updates_bytes)
 
         self.outgoing_updates_queue = []
 
 
+    def coalesce_outgoing_updates(self, updates: List[dict]) -> List[dict]:
+        """
+        Merge the updates queued for each entity into one, the same way the server compacts what it queues for clients
+
+        An entity that was created and killed before it was sent isn't sent at all.
+        Updates that aren't about an entity, like snapshot acks, are kept as they are and go first
+        """
+
+        control_updates = []
+        entity_updates = UpdateQueue()
+
+        for update in updates:
+
+            if update["entity_id"] is None:
+                control_updates.append(update)
+
+            else:
+                entity_updates.add(update)
+
+        coalesced = control_updates + list(entity_updates)
+
+        # nothing was merged, so nothing was saved
+        if len(coalesced) == len(updates):
+            return updates
+
+        self.coalesced_updates += len(updates) - len(coalesced)
+
+        if self.measure_coalescing:
+            self.coalesced_bytes += len(self.server.codec.encode(updates)) - len(self.server.codec.encode(coalesced))
+
+        return coalesced
+
+    def get_coalescing_stats(self) -> dict:
+        """How much merging our outgoing updates per entity has saved"""
+
+        return {
+            "coalesced_updates": self.coalesced_updates,
+            "coalesced_bytes": self.coalesced_bytes
+        }
+
+    def record_network_tick(self, event: NetworkTick):
+        self.recorder.record(NETWORK_TICK, self.tick_count)
+
+    def record_tick(self, event: TickStart):
+        self.recorder.record(TICK, self.tick_count, payload=DT.pack(self.dt))
+
+    def entities_to_diff(self) -> List[Entity]:
+        """
+        Every entity that can have changed since its checkpoint
+
+        That is every entity of a class without networked fields, since those can only be found by diffing,
+        and the entities that track their changes and had something assigned
+        """
+
+        entities = [
+            entity
+            for entity_class, class_entities in self.entity_registry.by_class.items() if not entity_class.tracks_changes
+            for created_number, entity in class_entities.values()
+        ]
+
+        # new entities of those classes are in dirty_entities too
+        entities += [entity for entity in self.dirty_entities.values() if entity.tracks_changes]
+
+        return entities
+
     def set_entity_checkpoints(self, event: ParsedNetworkUpdates):
         """Set entity update checkpoints after receiving updates from the server"""
 
-        for entity in self.entities.values():
+        for entity in self.entities_to_diff():
             entity.set_update_checkpoint()
+
+        self.dirty_entities.clear()
         
         self.trigger(StartedTrackingUpdates())
 
     def detect_entity_updates(self, event: NetworkTick):
         """Detect all entity changes between when the checkpoint was set and now"""
         
-        for entity in self.entities.values():
+        for entity in self.entities_to_diff():
             entity.detect_updates()
         
         self.trigger(FinishedTrackingUpdates())
@@ -326,7 +485,7 @@ class GamemodeClient:
 
         # this method can either be directly invoked or be called by an event
         try:
-            updates_json_bytes = self.server.recv_headered()
+            frames = self.server.recv_frames()
         except Disconnected:
             raise Disconnected()
 
@@ -334,23 +493,56 @@ class GamemodeClient:
             self.trigger(ReceivedNetworkUpdates())
             return
 
-        if self.network_compression:
-            try:
-                updates_json_bytes = zlib.decompress(updates_json_bytes)
-            except:
-                pass
-        
-        updates_json = updates_json_bytes.decode("utf-8")
+        # drain every frame we have instead of one per tick so we never fall behind the server
+        for frame in frames:
 
+            updates_bytes = self.server.compression.decompress(frame)
 
-        updates = json.loads(
-            updates_json
-        )
+            if self.recorder:
+                self.recorder.record(RECEIVED, self.tick_count, codec_name=self.server.codec.name, payload=updates_bytes)
+
+            updates = self.server.codec.decode(
+                updates_bytes
+            )
 
-        self.incoming_updates_queue += updates
+            # snapshot deltas are turned into normal updates against the last snapshot we applied
+            if self.snapshot_receiver and updates and updates[0]["update_type"] == "snapshot":
+                updates = self.snapshot_receiver.apply(updates)
+
+            elif not self.world_loaded:
+                updates = self.take_world_markers(updates)
+
+            self.incoming_updates_queue += updates
         
         self.trigger(ReceivedNetworkUpdates())
 
+    def take_world_markers(self, updates: List[dict]) -> List[dict]:
+        """Keep track of how much of the world we have while we are joining, and return the updates that arent markers"""
+
+        entity_updates = []
+
+        for update in updates:
+
+            match update["update_type"]:
+
+                case "world_begin":
+                    self.world_entities_expected = update["data"]["entities"]
+
+                case "world_end":
+                    self.world_loaded = True
+
+                    self.trigger(WorldLoaded())
+
+                case "create":
+                    self.world_entities_received += 1
+
+                    entity_updates.append(update)
+
+                case _:
+                    entity_updates.append(update)
+
+        return entity_updates
+
     def parse_incoming_updates(self, event: FinishedTrackingUpdates):
 
         for update in self.incoming_updates_queue:
@@ -368,7 +560,9 @@ class GamemodeClient:
                         game=self
                     )
 
-                    entity_class(game=self, id=update["entity_id"], **deserialized_data)
+                    new_entity = entity_class(game=self, id=update["entity_id"], **deserialized_data)
+
+                    self.pending_references.track(new_entity)
 
                 case "update":
                     
@@ -384,6 +578,10 @@ class GamemodeClient:
                         update["data"]
                     )
 
+                    self.spatial_index.entity_changed(updating_entity)
+
+                    self.pending_references.track(updating_entity)
+
                 case "delete":
 
                     try:
@@ -392,8 +590,8 @@ class GamemodeClient:
                         # THIS IS A BANDAID FIX
                         pass
 
-        for entity in self.entities.values():
-            entity.resolve()
+        # references were resolved as their entities were created, this just warns about ones that never will be
+        self.pending_references.check_stale()
 
         self.incoming_updates_queue = []
         
@@ -403,10 +601,7 @@ class GamemodeClient:
 
         draw_order: Dict[int, List[DrawableEntity]] = defaultdict(list)
 
-        for entity in self.entities.values():
-
-            if not isinstance(entity, DrawableEntity):
-                continue
+        for entity in self.entity_registry.of_type(DrawableEntity):
 
             if entity.draw_layer is None:
                 continue
@@ -425,31 +620,46 @@ class GamemodeClient:
         
         pygame.display.flip()
 
-    def clear_screen(self, event: TickComplete):
+    def clear_screen(self, event: Union[TickComplete, RenderFrame]):
 
         self.screen.fill((0,0,0))
 
         self.trigger(ScreenCleared())
 
-    def trigger(self, event: Event):
+    def kill_entities(self, entities: List[Entity]):
+        """Kill a group of entities, each one only costs as much as its own listeners"""
 
-        for function in self.event_subscriptions[type(event)]:
-            if function.__self__.__class__.__base__ == GamemodeClient:
-                # if the object this listener function belongs to has a base class that is GamemodeClient, then we don't need to check if we should run it
-                # this is because we never receive other user's GamemodeClient objects
+        for entity in entities:
+            entity.kill()
 
-                # we need to do this check because the GamemodeClient object does not have an "updater" attribute
-                pass
-            # dont call function if the entity this function belongs to isnt ours
-            elif function.__self__.updater != self.uuid:
-                continue
-            
-            function(event)
+    def trigger(self, event: Event):
+
+        # the dispatch table only contains listeners that belong to us, so there is nothing to check here
+        self.event_subscriptions.dispatch(event)
 
     def start(self, event: GameStart):
 
         pass
         
+    def offered_compression_modes(self) -> List[str]:
+        """Compression modes we are willing to use, in order of preference"""
+
+        if not self.network_compression:
+            return ["none"]
+
+        compression_modes = list(dict.fromkeys([self.compression_mode, "oneshot", "none"]))
+
+        # datagrams can be lost or reordered, so over udp every payload has to decompress on its own
+        if self.server.supports_unreliable:
+            compression_modes = [mode for mode in compression_modes if COMPRESSION_MODES[mode].shareable]
+
+        return compression_modes
+
+    def get_compression_stats(self) -> dict:
+        """Compression ratio and cpu time for our connection to the server"""
+
+        return self.server.compression.stats.as_dict()
+
     def connect(self, event: ResourcesLoaded):
 
         self.server.connect((self.server_ip, self.server_port))
@@ -457,15 +667,131 @@ class GamemodeClient:
         print("Connected to server")
         
         self.server.send_headered(
-            bytes(self.uuid, "utf-8")
+            handshake.encode_hello(
+                self.uuid,
+                {
+                    # offer our preferred codec first and always fall back to json
+                    "codecs": list(dict.fromkeys([self.codec.name, "json"])),
+                    "compression": self.offered_compression_modes(),
+                    "headers": headered_socket.HEADER_FORMATS,
+                    "replication": REPLICATION_MODES,
+                    "join": JOIN_MODES
+                }
+            )
         )
+
+        reply_bytes = self.server.recv_headered()
+
+        if self.recorder:
+            self.recorder.record(HELLO, self.tick_count, payload=reply_bytes)
+
+        reply = handshake.decode_reply(reply_bytes)
+
+        self.server.codec = get_codec(reply["codec"])
+        self.server.compression = get_compression(reply["compression"], self.compression_level)
+        self.server.header_format = reply["header"]
+        self.server.replication = reply.get("replication", "stream")
+        self.server.join = reply.get("join")
+
+        if self.server.replication == "snapshot":
+            self.snapshot_receiver = SnapshotReceiver(self)
+
+        print(f"Using {self.server.codec.name} codec with {self.server.compression.name} compression")
+
+        # chunked joins start with world_begin, the entities arrive over the next few ticks and are loaded as they come in
         self.receive_network_updates()
 
         self.server.setblocking(False)
 
+        # otherwise there is no way to tell when the server is done, so the first frame has to do
+        if self.server.join != "chunked":
+            self.world_loaded = True
+
+            self.trigger(WorldLoaded())
+
         print("Received initial state")
    
-    def run(self, max_tick_rate: int, network_tick_rate: int):
+    def game_tick(self):
+
+        if pygame.key.get_pressed()[pygame.K_F4]:
+            self.stop()
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.stop()
+
+        self.trigger(TickStart())
+
+        self.trigger(Tick())
+
+        self.trigger(TickComplete())
+
+    def network_tick(self):
+        self.trigger(NetworkTick())
+
+    def render(self):
+
+        start = time.perf_counter()
+
+        self.trigger(RenderFrame())
+
+        self.render_time = time.perf_counter() - start
+
+    def stop(self):
+
+        if self.scheduler:
+            self.scheduler.stop()
+
+        if self.recorder:
+            self.recorder.flush()
+
+    def get_frame_stats(self) -> Dict[str, dict]:
+        """Run counts, overruns and durations for the game, network and render loops"""
+
+        if self.scheduler is None:
+            return {}
+
+        stats = self.scheduler.get_stats()
+
+        stats["render"]["last_render_time"] = self.render_time
+
+        return stats
+
+    def run_decoupled(self, max_tick_rate: int, network_tick_rate: int, render_rate: int, max_catch_up_ticks: int = 5):
+        """
+        Simulate at a fixed rate and render at a separate capped rate, sleeping when there is nothing to do
+
+        A slow frame no longer delays the simulation or networking, and a fast machine doesnt simulate faster.
+        With vsync enabled flip() waits for the display, so render_rate should be at least the refresh rate
+        """
+
+        # drawing moves from the end of every tick to its own loop
+        self.event_subscriptions[TickComplete].remove(self.clear_screen)
+        self.event_subscriptions[RenderFrame] += [
+            self.clear_screen
+        ]
+
+        self.trigger(GameStart())
+
+        self.fixed_dt = 1/max_tick_rate
+
+        self.scheduler = TickScheduler()
+
+        self.scheduler.add_task("game", max_tick_rate, self.game_tick, max_catch_up=max_catch_up_ticks)
+
+        self.scheduler.add_task("network", network_tick_rate, self.network_tick, max_catch_up=1)
+
+        # never draw the same state twice just to catch up
+        self.scheduler.add_task("render", render_rate, self.render, max_catch_up=1)
+
+        self.scheduler.run()
+
+    def run(self, max_tick_rate: int, network_tick_rate: int, render_rate: Optional[int] = None):
+
+        if render_rate is not None:
+            self.run_decoupled(max_tick_rate, network_tick_rate, render_rate)
+
+            return
 
         self.trigger(GameStart())
 
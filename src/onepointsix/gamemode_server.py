@@ -1,8 +1,7 @@
 import socket
+import selectors
 import json
-from collections import defaultdict
-from copy import deepcopy
-from typing import List, Literal, Optional, Type, Dict, Union, Tuple, NewType
+from typing import List, Literal, Optional, Set, Type, Dict, Union, Tuple, NewType
 from types import MethodType
 import time
 import zlib
@@ -12,11 +11,26 @@ from rich import print
 import pygame
 from pygame import Rect
 
-from onepointsix import headered_socket
-from onepointsix.headered_socket import Disconnected
+from onepointsix import headered_socket, handshake
+from onepointsix.headered_socket import Disconnected, InvalidHeader
 from onepointsix.exceptions import MalformedUpdate, InvalidUpdateType
-from onepointsix.events import Tick, Event, DisconnectedClient, NewClient, ReceivedClientUpdates, UpdatesLoaded, ServerStart, TickStart, TickComplete, NetworkTick, ResourcesLoaded, GameStart
+from onepointsix.events import Tick, Event, DisconnectedClient, NewClient, ClientJoined, ReceivedClientUpdates, UpdatesLoaded, ServerStart, TickStart, TickComplete, NetworkTick, ResourcesLoaded, GameStart
 from onepointsix.entity import Entity
+from onepointsix.codec import CODECS, get_codec
+from onepointsix.scheduler import TickScheduler
+from onepointsix.dispatch import EventSubscriptions
+from onepointsix.update_batch import BatchedUpdateQueue, UpdateBatch
+from onepointsix.interest import InterestManager
+from onepointsix.spatial import SpatialIndex
+from onepointsix.registry import EntityRegistry, EntityTypeMap
+from onepointsix.references import PendingReferences
+from onepointsix.relay import RelayCache
+from onepointsix.snapshots import REPLICATION_MODES, SnapshotReplicator
+from onepointsix.udp_transport import TRANSPORTS, UdpEndpoint
+from onepointsix.backpressure import Backpressure
+from onepointsix.joining import JOIN_MODES, LIVE, STREAMING_STATE, JoiningClient, WorldSnapshot, world_begin, world_end
+from onepointsix.recording import DISCONNECTED, DT, HELLO, NETWORK_TICK, RECEIVED, SENT, TICK, Recorder
+from onepointsix.compression import COMPRESSION_MODES, NoCompression, OneShotCompression, get_compression
 
 
 class GamemodeServer:
@@ -30,27 +44,95 @@ class GamemodeServer:
     Basically only exists to simplify networking
     """
 
-    def __init__(self, server_ip: str = socket.gethostname(), server_port: int = 5560, network_compression: bool = True):
+    def __init__(self, server_ip: str = socket.gethostname(), server_port: int = 5560, network_compression: bool = True, network_codec: str = "binary", compression_mode: str = "stream", compression_level: int = zlib.Z_BEST_SPEED, io_mode: str = "poll", interest_radius: Optional[float] = None, spatial_cell_size: float = 256, relay_mode: bool = False, relay_fold_bytes: int = 1024 * 1024, replication: str = "stream", transport: str = "tcp", simulated_loss: float = 0, simulated_latency: float = 0, send_high_watermark: int = 1024 * 1024, send_low_watermark: int = 256 * 1024, slow_client_policy: str = "compact", handshake_timeout: float = 10, join_chunk_size: int = 256, join_chunk_bytes: int = 256 * 1024, join_chunks_per_tick: int = 4, recording_path: Optional[str] = None):
 
         pygame.init()
 
-        self.socket = headered_socket.HeaderedSocket(socket.AF_INET, socket.SOCK_STREAM)
+        if transport not in TRANSPORTS:
+            raise ValueError(f"transport must be one of {TRANSPORTS}, not {transport}")
+
+        # every udp client shares one socket, so there is nothing for a selector to tell apart
+        if transport == "udp" and io_mode != "poll":
+            raise ValueError("the udp transport only works with io_mode 'poll'")
+
+        self.transport = transport
+
+        if transport == "udp":
+            # loss and latency are simulated on everything we send, for testing over loopback
+            self.socket = UdpEndpoint(loss=simulated_loss, latency=simulated_latency)
+
+        else:
+            self.socket = headered_socket.HeaderedSocket(socket.AF_INET, socket.SOCK_STREAM)
 
         self.client_sockets: Dict[str, headered_socket.HeaderedSocket] = {}
+        self.joining_clients: List[JoiningClient] = [] # connections that havent sent their hello yet
+        self.streaming_clients: Dict[str, JoiningClient] = {} # clients that are being sent the world, nothing else is sent to them until that is done
+        self.clients_to_introduce: List[str] = [] # clients that finished their handshake, they are sent the world once what arrived before them is loaded
+        self.handshake_timeout = handshake_timeout # seconds a new connection gets to send its hello
+        self.join_chunk_size = join_chunk_size # most entities in one chunk of the world
+        self.join_chunk_bytes = join_chunk_bytes # chunks are split until they encode to at most this many bytes
+        self.join_chunks_per_tick = join_chunks_per_tick
+        self.world_snapshot: Optional[WorldSnapshot] = None # the world as it was last sent to a joining client, reused until something changes
+        self.frames_received = 0
+        self.recorder: Optional[Recorder] = Recorder(recording_path) if recording_path else None # every frame we send and receive, for replaying later
         self.entities: Dict[str, Entity] = {}
-        self.entity_type_map: Dict[str, Type[Entity]] = {}
+        self.dirty_entities: Dict[str, Entity] = {} # entities that were created or had networked fields assigned, the server doesnt diff so it is cleared every tick
+        self.entity_type_map = EntityTypeMap()
+        self.entity_registry: EntityRegistry = EntityRegistry() # entities grouped by class
+        self.pending_references: PendingReferences = PendingReferences(self) # entities waiting for the entities they point at to be created
         self.updates_to_load: List[dict] = []
         self.uuid = "server"
         self.server_clock = pygame.time.Clock()
-        self.update_queue: defaultdict[str, List[dict]] = defaultdict(list)
-        self.event_subscriptions: defaultdict[Type[Event], list] = defaultdict(list)
+        self.update_queue: BatchedUpdateQueue = BatchedUpdateQueue() # clients that get the same updates share one batch, which is only encoded once
+        self.backpressure: Backpressure = Backpressure(self, send_high_watermark, send_low_watermark, slow_client_policy) # what to do with clients that cant keep up
+        self.waiting_to_write: Set[str] = set() # clients the selector is also watching for writability, because their send buffer isnt empty
+        self.event_subscriptions: EventSubscriptions = EventSubscriptions(self)
+        self.spatial_index: SpatialIndex = SpatialIndex(self, spatial_cell_size) # entities with a position, for proximity queries
         self.server_ip = server_ip
         self.server_port = server_port
         self.tick_count = 0
         self.last_tick = time.time()
         self.network_compression = network_compression
+        self.codec = get_codec(network_codec) # preferred codec, clients that dont support it fall back to something they do
+        self.compression_mode = compression_mode if network_compression else "none"
+        self.compression_level = compression_level
         self.resources: Dict[str, pygame.Surface] = {}
         self.dt = 0.1 # i am initializing this with 0.1 instead of 0 because i think it might break stuff
+        self.io_mode = io_mode
+        self.selector: Optional[selectors.BaseSelector] = None
+        self.scheduler: Optional[TickScheduler] = None
+        self.fixed_dt: Optional[float] = None # when set, every tick simulates exactly this many seconds
+        self.interest: Optional[InterestManager] = None # when set, clients only get entities near their focus entities
+
+        self.relay_cache: Optional[RelayCache] = None # when set, client frames are forwarded without being decoded or loaded
+
+        if interest_radius is not None:
+            self.interest = InterestManager(self, interest_radius)
+
+        if relay_mode:
+
+            # filtering by area needs to know where entities are, which means loading them
+            if interest_radius is not None:
+                raise ValueError("relay_mode cant be used with interest_radius")
+
+            self.relay_cache = RelayCache(relay_fold_bytes)
+
+        self.replication = replication
+        self.snapshots: Optional[SnapshotReplicator] = None # sends clients that support it deltas against the last snapshot they acked
+
+        if replication not in REPLICATION_MODES:
+            raise ValueError(f"replication must be one of {REPLICATION_MODES}, not {replication}")
+
+        if replication == "snapshot":
+
+            # snapshots are made from loaded entities, and go to every client whole
+            if relay_mode or interest_radius is not None:
+                raise ValueError("snapshot replication cant be used with relay_mode or interest_radius")
+
+            self.snapshots = SnapshotReplicator(self)
+
+        if io_mode not in ["poll", "selector"]:
+            raise ValueError(f"io_mode must be 'poll' or 'selector', not {io_mode}")
 
         self.event_subscriptions[ReceivedClientUpdates] += [
             self.load_updates
@@ -60,6 +142,23 @@ class GamemodeServer:
             self.load_resources
         ]
 
+        # before anything else, so new clients are set up by the time the rest runs
+        self.event_subscriptions[UpdatesLoaded] += [
+            self.introduce_new_clients
+        ]
+
+        if self.interest:
+            # entities that entered or left someones area have to be queued before we send
+            self.event_subscriptions[UpdatesLoaded] += [
+                self.interest.update_interest
+            ]
+
+        if self.snapshots:
+            # serializing the whole world is too much to do every game tick, they go out with the next send
+            self.event_subscriptions[NetworkTick] += [
+                self.snapshots.send_snapshots
+            ]
+
         self.event_subscriptions[UpdatesLoaded] += [
             self.send_client_updates
         ]
@@ -68,47 +167,92 @@ class GamemodeServer:
             self.enable_socket
         ]
 
+        if self.recorder:
+            # marks where network ticks happened, so a replay runs them at the same points
+            self.event_subscriptions[NetworkTick] += [
+                self.record_network_tick
+            ]
+
         self.event_subscriptions[NewClient] += [
             self.handle_new_client
         ]
 
-        self.event_subscriptions[Tick] += [
-            self.increment_tick_counter,
-            self.accept_new_clients,
-            self.receive_client_updates 
-        ]
+        if io_mode == "selector":
+            # only wake up for sockets that actually have something for us
+            self.selector = selectors.DefaultSelector()
+
+            self.event_subscriptions[Tick] += [
+                self.increment_tick_counter,
+                self.advance_joining_clients,
+                self.poll_sockets
+            ]
+
+        else:
+            self.event_subscriptions[Tick] += [
+                self.increment_tick_counter,
+                self.accept_new_clients,
+                self.advance_joining_clients,
+                self.receive_client_updates 
+            ]
 
         self.event_subscriptions[TickStart] += [
-            self.measure_dt
+            self.measure_dt,
+            self.refresh_spatial_index
+        ]
+
+        if self.recorder:
+            # after measure_dt, so a replay can simulate each tick with the dt it had
+            self.event_subscriptions[TickStart] += [
+                self.record_tick
+            ]
+
+        self.event_subscriptions[TickComplete] += [
+            self.forget_dirty_entities
         ]
     
+    @property
+    def entity_type_map(self) -> EntityTypeMap:
+        return self._entity_type_map
+
+    @entity_type_map.setter
+    def entity_type_map(self, entity_type_map: Dict[str, Type[Entity]]):
+        # keep the reverse lookup working if a game assigns a plain dict
+        self._entity_type_map = EntityTypeMap(entity_type_map)
+
     def measure_dt(self, event: TickStart):
         """Measure the time since the last tick and update self.dt"""
-        self.dt = time.time() - self.last_tick
+        if self.fixed_dt is not None:
+            self.dt = self.fixed_dt
+        else:
+            self.dt = time.time() - self.last_tick
 
         self.last_tick = time.time()
 
+    def refresh_spatial_index(self, event: TickStart):
+        """Move entities that were created, updated or changed networked fields last tick to the cells they ended up in"""
+
+        self.spatial_index.refresh()
+
     def enable_socket(self, event: ServerStart):
         self.socket.bind((self.server_ip, self.server_port))
         self.socket.setblocking(False)
         self.socket.listen(5)
 
+        if self.selector:
+            self.selector.register(self.socket, selectors.EVENT_READ)
+
         print("server online...")
 
-    def trigger(self, event: Event):
+    def kill_entities(self, entities: List[Entity]):
+        """Kill a group of entities, each one only costs as much as its own listeners"""
 
-        for function in self.event_subscriptions[type(event)]:
-            if function.__self__.__class__.__base__ == GamemodeServer:
-                # if the object this listener function belongs to has a base class that is GamemodeServer, then we don't need to check if we should run it
-                # this is because we never receive other user's GamemodeServer objects
+        for entity in entities:
+            entity.kill()
 
-                # we need to do this check because the GamemodeServer object does not have an "updater" attribute
-                pass
-            # dont call function if the entity this function belongs to isnt ours
-            elif function.__self__.updater != self.uuid:
-                continue
-            
-            function(event) 
+    def trigger(self, event: Event):
+
+        # the dispatch table only contains listeners that belong to us, so there is nothing to check here
+        self.event_subscriptions.dispatch(event)
 
     def network_update(self, update_type: Union[Literal["create"], Literal["update"], Literal["delete"]], entity_id: str, destinations: Optional[List[str]] = None, data: Optional[dict] = None, entity_type_string: Optional[str] = None):
         """Queue up a network update for specified client uuid(s)"""
@@ -123,18 +267,28 @@ class GamemodeServer:
             raise MalformedUpdate(f"Entity type {entity_type_string} does not exist in the entity type map")
 
         # if no destinations are specified, we just send the update to all connected clients
-        if destinations is None:
+        if destinations is None and self.interest:
+            # or only the ones that know about the entity, new entities are sent once they are in someones area
+            destinations = self.interest.interested_clients(entity_id)
+
+        elif destinations is None:
             destinations = list(self.client_sockets.keys())
 
+        # snapshot clients get every change from the next snapshot instead
+        if self.snapshots:
+            destinations = [destination for destination in destinations if not self.snapshots.is_snapshot_client(destination)]
+
+        if update_type == "delete" and self.interest:
+            self.interest.forget_entity(entity_id)
+
         update = {
             "update_type": update_type,
             "entity_id": entity_id,
             "entity_type": entity_type_string,
             "data": data
         }
-        
-        for destination in destinations:
-            self.update_queue[destination].append(update)
+
+        self.update_queue.queue(update, destinations)
     
     def load_resources(self, event: GameStart):
         for sprite_path in pathlib.Path("resources").rglob("*.png"):
@@ -147,14 +301,13 @@ class GamemodeServer:
 
     def load_updates(self, event: ReceivedClientUpdates):
 
-        for update in deepcopy(self.updates_to_load):
+        # these are the same dicts that are queued to be relayed, deserialize() and update() only read them
+        for update in self.updates_to_load:
             
             match update["update_type"]:
 
                 case "create":
 
-                    print(f"created entity {update['entity_id']}")
-
                     entity_class = self.entity_type_map[
                         update["entity_type"]
                     ]
@@ -165,7 +318,9 @@ class GamemodeServer:
                         game=self
                     )
                     
-                    entity_class(game=self, id=update["entity_id"], **deserialized_data)
+                    new_entity = entity_class(game=self, id=update["entity_id"], **deserialized_data)
+
+                    self.pending_references.track(new_entity)
 
                 case "update":
 
@@ -181,11 +336,11 @@ class GamemodeServer:
                         update["data"]
                     )
 
-                case "delete":
+                    self.spatial_index.entity_changed(updating_entity)
 
-                    print(f"deleting entity {update['entity_id']} {self.tick_count}")
+                    self.pending_references.track(updating_entity)
 
-                    print(self.updates_to_load)
+                case "delete":
 
                     try:
                         self.entities[update["entity_id"]].kill()
@@ -197,90 +352,416 @@ class GamemodeServer:
 
         self.updates_to_load = []
 
-        for entity in self.entities.values():
-
-            entity.resolve()
+        # references were resolved as their entities were created, this just warns about ones that never will be
+        self.pending_references.check_stale()
 
         self.trigger(UpdatesLoaded())
 
     def lookup_entity_type_string(self, entity: Entity) -> Optional[str]:
         """Find entity type's corresponding type string in entity_type_map"""
 
-        entity_type_string = None
+        # this allows looking up an instance of an entity or just the class of an entity
+        entity_type = entity if isinstance(entity, type) else type(entity)
 
-        for possible_entity_type_string, entity_type in self.entity_type_map.items():
-            if type(entity) is entity_type or entity is entity_type: # this allows looking up an instance of an entity or just the class of an entity
-                entity_type_string = possible_entity_type_string
-        
-        if entity_type_string ==  None:
-            raise KeyError(f"Entity type {type(entity)} does not exist in entity type map")
-    
-        else:
-            return entity_type_string
+        try:
+            return self.entity_type_map.type_strings[entity_type]
+
+        except KeyError:
+            raise KeyError(f"Entity type {entity_type} does not exist in entity type map")
 
         
     def handle_new_client(self, event: NewClient):
+        """Start the handshake with a connection we just accepted, its hello is read whenever it arrives"""
 
         print("New connecting client")
 
-        # make server socket blocking temporarily, because we need this data now
-        event.new_client.setblocking(True)
+        event.new_client.setblocking(False)
 
-        client_uuid = event.new_client.recv_headered().decode("utf-8")
+        joining_client = JoiningClient(event.new_client, time.time())
 
-        event.new_client.setblocking(False)
+        self.joining_clients.append(joining_client)
 
-        self.client_sockets[client_uuid] = event.new_client
+        if self.selector:
+            self.selector.register(event.new_client, selectors.EVENT_READ, data=joining_client)
 
-        if len(self.entities) == 0:
-            
-            empty_update = json.dumps([])
+    def advance_joining_clients(self, event: Tick):
+        """Read hellos, drop connections that took too long to send one, and stream the next chunk of the world to clients that are joining"""
 
-            empty_update_bytes = bytes(empty_update, "utf-8")
+        for joining_client in list(self.joining_clients):
 
-            if self.network_compression:
-                empty_update_bytes = zlib.compress(empty_update_bytes, zlib.Z_BEST_COMPRESSION)
+            # the selector tells us when there is something to read
+            if not self.selector:
+                self.receive_hello(joining_client)
 
-            event.new_client.send_headered(
-                empty_update_bytes
-            )
+            if joining_client in self.joining_clients and time.time() - joining_client.started > self.handshake_timeout:
+                self.abandon_join(joining_client, "did not finish the handshake")
 
-            print("no entities, sending empty update")
+        for joining_client in list(self.streaming_clients.values()):
+            self.stream_initial_state(joining_client)
+
+    def receive_hello(self, joining_client: JoiningClient):
+
+        connection = joining_client.connection
+
+        try:
+            # the hello always has the ascii header, which is what a new connection reads
+            frames = connection.recv_frames()
+
+            client_uuid, options = handshake.decode_hello(bytes(frames[0]))
+
+        except BlockingIOError:
+            return
+
+        except (Disconnected, InvalidHeader, handshake.InvalidHandshake, ValueError):
+            self.abandon_join(joining_client, "sent an invalid hello or disconnected")
+
+            return
+
+        if client_uuid in self.client_sockets:
+            self.abandon_join(joining_client, f"used uuid {client_uuid}, which is already connected")
+
+            return
+
+        if self.recorder:
+            self.recorder.record(HELLO, self.tick_count, client_uuid, payload=bytes(frames[0]))
+
+        self.configure_connection(connection, options)
+
+        self.joining_clients.remove(joining_client)
+
+        self.client_sockets[client_uuid] = connection
+
+        if self.selector:
+            self.selector.modify(connection, selectors.EVENT_READ, data=client_uuid)
+
+        self.clients_to_introduce.append(client_uuid)
+
+    def abandon_join(self, joining_client: JoiningClient, reason: str):
+
+        print(f"New client {reason}, dropping it")
+
+        self.joining_clients.remove(joining_client)
+
+        if self.selector:
+            self.selector.unregister(joining_client.connection)
+
+        joining_client.connection.close()
+
+    def configure_connection(self, client_socket: headered_socket.HeaderedSocket, options: Optional[dict]):
+        """Set up the wire options for a client from the options it sent in its hello"""
+
+        # legacy clients just send their uuid and expect json
+        if options is not None:
+            self.negotiate_connection(client_socket, options)
+
+        elif self.network_compression:
+            client_socket.compression = OneShotCompression(self.compression_level)
 
         else:
-            for entity in self.entities.values():
+            client_socket.compression = NoCompression()
 
-                entity_type_string = self.lookup_entity_type_string(entity)
-                
-                data = entity.serialize()
+    def introduce_new_clients(self, event: UpdatesLoaded):
+        """
+        Start sending the world to clients that finished their handshake since the last time updates were loaded
+
+        Frames that arrived before a client's hello were relayed to everyone else but not loaded yet,
+        so its snapshot is only made now that they are
+        """
+
+        client_uuids = [client_uuid for client_uuid in self.clients_to_introduce if client_uuid in self.client_sockets]
+
+        self.clients_to_introduce = []
+
+        # whatever was relayed to them in the meantime is part of the world they are about to get
+        for client_uuid in client_uuids:
+            self.update_queue.take(client_uuid)
+
+        for client_uuid in client_uuids:
+            self.send_initial_state(client_uuid)
+
+    def send_initial_state(self, client_uuid: str):
+        """
+        Start sending the world to a client that just finished its handshake
+
+        The world is sent as a WorldSnapshot, a few chunks per tick, and nothing else is sent to the client until
+        every chunk is out, so the updates queued for it in the meantime are applied on top of the snapshot.
+        Clients that joined with "chunked" get world_begin and world_end around the chunks
+        """
+
+        client_socket = self.client_sockets[client_uuid]
+
+        if client_socket.replication == "snapshot":
+            self.snapshots.send_initial_snapshot(client_uuid)
 
-                self.network_update(update_type="create", entity_id=entity.id, data=data, entity_type_string=entity_type_string, destinations=[client_uuid])
-                
             self.send_client_updates()
 
+            self.trigger(ClientJoined(client_uuid))
+
+            return
+
+        snapshot = self.world_snapshot_for(client_uuid)
+
+        if client_socket.join == "chunked":
+            self.send_updates_now(client_uuid, [world_begin(snapshot.entity_count, len(snapshot.chunks))])
+
+        elif snapshot.entity_count == 0:
+            # the client waits for its first frame before it starts playing
+            self.send_updates_now(client_uuid, [])
+
+            print("no entities, sending empty update")
+
+        joining_client = JoiningClient(client_socket, time.time())
+
+        joining_client.state = STREAMING_STATE
+        joining_client.client_uuid = client_uuid
+        joining_client.snapshot = snapshot
+
+        self.streaming_clients[client_uuid] = joining_client
+
+        self.stream_initial_state(joining_client)
+
+    def world_snapshot_for(self, client_uuid: str) -> WorldSnapshot:
+        """The world as a joining client should get it, made once and shared by everyone that joins before anything changes"""
+
+        # everyone gets something different when they only get what is near them
+        if self.interest:
+            return self.make_world_snapshot(self.interest.introduce(client_uuid))
+
+        made_at = (self.tick_count, self.frames_received)
+
+        if self.world_snapshot is None or self.world_snapshot.made_at != made_at:
+
+            self.world_snapshot = self.make_world_snapshot(list(self.entities.values()))
+
+            self.world_snapshot.made_at = made_at
+
+        return self.world_snapshot
+
+    def make_world_snapshot(self, entities: List[Entity]) -> WorldSnapshot:
+
+        creates = [
+            {
+                "update_type": "create",
+                "entity_id": entity.id,
+                "entity_type": self.lookup_entity_type_string(entity),
+                "data": entity.serialize()
+            }
+            for entity in entities
+        ]
+
+        # entities clients told us about when we are just relaying
+        if self.relay_cache:
+            creates += self.relay_cache.snapshot()
+
+        return WorldSnapshot(creates, self.codec, self.join_chunk_size, self.join_chunk_bytes)
+
+    def stream_initial_state(self, joining_client: JoiningClient):
+        """Send the next few chunks of the world to a joining client"""
+
+        client_uuid = joining_client.client_uuid
+        connection = joining_client.connection
+
+        if self.client_sockets.get(client_uuid) is not connection:
+            # it disconnected before it got everything
+            del self.streaming_clients[client_uuid]
+
+            return
+
+        # dont pile more onto a connection that isnt keeping up with what it already has
+        if connection.pending_bytes > self.backpressure.low_watermark:
+            return
+
+        chunks = joining_client.snapshot.chunks
+
+        for chunk in chunks[joining_client.next_chunk:joining_client.next_chunk + self.join_chunks_per_tick]:
+
+            self.send_batch(client_uuid, chunk)
+
+            joining_client.next_chunk += 1
+
+        if joining_client.next_chunk < len(chunks):
+            return
+
+        if connection.join == "chunked":
+            self.send_updates_now(client_uuid, [world_end()])
+
+        joining_client.state = LIVE
+
+        # everything that was queued while the world was being sent goes out with the next send_client_updates
+        del self.streaming_clients[client_uuid]
+
+        self.trigger(ClientJoined(client_uuid))
+
+    def send_updates_now(self, client_uuid: str, updates: List[dict]):
+        """Send updates to one client as their own frame, without queueing them"""
+
+        self.send_batch(client_uuid, UpdateBatch(frozenset(), updates))
+
+    def send_batch(self, client_uuid: str, batch: UpdateBatch):
+
+        client_socket = self.client_sockets[client_uuid]
+
+        if self.recorder:
+            self.recorder.record(SENT, self.tick_count, client_uuid, client_socket.codec.name, batch.encode(client_socket.codec))
+
+        # udp connections send entity updates unreliably, so the batch is split in two, which is shared like the encoding
+        if client_socket.supports_unreliable:
+            client_socket.send_batch(batch)
+
+            return
+
+        client_socket.send_headered(
+            batch.payload_for(client_socket)
+        )
+
+    def negotiate_connection(self, client_socket: headered_socket.HeaderedSocket, options: dict):
+        """Pick the wire options for a newly connected client and tell the client which ones we picked"""
+
+        codec_name = handshake.pick_option(
+            offered=options.get("codecs", []),
+            supported=list(CODECS.keys()),
+            preferred=self.codec.name
+        )
+
+        if codec_name is None:
+            codec_name = "json"
+
+        # datagrams can be lost or reordered, so over udp every payload has to decompress on its own
+        offered_compression = [
+            mode for mode in options.get("compression", ["oneshot"])
+            if not client_socket.supports_unreliable or COMPRESSION_MODES.get(mode, NoCompression).shareable
+        ]
+
+        compression_mode = handshake.pick_option(
+            offered=offered_compression,
+            supported=list(COMPRESSION_MODES.keys()),
+            preferred=self.compression_mode
+        )
+
+        if compression_mode is None:
+            compression_mode = "none"
+
+        header_format = handshake.pick_option(
+            offered=options.get("headers", ["ascii"]),
+            supported=headered_socket.HEADER_FORMATS,
+            preferred="binary"
+        )
+
+        if header_format is None:
+            header_format = "ascii"
+
+        replication = "stream"
+
+        if self.snapshots and "snapshot" in options.get("replication", []):
+            replication = "snapshot"
+
+        # older clients dont know about world_begin and world_end, they just get the chunks
+        join = handshake.pick_option(
+            offered=options.get("join", []),
+            supported=JOIN_MODES,
+            preferred="chunked"
+        )
+
+        # snapshot clients join with a whole snapshot instead, which never has the markers around it
+        if replication == "snapshot":
+            join = None
+
+        client_socket.codec = get_codec(codec_name)
+        client_socket.compression = get_compression(compression_mode, self.compression_level)
+        client_socket.replication = replication
+        client_socket.join = join
+
+        client_socket.send_headered(
+            handshake.encode_reply(
+                {
+                    "codec": codec_name,
+                    "compression": compression_mode,
+                    "header": header_format,
+                    "replication": replication,
+                    "join": join
+                }
+            )
+        )
+
+        # the reply has to go out with the old header, everything after it uses the new one
+        client_socket.header_format = header_format
+
+    def get_compression_stats(self) -> Dict[str, dict]:
+        """Compression ratio and cpu time for every connected client"""
+
+        return {
+            client_uuid: client_socket.compression.stats.as_dict() for client_uuid, client_socket in self.client_sockets.items()
+        }
+
     def increment_tick_counter(self, event: Tick):
         self.tick_count += 1
 
+    def forget_dirty_entities(self, event: TickComplete):
+        """Entities mark themselves dirty on the server too, but nothing here diffs them"""
+
+        for entity in self.dirty_entities.values():
+            entity.dirty_fields.clear()
+
+        self.dirty_entities.clear()
+
     def handle_client_disconnect(self, event: DisconnectedClient):
         
         disconnected_client_uuid = event.disconnected_client_uuid
+
+        # disconnect_client already forgot it
+        if disconnected_client_uuid not in self.client_sockets:
+            return
         
         for entity_uuid, entity in self.entities.copy().items():
 
             if entity.updater == disconnected_client_uuid:
                 del self.entities[entity_uuid]
 
+                self.entity_registry.remove(entity)
+
+                self.spatial_index.remove(entity_uuid)
+
+                self.pending_references.entity_killed(entity)
+
                 self.network_update(
                     update_type="delete",
                     entity_id=entity_uuid,
                     destinations=list(self.client_sockets.keys())
                 )
         
+        if self.relay_cache:
+
+            for entity_uuid in self.relay_cache.owned_by(disconnected_client_uuid):
+
+                self.relay_cache.remove(entity_uuid)
+
+                self.network_update(
+                    update_type="delete",
+                    entity_id=entity_uuid,
+                    destinations=list(self.client_sockets.keys())
+                )
+
         print(f"{disconnected_client_uuid} disconnected")
         
-        del self.client_sockets[disconnected_client_uuid]
+        client_socket = self.client_sockets.pop(disconnected_client_uuid)
 
-        del self.update_queue[disconnected_client_uuid]
+        # before closing it, a selector cant unregister a closed socket
+        if self.selector:
+            self.selector.unregister(client_socket)
+
+            self.waiting_to_write.discard(disconnected_client_uuid)
+
+        client_socket.close()
+
+        self.update_queue.pop(disconnected_client_uuid)
+
+        self.backpressure.remove_client(disconnected_client_uuid)
+
+        if self.interest:
+            self.interest.forget_client(disconnected_client_uuid)
+
+        if self.snapshots:
+            self.snapshots.remove_client(disconnected_client_uuid)
         
     def accept_new_clients(self, event: Tick):
 
@@ -295,80 +776,261 @@ class GamemodeServer:
     def receive_client_updates(self, event: Tick):
 
         for sending_client_uuid, sending_client in self.client_sockets.copy().items():
-            
-            try:
-                
-                incoming_updates_bytes = sending_client.recv_headered()
+            self.receive_from_client(sending_client_uuid, sending_client)
+        
+        self.trigger(ReceivedClientUpdates())
 
-            except Disconnected:
+    def poll_sockets(self, event: Tick):
+        """Accept and receive only from the sockets the selector says are ready"""
 
-                self.trigger(DisconnectedClient(sending_client_uuid))
+        for key, mask in self.selector.select(timeout=0):
+
+            if key.fileobj is self.socket:
+                self.accept_pending_clients()
 
                 continue
 
-            except BlockingIOError:
+            # connections that are still handshaking only register to read their hello
+            if isinstance(key.data, JoiningClient):
+
+                if key.data in self.joining_clients:
+                    self.receive_hello(key.data)
+
                 continue
 
-            if self.network_compression:
-                incoming_updates_bytes = zlib.decompress(incoming_updates_bytes)
+            # the client may have been dropped by an earlier event in this loop
+            if key.data in self.client_sockets and mask & selectors.EVENT_WRITE:
+                key.fileobj.flush()
+
+                self.update_write_interest(key.data, key.fileobj)
+
+            if key.data in self.client_sockets and mask & selectors.EVENT_READ:
+                self.receive_from_client(key.data, key.fileobj)
 
-            incoming_updates = json.loads(incoming_updates_bytes.decode("utf-8"))
+        self.trigger(ReceivedClientUpdates())
+
+    def accept_pending_clients(self):
+        """Accept every connection waiting in the listen backlog"""
+
+        while True:
+            try:
+                new_client, address = self.socket.accept()
+
+            except BlockingIOError:
+                return
+
+            self.trigger(NewClient(new_client))
+
+    def receive_from_client(self, sending_client_uuid: str, sending_client: headered_socket.HeaderedSocket):
+
+        try:
             
-            #self.validate_updates
+            frames = sending_client.recv_frames()
 
-            self.updates_to_load += incoming_updates
+        except Disconnected:
 
-            for receiving_client_uuid, receiving_client in self.client_sockets.items():
+            if self.recorder:
+                self.recorder.record(DISCONNECTED, self.tick_count, sending_client_uuid)
 
-                if sending_client_uuid is receiving_client_uuid:
-                    continue
-                
-                #print(self.update_queue[receiving_client_uuid])
+            self.trigger(DisconnectedClient(sending_client_uuid))
 
-                self.update_queue[receiving_client_uuid] += incoming_updates
-        
-        self.trigger(ReceivedClientUpdates())
+            return
+
+        except BlockingIOError:
+            return
+
+        for frame in frames:
+            self.handle_client_frame(sending_client_uuid, sending_client, frame)
+
+    def handle_client_frame(self, sending_client_uuid: str, sending_client: headered_socket.HeaderedSocket, frame: memoryview):
+        """Decode one frame of updates from a client and relay it to everyone else"""
+
+        incoming_updates_bytes = sending_client.compression.decompress(frame)
+
+        # a snapshot of the world made before this frame is out of date
+        self.frames_received += 1
+
+        if self.recorder:
+            self.recorder.record(RECEIVED, self.tick_count, sending_client_uuid, sending_client.codec.name, incoming_updates_bytes)
+
+        if self.relay_cache:
+            self.relay_frame(sending_client_uuid, sending_client, incoming_updates_bytes)
+
+            return
+
+        incoming_updates = sending_client.codec.decode(incoming_updates_bytes)
+
+        self.validate_updates(incoming_updates)
+
+        if self.snapshots:
+            incoming_updates = self.snapshots.take_acks(sending_client_uuid, incoming_updates)
+
+        self.updates_to_load += incoming_updates
+
+        if self.interest:
+            self.interest.relay(incoming_updates, sending_client_uuid)
+
+            return
+
+        # everyone except the sender gets the same batch, snapshot clients get it in the next snapshot
+        receiving_client_uuids = [
+            receiving_client_uuid for receiving_client_uuid, receiving_client in self.client_sockets.items()
+            if receiving_client_uuid != sending_client_uuid and receiving_client.replication == "stream"
+        ]
+
+        self.update_queue.queue(incoming_updates, receiving_client_uuids)
+
+    def validate_updates(self, updates):
+        """Make sure a frame from a client is something load_updates can load, so a bad one fails here and not halfway through loading a tick"""
+
+        if type(updates) is not list:
+            raise MalformedUpdate(f"Expected a list of updates, got {type(updates).__name__}")
+
+        for update in updates:
+
+            if type(update) is not dict or "update_type" not in update or "entity_id" not in update:
+                raise MalformedUpdate(f"Update {update} is missing update_type or entity_id")
+
+            # deletes dont carry any data
+            if update["update_type"] in ("create", "update") and type(update.get("data")) is not dict:
+                raise MalformedUpdate(f"{update['update_type']} update for {update['entity_id']} has no data")
+
+            if update["update_type"] == "create" and update.get("entity_type") not in self.entity_type_map:
+                raise MalformedUpdate(f"Entity type {update.get('entity_type')} does not exist in the entity type map")
+
+    def relay_frame(self, sending_client_uuid: str, sending_client: headered_socket.HeaderedSocket, incoming_updates_bytes: bytes):
+        """Forward an encoded frame to everyone else without decoding it, clients using the same codec get the same bytes"""
+
+        self.relay_cache.record(sending_client.codec, incoming_updates_bytes)
+
+        receiving_client_uuids = [
+            receiving_client_uuid for receiving_client_uuid in self.client_sockets.keys() if receiving_client_uuid != sending_client_uuid
+        ]
+
+        self.update_queue.queue_encoded(sending_client.codec, incoming_updates_bytes, receiving_client_uuids)
+
+    def update_write_interest(self, client_uuid: str, client_socket: headered_socket.HeaderedSocket):
+        """Have the selector tell us when a client's socket can take more, but only while we have something for it"""
+
+        if not self.selector:
+            return
+
+        wants_write = client_socket.pending_bytes > 0
+
+        if wants_write == (client_uuid in self.waiting_to_write):
+            return
+
+        if wants_write:
+            self.selector.modify(client_socket, selectors.EVENT_READ | selectors.EVENT_WRITE, data=client_uuid)
+
+            self.waiting_to_write.add(client_uuid)
+
+        else:
+            self.selector.modify(client_socket, selectors.EVENT_READ, data=client_uuid)
+
+            self.waiting_to_write.discard(client_uuid)
+
+    def disconnect_client(self, client_uuid: str):
+        """Cut a client off and forget it straight away, the same way as if it had disconnected itself"""
+
+        print(f"disconnecting {client_uuid}")
+
+        # handle_client_disconnect closes it once the rest of the server is done with it
+        self.client_sockets[client_uuid].shutdown(socket.SHUT_RDWR)
+
+        self.update_queue.take(client_uuid)
+
+        if self.recorder:
+            self.recorder.record(DISCONNECTED, self.tick_count, client_uuid)
+
+        self.trigger(DisconnectedClient(client_uuid))
+
+        # games dont have to subscribe handle_client_disconnect, but the client has to be gone either way
+        self.handle_client_disconnect(DisconnectedClient(client_uuid))
+
+    def record_network_tick(self, event: NetworkTick):
+        self.recorder.record(NETWORK_TICK, self.tick_count)
+
+    def record_tick(self, event: TickStart):
+        self.recorder.record(TICK, self.tick_count, payload=DT.pack(self.dt))
+
+    def get_send_stats(self) -> Dict[str, dict]:
+        """Bytes waiting in each client's send buffer, how much is queued for it and whether it is congested"""
+
+        return self.backpressure.get_stats()
 
     def send_client_updates(self, event: Optional[ReceivedClientUpdates] = None):
         """Actually send queued network updates"""
 
-        for receiving_client_uuid, updates in self.update_queue.copy().items():
+        # in poll mode this is where send buffers get drained, the selector does it as soon as sockets are writable
+        if not self.selector:
+            for client_socket in self.client_sockets.values():
+                if client_socket.pending_bytes:
+                    client_socket.flush()
 
-            if updates == []:
+        for receiving_client_uuid, batches in list(self.update_queue.items()):
+
+            if batches == []:
                 # if there are no updates to send, dont send anything
                 continue
             
-            updates_json = json.dumps(updates)
-            
-            updates_json_bytes = bytes(updates_json, "utf-8")
+            # updates for clients that are still being sent the world wait until they have all of it
+            if receiving_client_uuid in self.streaming_clients:
+                self.update_queue.hold(receiving_client_uuid)
 
-            if self.network_compression:
-                updates_json_bytes = zlib.compress(updates_json_bytes, zlib.Z_BEST_COMPRESSION)
+                continue
 
-            self.client_sockets[receiving_client_uuid].send_headered(
-                updates_json_bytes
-            )
-        
-            self.update_queue[receiving_client_uuid] = []
+            receiving_client = self.client_sockets[receiving_client_uuid]
+
+            # clients that arent keeping up get their updates compacted, dropped or get disconnected instead
+            if self.backpressure.hold(receiving_client_uuid, receiving_client):
+                continue
+
+            # each batch is its own frame, shared batches are only encoded and compressed by the first client that sends them
+            for batch in self.update_queue.take(receiving_client_uuid):
+                self.send_batch(receiving_client_uuid, batch)
+
+            self.update_write_interest(receiving_client_uuid, receiving_client)
             
-    def run(self, max_tick_rate: int, network_tick_rate: int):
+    def game_tick(self):
+
+        self.trigger(TickStart())
+
+        self.trigger(Tick())
+
+        self.trigger(TickComplete())
+
+    def network_tick(self):
+        self.trigger(NetworkTick())
+
+    def get_tick_stats(self) -> Dict[str, dict]:
+        """Run counts, overruns and skipped ticks for the game and network ticks"""
+
+        if self.scheduler is None:
+            return {}
+
+        return self.scheduler.get_stats()
+
+    def run(self, max_tick_rate: int, network_tick_rate: int, max_catch_up_ticks: int = 5):
+        """
+        Run the game at a fixed timestep, sleeping until the next game or network tick is due
+
+        If a tick takes too long we run up to max_catch_up_ticks ticks back to back to catch up,
+        anything beyond that is skipped and counted in get_tick_stats()
+        """
         
         self.trigger(ServerStart())
-        
-        last_network_tick: float = 0
-        last_game_tick: float = 0
 
-        while True:   
-            
-            if time.time() - last_game_tick >= 1/max_tick_rate:
+        self.fixed_dt = 1/max_tick_rate
 
-                self.trigger(TickStart())
+        self.scheduler = TickScheduler()
 
-                self.trigger(Tick())
+        self.scheduler.add_task("game", max_tick_rate, self.game_tick, max_catch_up=max_catch_up_ticks)
 
-                self.trigger(TickComplete())
+        # there is no point sending several network ticks back to back
+        self.scheduler.add_task("network", network_tick_rate, self.network_tick, max_catch_up=1)
 
-            if time.time() - last_network_tick >= 1/network_tick_rate:
-                self.trigger(NetworkTick())
+        self.scheduler.run()
 
-                last_network_tick = time.time()
\ No newline at end of file
+        if self.recorder:
+            self.recorder.flush()
\ No newline at end of file
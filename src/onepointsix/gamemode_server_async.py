@@ -0,0 +1,250 @@
+import asyncio
+import socket
+import zlib
+from typing import Dict, Optional
+
+from rich import print
+
+from onepointsix import handshake
+from onepointsix.headered_socket import Disconnected, InvalidHeader, encode_header, decode_header, header_length
+from onepointsix.codec import Codec, CodecError, JsonCodec
+from onepointsix.compression import Compression, OneShotCompression
+from onepointsix.exceptions import MalformedUpdate
+from onepointsix.events import Tick, NetworkTick, NewClient, DisconnectedClient, ReceivedClientUpdates, ServerStart
+from onepointsix.gamemode_server import GamemodeServer
+from onepointsix.recording import DISCONNECTED, HELLO
+
+
+class StreamConnection:
+    """
+    Asyncio version of a client HeaderedSocket
+
+    Has the same codec, compression and header format attributes and the same send_headered(),
+    so everything in GamemodeServer that sends to clients works with it unchanged
+    """
+
+    supports_unreliable = False
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+
+        self.reader = reader
+        self.writer = writer
+
+        self.codec: Codec = JsonCodec()
+        self.compression: Compression = OneShotCompression(zlib.Z_BEST_COMPRESSION)
+        self.header_format = "ascii"
+        self.replication = "stream"
+        self.join: Optional[str] = None
+
+    def send_headered(self, data, header_size=7):
+
+        # the transport buffers whatever the socket cant take right now
+        self.writer.write(
+            encode_header(len(data), self.header_format, header_size) + data
+        )
+
+    @property
+    def pending_bytes(self) -> int:
+        """Bytes the transport is still holding on to"""
+
+        return self.writer.transport.get_write_buffer_size()
+
+    def flush(self) -> bool:
+        # the event loop writes the transport's buffer out on its own
+        return self.pending_bytes == 0
+
+    def shutdown(self, how: int):
+        # handle_connection sees the stream end and reports the disconnect
+        self.writer.close()
+
+    async def recv_headered(self) -> bytes:
+        """Wait for one complete frame"""
+
+        try:
+            header = await self.reader.readexactly(
+                header_length(self.header_format)
+            )
+
+            payload_length = decode_header(header, self.header_format)
+
+            return await self.reader.readexactly(payload_length)
+
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            raise Disconnected("Remote socket disconnected")
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncGamemodeServer(GamemodeServer):
+    """
+    GamemodeServer running on asyncio
+
+    Every client connection is its own coroutine, and the game tick and network tick are separate tasks.
+    Because nothing blocks, several servers (rooms) can run in the same event loop with serve()
+    """
+
+    def __init__(self, server_ip: str = socket.gethostname(), server_port: int = 5560, network_compression: bool = True, network_codec: str = "binary", compression_mode: str = "stream", compression_level: int = zlib.Z_BEST_SPEED, handshake_timeout: float = 10, interest_radius: Optional[float] = None, spatial_cell_size: float = 256, relay_mode: bool = False, relay_fold_bytes: int = 1024 * 1024, replication: str = "stream", send_high_watermark: int = 1024 * 1024, send_low_watermark: int = 256 * 1024, slow_client_policy: str = "compact", recording_path: Optional[str] = None):
+
+        super().__init__(
+            server_ip=server_ip,
+            server_port=server_port,
+            network_compression=network_compression,
+            network_codec=network_codec,
+            compression_mode=compression_mode,
+            compression_level=compression_level,
+            interest_radius=interest_radius,
+            spatial_cell_size=spatial_cell_size,
+            relay_mode=relay_mode,
+            relay_fold_bytes=relay_fold_bytes,
+            replication=replication,
+            send_high_watermark=send_high_watermark,
+            send_low_watermark=send_low_watermark,
+            slow_client_policy=slow_client_policy,
+            handshake_timeout=handshake_timeout,
+            recording_path=recording_path
+        )
+
+        self.client_sockets: Dict[str, StreamConnection] = {}
+        self.listener: Optional[asyncio.Server] = None
+
+        # accepting, handshaking and receiving are done by the connection coroutines instead of the tick
+        self.event_subscriptions[ServerStart].remove(self.enable_socket)
+        self.event_subscriptions[NewClient].remove(self.handle_new_client)
+        self.event_subscriptions[Tick].remove(self.accept_new_clients)
+        self.event_subscriptions[Tick].remove(self.receive_client_updates)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+
+        print("New connecting client")
+
+        connection = StreamConnection(reader, writer)
+
+        # other clients keep playing while we wait for this one to introduce itself
+        try:
+            hello = await asyncio.wait_for(connection.recv_headered(), timeout=self.handshake_timeout)
+
+            client_uuid, options = handshake.decode_hello(hello)
+
+        except (Disconnected, asyncio.TimeoutError, InvalidHeader, handshake.InvalidHandshake, ValueError):
+            print("Client did not finish the handshake")
+
+            connection.close()
+
+            return
+
+        if client_uuid in self.client_sockets:
+            print(f"New client used uuid {client_uuid}, which is already connected, dropping it")
+
+            connection.close()
+
+            return
+
+        if self.recorder:
+            self.recorder.record(HELLO, self.tick_count, client_uuid, payload=hello)
+
+        self.configure_connection(connection, options)
+
+        self.client_sockets[client_uuid] = connection
+
+        # sent the world on the next network tick, after the frames that came in before it are loaded
+        self.clients_to_introduce.append(client_uuid)
+
+        self.trigger(NewClient(connection))
+
+        try:
+
+            while True:
+
+                try:
+                    frame = await connection.recv_headered()
+
+                except (Disconnected, InvalidHeader):
+                    break
+
+                # the connection may have been dropped while we were waiting
+                if self.client_sockets.get(client_uuid) is not connection:
+                    break
+
+                try:
+                    self.handle_client_frame(client_uuid, connection, frame)
+
+                # a frame that doesnt decompress or decode, or isnt a list of updates
+                except (CodecError, zlib.error, ValueError, KeyError, TypeError, MalformedUpdate) as exception:
+                    print(f"{client_uuid} sent a corrupt frame ({exception!r}), dropping it")
+
+                    break
+
+        finally:
+
+            if self.client_sockets.get(client_uuid) is connection:
+
+                if self.recorder:
+                    self.recorder.record(DISCONNECTED, self.tick_count, client_uuid)
+
+                self.trigger(DisconnectedClient(client_uuid))
+
+                # like disconnect_client, the client has to be gone whether or not the game subscribed handle_client_disconnect
+                self.handle_client_disconnect(DisconnectedClient(client_uuid))
+
+            connection.close()
+
+    async def game_tick_loop(self, max_tick_rate: int):
+
+        await self.tick_loop(max_tick_rate, self.game_tick)
+
+    async def network_tick_loop(self, network_tick_rate: int):
+
+        await self.tick_loop(network_tick_rate, self.network_tick)
+
+    def network_tick(self):
+
+        # first, so snapshots taken on the network tick go out with this send instead of the next one
+        self.trigger(NetworkTick())
+
+        # frames are decoded as they arrive, so this loads them and sends everything that was queued
+        self.trigger(ReceivedClientUpdates())
+
+    async def tick_loop(self, tick_rate: int, tick):
+        """Call tick at a fixed rate, sleeping in between so other tasks and rooms can run"""
+
+        loop = asyncio.get_running_loop()
+
+        period = 1/tick_rate
+
+        next_tick = loop.time()
+
+        while True:
+
+            tick()
+
+            next_tick += period
+
+            # if we fell more than a whole tick behind, dont try to catch up
+            if loop.time() - next_tick > period:
+                next_tick = loop.time()
+
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+
+    async def serve(self, max_tick_rate: int, network_tick_rate: int):
+        """Run this server inside an already running event loop"""
+
+        self.trigger(ServerStart())
+
+        self.fixed_dt = 1/max_tick_rate
+
+        self.listener = await asyncio.start_server(self.handle_connection, self.server_ip, self.server_port)
+
+        print("server online...")
+
+        async with self.listener:
+            await asyncio.gather(
+                self.game_tick_loop(max_tick_rate),
+                self.network_tick_loop(network_tick_rate)
+            )
+
+    def run(self, max_tick_rate: int, network_tick_rate: int):
+
+        asyncio.run(
+            self.serve(max_tick_rate, network_tick_rate)
+        )
@@ -0,0 +1,63 @@
+import json
+from typing import Optional, Tuple
+
+
+class InvalidHandshake(Exception):
+    pass
+
+
+# Clients from before the handshake existed send their bare uuid as the first message.
+# Newer clients send a json object containing their uuid and the wire options they support,
+# and the server replies with a json object containing the options it picked.
+# Both the hello and the reply are always sent uncompressed with the default 7 digit header.
+
+def encode_hello(client_uuid: str, options: dict) -> bytes:
+
+    hello = {"uuid": client_uuid}
+
+    hello.update(options)
+
+    return bytes(json.dumps(hello), "utf-8")
+
+
+def decode_hello(data: bytes) -> Tuple[str, Optional[dict]]:
+    """Returns the client's uuid and its options. Options are None if the client uses the legacy handshake"""
+
+    if data[:1] != b"{":
+        return data.decode("utf-8"), None
+
+    try:
+        hello = json.loads(data)
+
+        client_uuid = hello.pop("uuid")
+
+    except (ValueError, KeyError):
+        raise InvalidHandshake(f"Client sent invalid hello {data!r}")
+
+    return client_uuid, hello
+
+
+def encode_reply(options: dict) -> bytes:
+    return bytes(json.dumps(options), "utf-8")
+
+
+def decode_reply(data: bytes) -> dict:
+
+    try:
+        return json.loads(data)
+
+    except ValueError:
+        raise InvalidHandshake(f"Server sent invalid handshake reply {data!r}")
+
+
+def pick_option(offered: list, supported: list, preferred: str) -> Optional[str]:
+    """Pick our preferred option if the other side offered it, otherwise the first offered option we support"""
+
+    if preferred in offered:
+        return preferred
+
+    for option in offered:
+        if option in supported:
+            return option
+
+    return None
@@ -1,6 +1,11 @@
 import socket
+import struct
+import zlib
 from socket import AddressFamily, SocketKind
-from typing import Optional
+from typing import List, Optional
+
+from onepointsix.codec import Codec, JsonCodec
+from onepointsix.compression import Compression, OneShotCompression
 
 
 class InvalidHeader(Exception):
@@ -15,42 +20,181 @@ class PayloadTooLarge(Exception):
     pass
 
 
+# "ascii" is the original 7 digit decimal header, "binary" is a 4 byte big endian length
+HEADER_FORMATS = ["binary", "ascii"]
+
+ASCII_HEADER_SIZE = 7
+
+BINARY_HEADER = struct.Struct(">I")
+
+
+def encode_header(data_size: int, header_format: str = "ascii", header_size: int = ASCII_HEADER_SIZE) -> bytes:
+    """Create the header that goes in front of a payload of data_size bytes"""
+
+    if header_format == "binary":
+
+        if data_size > 0xFFFFFFFF:
+            raise PayloadTooLarge(f"Payload of {data_size} bytes does not fit in a binary header")
+
+        return BINARY_HEADER.pack(data_size)
+
+    # if the number used to represent the length of the payload is over 7 characters we cant trasmit it
+    if len(str(data_size)) > header_size:
+        raise PayloadTooLarge(f"Payload header cannot be more than {header_size} characters")
+
+    # create header containing payload size - this header must always be the same size: 7 characters
+    # header contains the number of bytes that the json payload is
+    # if the number of bytes requires less than 7 characters to represent, we use leading zeros
+    header = f"{(header_size - len(str(data_size))) * '0'}{data_size}"  # 7 - len(str(payload_size_string)) fills in unused digits with 0s
+
+    return bytes(header, "utf-8")
+
+
+def decode_header(header: bytes | memoryview, header_format: str = "ascii") -> int:
+    """Get the payload length out of a header"""
+
+    if header_format == "binary":
+        return BINARY_HEADER.unpack(header)[0]
+
+    try:
+        return int(bytes(header))
+
+    except ValueError:
+        raise InvalidHeader(f"Sender sent header {bytes(header)!r}, which is invalid")
+
+
+def header_length(header_format: str) -> int:
+    return BINARY_HEADER.size if header_format == "binary" else ASCII_HEADER_SIZE
+
+
 # a socket that has the ability to add headers
 class HeaderedSocket(socket.socket):
 
-    def __init__(self, family: AddressFamily | int = -1, type: SocketKind | int = -1, proto: int = -1, fileno: int | None = None) -> None:
+    # tcp delivers everything in order, there is no unreliable channel to send updates over
+    supports_unreliable = False
+
+    def __init__(self, family: AddressFamily | int = -1, type: SocketKind | int = -1, proto: int = -1, fileno: int | None = None, receive_buffer_size: int = 65536) -> None:
         super().__init__(family, type, proto, fileno)
 
         self.constructed_data = bytearray()
         self.payload_length = int()
 
+        # codec used for update lists sent over this socket, picked during the handshake
+        self.codec: Codec = JsonCodec()
+
+        # compression context for payloads sent over this socket, also picked during the handshake
+        self.compression: Compression = OneShotCompression(zlib.Z_BEST_COMPRESSION)
+
+        # header format used by send_headered and recv_frames, picked during the handshake
+        # the handshake itself always uses the ascii header so old peers can understand it
+        self.header_format = "ascii"
+
+        # "stream" sends every create, update and delete, "snapshot" sends numbered deltas of the world, also picked during the handshake
+        self.replication = "stream"
+
+        # how the world is sent when the client joins, None means as plain chunks of creates, also picked during the handshake
+        self.join: Optional[str] = None
+
+        # reusable buffer for recv_frames, everything between read_position and write_position hasnt been returned yet
+        self.receive_buffer = bytearray(receive_buffer_size)
+        self.read_position = 0
+        self.write_position = 0
+        self.remote_closed = False
+
+        # frames a non blocking socket couldnt send yet, everything before send_position has already gone out
+        self.send_buffer = bytearray()
+        self.send_position = 0
+        self.shut_down = False
+
+    @property
+    def pending_bytes(self) -> int:
+        """Bytes queued by send_headered that the kernel hasnt taken yet"""
+
+        return len(self.send_buffer) - self.send_position
+
     def send_headered(self, data, header_size=7):
 
         # construct a payload with header from bytes
+        header_bytes = encode_header(len(data), self.header_format, header_size)
+
+        # nobody is going to read it
+        if self.shut_down:
+            return
+
+        if self.getblocking():
+
+            # anything still buffered from when we were non blocking has to go first
+            if self.pending_bytes:
+                with memoryview(self.send_buffer) as buffer_view:
+                    self.sendall(buffer_view[self.send_position:])
+
+                self.send_buffer.clear()
+                self.send_position = 0
+
+            self.sendall(header_bytes + data)
+
+            return
+
+        # non blocking sockets queue the frame and send what the kernel will take, flush() sends the rest later
+        self.send_buffer += header_bytes
+        self.send_buffer += data
+
+        self.flush()
+
+    def flush(self) -> bool:
+        """Send as much of the buffered frames as the socket will take, returns whether everything was sent"""
+
+        while self.send_position < len(self.send_buffer):
+
+            try:
+                with memoryview(self.send_buffer) as buffer_view:
+                    sent_size = self.send(buffer_view[self.send_position:])
+
+            except BlockingIOError:
+                break
+
+            except (BrokenPipeError, ConnectionResetError):
+                # recv_frames reports the disconnect, there is no point keeping what we couldnt send
+                self.send_buffer.clear()
+                self.send_position = 0
+
+                return True
+
+            self.send_position += sent_size
+
+        if self.send_position == len(self.send_buffer):
+            self.send_buffer.clear()
+            self.send_position = 0
+
+        # dont let the sent part of the buffer grow forever while the client is slow
+        elif self.send_position > len(self.send_buffer) // 2:
+            del self.send_buffer[:self.send_position]
 
-        # get number of bytes json string uses
-        data_size = len(data)
+            self.send_position = 0
 
-        # if the number used to represent the length of the payload is over 7 characters we cant trasmit it
-        if len(str(data_size)) > header_size:
-            raise PayloadTooLarge(f"Payload header cannot be more than {header_size} characters")
+        return self.pending_bytes == 0
 
-        # create header containing payload size - this header must always be the same size: 7 characters
-        # header contains the number of bytes that the json payload is
-        # if the number of bytes requires less than 7 characters to represent, we use leading zeros
-        header = f"{(header_size - len(str(data_size))) * '0'}{data_size}"  # 7 - len(str(payload_size_string)) fills in unused digits with 0s
+    def shutdown(self, how: int):
+        """Stop sending and receiving, recv_frames reports the disconnect as usual"""
 
-        header_bytes = bytes(header, "utf-8")
+        self.shut_down = True
 
-        # final payload with header and data
-        headered_data = header_bytes + data
+        self.send_buffer.clear()
+        self.send_position = 0
 
-        self.sendall(headered_data)
+        try:
+            super().shutdown(how)
+
+        except OSError:
+            # already disconnected
+            pass
 
     def recv_headered(self, header_size=7) -> bytes:
         """
         Attempt to construct complete message
         If didn't receive the whole message yet, returns None
+
+        Always reads the ascii header, it is used for the handshake before the header format is negotiated
         """
         
         # if self.constructed data is 0, that means we should be expecting a new header
@@ -105,6 +249,116 @@ class HeaderedSocket(socket.socket):
         # this will only return if we get all of the data
         return bytes(constructed_data)
 
+    def recv_frames(self) -> List[memoryview]:
+        """
+        Read everything that is available and return every complete frame in it
+
+        The returned memoryviews point into the receive buffer, so they are only valid until the next call.
+        Non blocking sockets raise BlockingIOError if there isn't a complete frame yet.
+        Blocking sockets wait until there is at least one.
+        Don't mix this with recv_headered once it has been called
+        """
+
+        if self.remote_closed:
+            raise Disconnected("Remote socket disconnected")
+
+        # move whatever is left of a partial frame to the start of the buffer
+        # this overwrites the frames returned last call
+        if self.read_position != 0:
+            remaining = self.write_position - self.read_position
+
+            self.receive_buffer[0:remaining] = self.receive_buffer[self.read_position:self.write_position]
+
+            self.read_position = 0
+            self.write_position = remaining
+
+        frames: List[memoryview] = []
+
+        blocking = self.getblocking()
+
+        while True:
+
+            if self.write_position == len(self.receive_buffer):
+                self._replace_receive_buffer()
+
+            try:
+                with memoryview(self.receive_buffer) as buffer_view:
+                    received_size = self.recv_into(buffer_view[self.write_position:])
+
+            except BlockingIOError:
+                break
+
+            except ConnectionResetError:
+                raise Disconnected("Remote socket reset connection")
+
+            if received_size == 0:
+                if frames:
+                    # hand over what we have, the next call will raise
+                    self.remote_closed = True
+                    break
+
+                raise Disconnected("Remote socket disconnected")
+
+            self.write_position += received_size
+
+            self._split_frames(frames)
+
+            if blocking and frames:
+                break
+
+        if not frames:
+            raise BlockingIOError()
+
+        return frames
+
+    def _split_frames(self, frames: List[memoryview]):
+        """Cut every complete frame out of the receive buffer"""
+
+        header_size = header_length(self.header_format)
+
+        buffer_view = memoryview(self.receive_buffer)
+
+        while self.write_position - self.read_position >= header_size:
+
+            payload_start = self.read_position + header_size
+
+            payload_length = decode_header(
+                buffer_view[self.read_position:payload_start], self.header_format
+            )
+
+            if self.write_position - payload_start < payload_length:
+                # make sure the rest of this frame will fit once it arrives
+                if header_size + payload_length > len(self.receive_buffer):
+                    self._replace_receive_buffer(header_size + payload_length)
+
+                break
+
+            frames.append(buffer_view[payload_start:payload_start + payload_length])
+
+            self.read_position = payload_start + payload_length
+
+    def _replace_receive_buffer(self, minimum_size: int = 0):
+        """
+        Copy the unread data into a fresh buffer
+
+        Frames returned during this call still point into the old buffer, so it cant be compacted in place
+        """
+
+        remaining = self.write_position - self.read_position
+
+        new_size = len(self.receive_buffer)
+
+        # only grow when the data we need to keep wouldnt leave room to read into
+        while new_size < max(minimum_size, remaining * 2):
+            new_size *= 2
+
+        new_buffer = bytearray(new_size)
+        new_buffer[0:remaining] = self.receive_buffer[self.read_position:self.write_position]
+
+        self.receive_buffer = new_buffer
+        self.read_position = 0
+        self.write_position = remaining
+
     # accept() is redefined to return PayloadSockets instead of default ones
     def accept(self):
 
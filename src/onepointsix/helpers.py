@@ -50,4 +50,20 @@ def dict_diff(dict1: dict, dict2: dict):
         elif key in dict1.keys() and dict1[key] != dict2[key]:
             diff_dict[key] = value
             
-    return diff_dict
\ No newline at end of file
+    return diff_dict
+
+
+def merge_dicts(base: dict, changes: dict) -> dict:
+    """Apply a diff from dict_diff on top of another diff or a full serialized entity, without modifying either"""
+    merged = dict(base)
+
+    for key, value in changes.items():
+
+        # sub dictionaries only contain the keys that changed, so merge them instead of replacing them
+        if type(value) is dict and type(merged.get(key)) is dict:
+            merged[key] = merge_dicts(merged[key], value)
+
+        else:
+            merged[key] = value
+
+    return merged
@@ -0,0 +1,193 @@
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+from onepointsix.entity import Entity
+from onepointsix.events import UpdatesLoaded
+from onepointsix.spatial import Position
+
+if TYPE_CHECKING:
+    from onepointsix.gamemode_server import GamemodeServer
+
+
+class InterestManager:
+    """
+    Decides which entities each client gets updates for
+
+    An entity is in a client's area of interest if it is within view_radius + its relevance_radius
+    of one of the client's focus entities (entities with interest_focus set that the client is the updater of).
+    Entities without a position, and everything a client is the updater of, are always relevant.
+    A client without any focus entities only gets entities without a position.
+
+    Every network tick entities that entered a client's area are sent to it as a create, and entities
+    that left are sent as a delete. Updates are only relayed to clients that currently know the entity.
+    Entities have to move leave_margin further out than view_radius before they leave, so they dont
+    flicker in and out at the edge.
+
+    Entities that point at other entities should be relevant wherever the entities they point at are,
+    otherwise a client might not be able to resolve them
+    """
+
+    def __init__(self, game: "GamemodeServer", view_radius: float, leave_margin: float = 0.1):
+
+        self.game = game
+        self.view_radius = view_radius
+        self.leave_radius = view_radius * (1 + leave_margin)
+
+        # shared with everything else that needs to find entities by position
+        self.grid = game.spatial_index
+
+        # client uuid -> ids of the entities it has been sent and not told to delete
+        self.known: Dict[str, Set[str]] = {}
+
+        # entities without a position
+        self.global_entities: Set[str] = set()
+
+        # entities whose relevance radius is too big for the grid lookup, they are checked one by one
+        self.large_entities: Set[str] = set()
+
+        # client uuid -> positions of its focus entities
+        self.focus_positions: Dict[str, List[Position]] = {}
+
+        # client uuid -> ids of the entities it is the updater of
+        self.owned_entities: Dict[str, Set[str]] = {}
+
+    def refresh_positions(self):
+        """Bring the grid up to date with where every entity is now"""
+
+        self.grid.refresh()
+
+        self.global_entities.clear()
+        self.large_entities.clear()
+        self.focus_positions.clear()
+        self.owned_entities.clear()
+
+        for entity_id, entity in self.game.entities.items():
+
+            self.owned_entities.setdefault(entity.updater, set()).add(entity_id)
+
+            position = self.grid.positions.get(entity_id)
+
+            if position is None:
+                self.global_entities.add(entity_id)
+
+                continue
+
+            if entity.relevance_radius > self.grid.cell_size:
+                self.large_entities.add(entity_id)
+
+            if entity.interest_focus:
+                self.focus_positions.setdefault(entity.updater, []).append(position)
+
+    def is_in_range(self, entity: Entity, focus_position: Position, radius: float) -> bool:
+
+        entity_x, entity_y = self.grid.positions[entity.id]
+
+        reach = radius + entity.relevance_radius
+
+        return (entity_x - focus_position[0]) ** 2 + (entity_y - focus_position[1]) ** 2 <= reach * reach
+
+    def relevant_entities(self, client_uuid: str) -> Set[str]:
+        """Ids of every entity the client should know about right now"""
+
+        relevant = set(self.global_entities)
+
+        known = self.known.get(client_uuid, set())
+
+        for focus_position in self.focus_positions.get(client_uuid, []):
+
+            # small entities can only reach one cell further than the view radius
+            for entity_id in self.grid.query_radius(focus_position, self.leave_radius + self.grid.cell_size):
+
+                if entity_id in relevant:
+                    continue
+
+                # entities the client already knows about only leave once they pass the leave radius
+                radius = self.leave_radius if entity_id in known else self.view_radius
+
+                if self.is_in_range(self.game.entities[entity_id], focus_position, radius):
+                    relevant.add(entity_id)
+
+            for entity_id in self.large_entities:
+
+                radius = self.leave_radius if entity_id in known else self.view_radius
+
+                if self.is_in_range(self.game.entities[entity_id], focus_position, radius):
+                    relevant.add(entity_id)
+
+        return relevant
+
+    def introduce(self, client_uuid: str) -> List[Entity]:
+        """The entities a client that just connected should be sent"""
+
+        self.refresh_positions()
+
+        relevant = self.relevant_entities(client_uuid)
+
+        self.known[client_uuid] = relevant
+
+        return [self.game.entities[entity_id] for entity_id in relevant]
+
+    def update_interest(self, event: UpdatesLoaded):
+        """Send creates for entities that entered each client's area and deletes for ones that left"""
+
+        self.refresh_positions()
+
+        for client_uuid in self.game.client_sockets.keys():
+
+            known = self.known.setdefault(client_uuid, set())
+
+            owned = self.owned_entities.get(client_uuid, set())
+
+            relevant = self.relevant_entities(client_uuid)
+
+            for entity_id in relevant - known - owned:
+
+                entity = self.game.entities[entity_id]
+
+                self.game.network_update(
+                    update_type="create",
+                    entity_id=entity_id,
+                    data=entity.serialize(),
+                    entity_type_string=self.game.lookup_entity_type_string(entity),
+                    destinations=[client_uuid]
+                )
+
+            for entity_id in known - relevant - owned:
+
+                # killed entities already had their delete sent
+                if entity_id in self.game.entities:
+                    self.game.network_update(update_type="delete", entity_id=entity_id, destinations=[client_uuid])
+
+            # the client is the updater of these, so it already has them
+            self.known[client_uuid] = relevant | owned
+
+    def interested_clients(self, entity_id: str, exclude: Optional[str] = None) -> List[str]:
+        """Clients that currently know about an entity"""
+
+        return [
+            client_uuid for client_uuid, known in self.known.items() if entity_id in known and client_uuid != exclude
+        ]
+
+    def forget_entity(self, entity_id: str):
+
+        for known in self.known.values():
+            known.discard(entity_id)
+
+    def forget_client(self, client_uuid: str):
+
+        self.known.pop(client_uuid, None)
+
+    def relay(self, updates: List[dict], sending_client_uuid: str):
+        """Queue updates from a client for the other clients that know about the entities they are for"""
+
+        for update in updates:
+
+            # creates go out once the entity is loaded and we know where it is
+            if update["update_type"] == "create":
+                continue
+
+            destinations = self.interested_clients(update["entity_id"], exclude=sending_client_uuid)
+
+            if update["update_type"] == "delete":
+                self.forget_entity(update["entity_id"])
+
+            self.game.update_queue.queue(update, destinations)
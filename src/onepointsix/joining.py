@@ -0,0 +1,85 @@
+from typing import List, Optional, Tuple
+
+from onepointsix.codec import Codec
+from onepointsix.update_batch import UpdateBatch
+
+AWAITING_HELLO = "awaiting_hello"
+STREAMING_STATE = "streaming_state"
+LIVE = "live"
+
+# join modes a client can offer in its hello, "chunked" clients understand the world_begin and world_end markers
+JOIN_MODES = ["chunked"]
+
+
+def world_begin(entity_count: int, chunk_count: int) -> dict:
+    return {
+        "update_type": "world_begin",
+        "entity_id": None,
+        "entity_type": None,
+        "data": {"entities": entity_count, "chunks": chunk_count}
+    }
+
+
+def world_end() -> dict:
+    return {
+        "update_type": "world_end",
+        "entity_id": None,
+        "entity_type": None,
+        "data": None
+    }
+
+
+class WorldSnapshot:
+    """
+    Every entity a joining client needs, as creates split into chunks
+
+    Chunks hold at most chunk_size entities and are split further until they encode to at most max_chunk_bytes,
+    so a big world never turns into one frame that is too large to send.
+    Each chunk is an UpdateBatch, so clients that join in the same tick share the encoding and compression work
+    """
+
+    def __init__(self, creates: List[dict], codec: Codec, chunk_size: int = 256, max_chunk_bytes: int = 256 * 1024):
+
+        self.entity_count = len(creates)
+        self.chunks: List[UpdateBatch] = []
+
+        # (tick, frames received) the snapshot was made at, it is only reused while neither changes
+        self.made_at: Optional[Tuple[int, int]] = None
+
+        for start in range(0, len(creates), chunk_size):
+            self.add_chunk(creates[start:start + chunk_size], codec, max_chunk_bytes)
+
+    def add_chunk(self, creates: List[dict], codec: Codec, max_chunk_bytes: int):
+
+        chunk = UpdateBatch(frozenset(), creates)
+
+        # a single entity that is bigger than that has to go on its own
+        if len(creates) > 1 and len(chunk.encode(codec)) > max_chunk_bytes:
+
+            middle = len(creates) // 2
+
+            self.add_chunk(creates[:middle], codec, max_chunk_bytes)
+            self.add_chunk(creates[middle:], codec, max_chunk_bytes)
+
+            return
+
+        self.chunks.append(chunk)
+
+
+class JoiningClient:
+    """
+    A connection that hasn't finished joining yet
+
+    It starts out waiting for the client's hello, then the world is streamed to it a few chunks per tick, then it is live.
+    None of that blocks, so a slow or stalled connection only ever holds up itself
+    """
+
+    def __init__(self, connection, started: float):
+
+        self.connection = connection
+        self.started = started
+        self.state = AWAITING_HELLO
+        self.client_uuid: Optional[str] = None
+
+        self.snapshot: Optional[WorldSnapshot] = None
+        self.next_chunk = 0
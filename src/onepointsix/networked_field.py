@@ -0,0 +1,58 @@
+from typing import Any, Callable, Optional
+
+
+class NetworkedField:
+    """
+    An entity attribute that marks itself dirty whenever it is assigned
+
+    Entities that declare at least one of these only serialize and diff the fields that changed each network tick,
+    instead of serializing the whole entity.
+    key is the name of the attribute in serialize()'s output, it defaults to the attribute's own name.
+    serializer turns the value into what serialize() would output for it, fields that serialize() doesn't convert dont need one.
+
+    Mutating the value in place (appending to a list, setting vector.x) doesn't go through the setter,
+    so either reassign the attribute or call entity.mark_dirty(key) afterwards
+    """
+
+    def __init__(self, key: Optional[str] = None, serializer: Optional[Callable[[Any], Any]] = None):
+        self.key = key
+        self.serializer = serializer
+
+    def serialize(self, instance):
+        """The value of this field in instance's serialize() output, without serializing anything else"""
+
+        value = self.__get__(instance, type(instance))
+
+        if self.serializer is None:
+            return value
+
+        return self.serializer(value)
+
+    def __set_name__(self, owner, name: str):
+
+        self.name = name
+
+        if self.key is None:
+            self.key = name
+
+    def __get__(self, instance, owner):
+
+        if instance is None:
+            return self
+
+        try:
+            return instance.__dict__[self.name]
+
+        except KeyError:
+            raise AttributeError(f"{owner.__name__} has no attribute {self.name}")
+
+    def __set__(self, instance, value):
+
+        instance.__dict__[self.name] = value
+
+        try:
+            instance.mark_dirty(self.key)
+
+        except AttributeError:
+            # assigned before Entity.__init__ ran, new entities are sent whole anyway
+            pass
@@ -0,0 +1,392 @@
+import struct
+import time
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterator, List, Optional, Union
+
+from onepointsix import handshake
+from onepointsix.codec import Codec, JsonCodec, get_codec
+from onepointsix.events import WorldLoaded
+from onepointsix.compression import Compression, NoCompression
+from onepointsix.headered_socket import Disconnected
+from onepointsix.snapshots import SnapshotReceiver
+
+if TYPE_CHECKING:
+    from onepointsix.gamemode_client import GamemodeClient
+    from onepointsix.gamemode_server import GamemodeServer
+
+
+class InvalidRecording(Exception):
+    pass
+
+
+MAGIC = b"1.6rec"
+VERSION = 1
+
+FILE_HEADER = struct.Struct(">6sB")
+
+# kind, tick, timestamp, peer length, codec name length, payload length
+RECORD_HEADER = struct.Struct(">BIdBBI")
+
+# record kinds
+SENT = 0
+RECEIVED = 1
+HELLO = 2 # the other side's half of the handshake, the client's hello on a server and the server's reply on a client
+NETWORK_TICK = 3
+DISCONNECTED = 4
+TICK = 5 # the dt a tick simulated, recorded as it starts
+
+# payload of a TICK record
+DT = struct.Struct(">d")
+
+
+class Record:
+
+    def __init__(self, kind: int, tick: int, timestamp: float, peer: str, codec_name: str, payload: bytes):
+
+        self.kind = kind
+        self.tick = tick
+        self.timestamp = timestamp
+        self.peer = peer # uuid of the client on a server, empty on a client
+        self.codec_name = codec_name
+        self.payload = payload
+
+
+class Recorder:
+    """
+    Appends every frame a game sends and receives to a binary file, with the tick and time it happened at,
+    and how long every tick was
+
+    Payloads are recorded encoded but not compressed, since stream compression cant be undone one frame at a time.
+    Records are only ever appended, so a recording cut off by a crash is still readable up to its last whole record
+    """
+
+    def __init__(self, path: str):
+
+        self.path = path
+        self.file: BinaryIO = open(path, "ab")
+
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+
+        self.records = 0
+        self.recorded_bytes = 0
+
+    def record(self, kind: int, tick: int, peer: str = "", codec_name: str = "", payload: Union[bytes, memoryview] = b""):
+
+        peer_bytes = peer.encode("utf-8")
+        codec_bytes = codec_name.encode("utf-8")
+
+        self.file.write(RECORD_HEADER.pack(kind, tick, time.time(), len(peer_bytes), len(codec_bytes), len(payload)))
+        self.file.write(peer_bytes)
+        self.file.write(codec_bytes)
+        self.file.write(payload)
+
+        self.records += 1
+        self.recorded_bytes += RECORD_HEADER.size + len(peer_bytes) + len(codec_bytes) + len(payload)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def get_stats(self) -> dict:
+        return {
+            "records": self.records,
+            "recorded_bytes": self.recorded_bytes
+        }
+
+
+def read_recording(path: str) -> Iterator[Record]:
+    """Every whole record in a recording, in the order they were recorded"""
+
+    with open(path, "rb") as file:
+
+        file_header = file.read(FILE_HEADER.size)
+
+        if len(file_header) < FILE_HEADER.size:
+            raise InvalidRecording(f"{path} is too short to be a recording")
+
+        magic, version = FILE_HEADER.unpack(file_header)
+
+        if magic != MAGIC:
+            raise InvalidRecording(f"{path} is not a recording")
+
+        if version != VERSION:
+            raise InvalidRecording(f"{path} is a version {version} recording, only version {VERSION} can be read")
+
+        while True:
+
+            record_header = file.read(RECORD_HEADER.size)
+
+            # anything shorter is a record that was being written when the game stopped
+            if len(record_header) < RECORD_HEADER.size:
+                return
+
+            kind, tick, timestamp, peer_length, codec_length, payload_length = RECORD_HEADER.unpack(record_header)
+
+            body = file.read(peer_length + codec_length + payload_length)
+
+            if len(body) < peer_length + codec_length + payload_length:
+                return
+
+            yield Record(
+                kind,
+                tick,
+                timestamp,
+                body[:peer_length].decode("utf-8"),
+                body[peer_length:peer_length + codec_length].decode("utf-8"),
+                body[peer_length + codec_length:]
+            )
+
+
+class ReplayConnection:
+    """
+    Stands in for a game's connection during a replay
+
+    recv_frames returns the recorded frames it was given, and frames sent over it are kept so they can be
+    compared to the recorded ones. Nothing is compressed, the recorded payloads arent either
+    """
+
+    supports_unreliable = False
+
+    def __init__(self, codec: Optional[Codec] = None):
+
+        self.codec: Codec = codec or JsonCodec()
+        self.compression: Compression = NoCompression()
+        self.header_format = "binary"
+        self.replication = "stream"
+        self.join: Optional[str] = None
+
+        self.pending_bytes = 0
+
+        self.incoming_frames: List[bytes] = []
+        self.sent_frames: List[bytes] = []
+        self.remote_closed = False
+
+    def recv_frames(self) -> List[bytes]:
+
+        if self.incoming_frames:
+            frames = self.incoming_frames
+
+            self.incoming_frames = []
+
+            return frames
+
+        if self.remote_closed:
+            raise Disconnected("Remote socket disconnected")
+
+        raise BlockingIOError()
+
+    def send_headered(self, data, header_size=7):
+        self.sent_frames.append(bytes(data))
+
+    def accept(self):
+        # used in place of the server's listening socket, nobody new ever connects during a replay
+        raise BlockingIOError()
+
+    def flush(self) -> bool:
+        return True
+
+    def setblocking(self, flag: bool):
+        pass
+
+    def shutdown(self, how: int):
+        self.remote_closed = True
+
+    def close(self):
+        self.remote_closed = True
+
+
+def replay(game: Union["GamemodeServer", "GamemodeClient"], path: str) -> dict:
+    """
+    Feed a recording back into a game as fast as it can run, without any sockets
+
+    A server gets the frames every recorded client sent it and a client gets the frames the server sent it,
+    each on the same tick they arrived on when the recording was made, and network ticks run where they ran then.
+    Every tick simulates the dt it did when it was recorded, recordings without dts can only be replayed with fixed_dt set.
+    The game should be set up like the recorded one but not started or connected.
+
+    Returns how long the replay took next to how long the recording did, and how many of the frames the game sent
+    were identical to the recorded ones, which is where to start looking for desyncs.
+    Frames from peers whose hello isnt in the recording cant be fed to the game, they are counted as skipped_frames
+    """
+
+    # importing this at the top would be circular, the games import this module
+    from onepointsix.gamemode_server import GamemodeServer
+
+    is_server = isinstance(game, GamemodeServer)
+
+    if is_server and game.selector:
+        raise ValueError("servers can only be replayed with io_mode 'poll'")
+
+    connections: Dict[str, ReplayConnection] = {}
+    recorded_sent_frames: Dict[str, List[bytes]] = {}
+
+    if is_server:
+        game.socket = ReplayConnection()
+
+    else:
+        game.server = connections[""] = ReplayConnection()
+
+    first_record: Optional[Record] = None
+    last_record: Optional[Record] = None
+    tick_offset = 0
+
+    ticks = 0
+    network_ticks = 0
+    received_frames = 0
+    skipped_frames = 0
+
+    # recorded dts replace the game's own until the replay is done
+    previous_fixed_dt = game.fixed_dt
+
+    def run_ticks_until(tick: int):
+
+        nonlocal ticks
+
+        while game.tick_count < tick:
+
+            # wall clock time between ticks means nothing when they run as fast as they can
+            if game.fixed_dt is None:
+                raise ValueError(f"{path} doesnt record how long ticks were, set fixed_dt to replay it")
+
+            game.game_tick()
+
+            ticks += 1
+
+    started = time.perf_counter()
+
+    try:
+        for record in read_recording(path):
+
+            if first_record is None:
+                first_record = record
+
+                # the recording didnt necessarily start on the game's first tick
+                tick_offset = game.tick_count - record.tick
+
+            last_record = record
+
+            tick = record.tick + tick_offset
+
+            if record.kind == SENT:
+                recorded_sent_frames.setdefault(record.peer, []).append(record.payload)
+
+            elif record.kind == RECEIVED:
+                # frames are received during the tick they are recorded on, so they have to be waiting before it starts
+                run_ticks_until(tick - 1)
+
+                connection = connections.get(record.peer)
+
+                # from a client whose hello isnt in the recording, so the game never heard of it
+                if connection is None:
+                    skipped_frames += 1
+
+                    continue
+
+                connection.codec = get_codec(record.codec_name)
+                connection.incoming_frames.append(record.payload)
+
+                received_frames += 1
+
+            elif record.kind == TICK:
+                run_ticks_until(tick)
+
+                # the next tick to run is the one this was recorded at the start of
+                game.fixed_dt = DT.unpack(record.payload)[0]
+
+            elif record.kind == NETWORK_TICK:
+                run_ticks_until(tick)
+
+                game.network_tick()
+
+                network_ticks += 1
+
+            elif record.kind == HELLO:
+                run_ticks_until(tick - 1)
+
+                if is_server:
+                    connections[record.peer] = replay_join(game, record)
+
+                else:
+                    replay_reply(game, record)
+
+            elif record.kind == DISCONNECTED and record.peer in connections:
+                run_ticks_until(tick - 1)
+
+                connections[record.peer].remote_closed = True
+
+    finally:
+        game.fixed_dt = previous_fixed_dt
+
+    duration = time.perf_counter() - started
+
+    sent_frames = 0
+    matching_frames = 0
+    first_mismatch: Optional[dict] = None
+
+    for peer, connection in connections.items():
+
+        recorded_frames = recorded_sent_frames.get(peer, [])
+
+        sent_frames += len(connection.sent_frames)
+
+        for index, (sent_frame, recorded_frame) in enumerate(zip(connection.sent_frames, recorded_frames)):
+
+            if sent_frame == recorded_frame:
+                matching_frames += 1
+
+            elif first_mismatch is None:
+                first_mismatch = {"peer": peer, "frame": index}
+
+    return {
+        "ticks": ticks,
+        "network_ticks": network_ticks,
+        "received_frames": received_frames,
+        "skipped_frames": skipped_frames,
+        "sent_frames": sent_frames,
+        "recorded_sent_frames": sum(len(frames) for frames in recorded_sent_frames.values()),
+        "matching_frames": matching_frames,
+        "first_mismatch": first_mismatch,
+        "duration": duration,
+        "recorded_duration": last_record.timestamp - first_record.timestamp if first_record else 0
+    }
+
+
+def replay_join(game: "GamemodeServer", record: Record) -> ReplayConnection:
+    """Connect a recorded client to a server the way receive_hello would have"""
+
+    client_uuid, options = handshake.decode_hello(record.payload)
+
+    connection = ReplayConnection()
+
+    game.configure_connection(connection, options)
+
+    # the handshake reply isnt a frame, and the recorded payloads arent compressed
+    connection.sent_frames.clear()
+    connection.compression = NoCompression()
+
+    game.client_sockets[client_uuid] = connection
+
+    game.clients_to_introduce.append(client_uuid)
+
+    return connection
+
+
+def replay_reply(game: "GamemodeClient", record: Record):
+    """Set up a client's connection from the server's recorded handshake reply, the way connect would have"""
+
+    reply = handshake.decode_reply(record.payload)
+
+    game.server.codec = get_codec(reply["codec"])
+    game.server.replication = reply.get("replication", "stream")
+    game.server.join = reply.get("join")
+
+    if game.server.replication == "snapshot":
+        game.snapshot_receiver = SnapshotReceiver(game)
+
+    # like connect, there is no way to tell when the world is loaded without the markers
+    game.world_loaded = game.server.join != "chunked"
+
+    if game.world_loaded:
+        game.trigger(WorldLoaded())
@@ -0,0 +1,178 @@
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple, Union
+
+from rich import print
+
+from onepointsix.unresolved import Unresolved
+
+if TYPE_CHECKING:
+    from onepointsix.entity import Entity
+    from onepointsix.gamemode_client import GamemodeClient
+    from onepointsix.gamemode_server import GamemodeServer
+
+
+class PendingReference:
+    """An entity attribute that is still an Unresolved placeholder"""
+
+    def __init__(self, holder: "Entity", attribute_name: str, uuid: str, since_tick: int):
+
+        self.holder = holder
+        self.attribute_name = attribute_name
+        self.uuid = uuid
+        self.since_tick = since_tick
+        self.reported = False
+
+    def __repr__(self) -> str:
+        return f"PendingReference({self.holder.id}.{self.attribute_name} -> {self.uuid})"
+
+
+class PendingReferences:
+    """
+    Keeps track of which entities are waiting for which other entities to exist
+
+    Entities are only checked for Unresolved attributes when they are created or updated from the network,
+    and a waiting reference is resolved the moment the entity it points at is created,
+    so nothing has to look through every entity each network tick.
+
+    References to entities that were deleted, or that are still waiting after stale_after_ticks ticks,
+    are reported once and kept in unresolvable()
+    """
+
+    def __init__(self, game: Union["GamemodeClient", "GamemodeServer"], stale_after_ticks: int = 300, remembered_deletes: int = 1024):
+
+        self.game = game
+        self.stale_after_ticks = stale_after_ticks
+        self.remembered_deletes = remembered_deletes
+
+        # uuid of a missing entity -> (holder id, attribute name) -> the reference waiting for it
+        self.waiting: Dict[str, Dict[Tuple[str, str], PendingReference]] = {}
+
+        # holder id -> uuids it is waiting for, so killing a holder only touches its own references
+        self.holder_targets: Dict[str, Set[str]] = {}
+
+        # recently killed entity ids, a reference to one of these will never resolve
+        self.deleted_ids: OrderedDict[str, None] = OrderedDict()
+
+    def __len__(self) -> int:
+        return sum(len(references) for references in self.waiting.values())
+
+    def track(self, entity: "Entity"):
+        """Resolve or start waiting on every Unresolved attribute of an entity that was just created or updated"""
+
+        # start from scratch in case attributes were pointed somewhere else, but keep how long they have been waiting
+        previous_references = {
+            (reference.attribute_name, reference.uuid): reference for reference in self.untrack(entity)
+        }
+
+        for attribute_name, attribute in list(entity.__dict__.items()):
+
+            if type(attribute) is not Unresolved:
+                continue
+
+            target = self.game.entities.get(attribute.uuid)
+
+            if target is not None:
+                setattr(entity, attribute_name, target)
+
+                continue
+
+            reference = previous_references.get((attribute_name, attribute.uuid))
+
+            if reference is None:
+                reference = PendingReference(entity, attribute_name, attribute.uuid, self.game.tick_count)
+
+            self.waiting.setdefault(attribute.uuid, {})[(entity.id, attribute_name)] = reference
+            self.holder_targets.setdefault(entity.id, set()).add(attribute.uuid)
+
+            if attribute.uuid in self.deleted_ids:
+                self.report(reference, "points at an entity that was deleted")
+
+    def entity_created(self, entity: "Entity"):
+        """Resolve everything that was waiting for this entity"""
+
+        self.deleted_ids.pop(entity.id, None)
+
+        references = self.waiting.pop(entity.id, None)
+
+        if references is None:
+            return
+
+        for reference in references.values():
+
+            self._forget_target(reference.holder.id, entity.id)
+
+            placeholder = reference.holder.__dict__.get(reference.attribute_name)
+
+            # the attribute might have been changed since it was tracked
+            if type(placeholder) is Unresolved and placeholder.uuid == entity.id:
+                setattr(reference.holder, reference.attribute_name, entity)
+
+    def untrack(self, entity: "Entity") -> List[PendingReference]:
+        """Stop waiting on anything for an entity, returns the references that were dropped"""
+
+        dropped: List[PendingReference] = []
+
+        for uuid in self.holder_targets.pop(entity.id, ()):
+
+            references = self.waiting.get(uuid)
+
+            if references is None:
+                continue
+
+            for key in [key for key, reference in references.items() if reference.holder is entity]:
+                dropped.append(references.pop(key))
+
+            if not references:
+                del self.waiting[uuid]
+
+        return dropped
+
+    def entity_killed(self, entity: "Entity"):
+
+        self.untrack(entity)
+
+        self.deleted_ids[entity.id] = None
+
+        if len(self.deleted_ids) > self.remembered_deletes:
+            self.deleted_ids.popitem(last=False)
+
+        # anything still waiting for this entity is never going to get it
+        for reference in self.waiting.get(entity.id, {}).values():
+            self.report(reference, "points at an entity that was deleted")
+
+    def _forget_target(self, holder_id: str, uuid: str):
+
+        targets = self.holder_targets.get(holder_id)
+
+        if targets is None:
+            return
+
+        targets.discard(uuid)
+
+        if not targets:
+            del self.holder_targets[holder_id]
+
+    def check_stale(self):
+        """Report references that have been waiting for too long"""
+
+        for references in self.waiting.values():
+            for reference in references.values():
+
+                if not reference.reported and self.game.tick_count - reference.since_tick >= self.stale_after_ticks:
+                    self.report(reference, f"has not resolved after {self.stale_after_ticks} ticks")
+
+    def report(self, reference: PendingReference, reason: str):
+
+        if reference.reported:
+            return
+
+        reference.reported = True
+
+        print(f"[yellow]Unresolvable reference: {reference.holder.id}.{reference.attribute_name} {reason} ({reference.uuid})")
+
+    def unresolvable(self) -> List[PendingReference]:
+        """Every waiting reference that has been reported"""
+
+        return [
+            reference for references in self.waiting.values() for reference in references.values() if reference.reported
+        ]
@@ -0,0 +1,169 @@
+import heapq
+from typing import TYPE_CHECKING, Dict, Iterable, List, Mapping, Tuple, Type, TypeVar, Union
+
+if TYPE_CHECKING:
+    from onepointsix.entity import Entity
+
+
+EntityType = TypeVar("EntityType", bound="Entity")
+
+
+class EntityTypeMap(dict):
+    """
+    Maps type strings to entity classes
+
+    Works like a normal dict, but also keeps the reverse class -> type string map up to date,
+    so finding the type string of an entity doesn't have to look through every type
+    """
+
+    def __init__(self, entity_types: Union[Mapping[str, Type["Entity"]], Iterable] = ()):
+        super().__init__()
+
+        self.type_strings: Dict[Type["Entity"], str] = {}
+
+        self.update(entity_types)
+
+    def __setitem__(self, entity_type_string: str, entity_type: Type["Entity"]):
+
+        if entity_type_string in self:
+            self._forget(entity_type_string)
+
+        super().__setitem__(entity_type_string, entity_type)
+
+        self.type_strings[entity_type] = entity_type_string
+
+    def __delitem__(self, entity_type_string: str):
+
+        self._forget(entity_type_string)
+
+        super().__delitem__(entity_type_string)
+
+    def _forget(self, entity_type_string: str):
+
+        entity_type = self[entity_type_string]
+
+        if self.type_strings.get(entity_type) == entity_type_string:
+            del self.type_strings[entity_type]
+
+        # another type string might still point at the same class
+        for other_type_string, other_entity_type in self.items():
+            if other_entity_type is entity_type and other_type_string != entity_type_string:
+                self.type_strings[entity_type] = other_type_string
+
+    def update(self, entity_types=(), **kwargs):
+
+        if isinstance(entity_types, Mapping):
+            entity_types = entity_types.items()
+
+        for entity_type_string, entity_type in entity_types:
+            self[entity_type_string] = entity_type
+
+        for entity_type_string, entity_type in kwargs.items():
+            self[entity_type_string] = entity_type
+
+    def setdefault(self, entity_type_string: str, entity_type: Type["Entity"]):
+
+        if entity_type_string not in self:
+            self[entity_type_string] = entity_type
+
+        return self[entity_type_string]
+
+    def pop(self, entity_type_string: str, *default):
+
+        if entity_type_string not in self:
+            return super().pop(entity_type_string, *default)
+
+        entity_type = self[entity_type_string]
+
+        del self[entity_type_string]
+
+        return entity_type
+
+    def popitem(self):
+
+        entity_type_string = next(reversed(self))
+
+        return entity_type_string, self.pop(entity_type_string)
+
+    def clear(self):
+
+        super().clear()
+
+        self.type_strings.clear()
+
+
+class EntityRegistry:
+    """
+    Every entity in a game, grouped by class
+
+    Getting all entities of a class only looks at the classes that are a subclass of it,
+    instead of checking every entity.
+    Entities come out in the order they were created, same as iterating over game.entities
+    """
+
+    def __init__(self):
+
+        # exact class -> entity id -> (creation number, entity), each one in creation order
+        self.by_class: Dict[type, Dict[str, Tuple[int, "Entity"]]] = {}
+        self.created_count = 0
+
+        # queried class -> the registered classes that are a subclass of it
+        self.subclass_cache: Dict[type, List[type]] = {}
+
+    def add(self, entity: "Entity"):
+
+        entity_class = type(entity)
+
+        if entity_class not in self.by_class:
+            self.by_class[entity_class] = {}
+
+            # a new class might be a subclass of something we already looked up
+            self.subclass_cache.clear()
+
+        class_entities = self.by_class[entity_class]
+
+        # a replaced entity has to move to the end to keep the creation order
+        class_entities.pop(entity.id, None)
+
+        class_entities[entity.id] = (self.created_count, entity)
+
+        self.created_count += 1
+
+    def remove(self, entity: "Entity"):
+
+        class_entities = self.by_class.get(type(entity))
+
+        # a newer entity might have been created with the same id
+        if class_entities is not None and entity.id in class_entities and class_entities[entity.id][1] is entity:
+            del class_entities[entity.id]
+
+    def subclasses_of(self, entity_type: type) -> List[type]:
+
+        try:
+            return self.subclass_cache[entity_type]
+
+        except KeyError:
+            subclasses = [entity_class for entity_class in self.by_class if issubclass(entity_class, entity_type)]
+
+            self.subclass_cache[entity_type] = subclasses
+
+            return subclasses
+
+    def of_type(self, entity_type: Type[EntityType]) -> List[EntityType]:
+        """Every entity that is an instance of entity_type, including subclasses"""
+
+        subclasses = self.subclasses_of(entity_type)
+
+        if len(subclasses) == 1:
+            return [entity for created_number, entity in self.by_class[subclasses[0]].values()]
+
+        # every class is already in creation order, so they only need to be merged
+        return [
+            entity for created_number, entity in heapq.merge(
+                *[self.by_class[entity_class].values() for entity_class in subclasses],
+                key=lambda item: item[0]
+            )
+        ]
+
+    def count(self, entity_type: type) -> int:
+        return sum(len(self.by_class[entity_class]) for entity_class in self.subclasses_of(entity_type))
@@ -0,0 +1,86 @@
+from typing import Dict, List, Tuple
+
+from onepointsix.codec import Codec
+from onepointsix.update_queue import merge_update
+
+
+class RelayCache:
+    """
+    The last known state of every entity clients have told a relaying server about
+
+    Relayed frames are just stored as they arrive, and only decoded when the cache is actually needed
+    (a client joining or leaving) or when more than max_pending_bytes are waiting.
+
+    So relaying itself never decodes, but every frame still gets decoded once, later and in one go.
+    A relaying server doesnt load entities, so this is the only place the world a joining client needs can come from.
+    A bigger max_pending_bytes folds less often but holds on to more bytes and makes the next join or leave slower,
+    0 folds every frame as it arrives
+    """
+
+    def __init__(self, max_pending_bytes: int = 1024 * 1024):
+
+        self.max_pending_bytes = max_pending_bytes
+
+        # entity id -> create update holding its latest state
+        self.states: Dict[str, dict] = {}
+
+        self.pending_frames: List[Tuple[Codec, bytes]] = []
+        self.pending_bytes = 0
+
+    def record(self, codec: Codec, encoded: bytes):
+
+        self.pending_frames.append((codec, encoded))
+        self.pending_bytes += len(encoded)
+
+        if self.pending_bytes > self.max_pending_bytes:
+            self.fold()
+
+    def fold(self):
+        """Decode every pending frame into the cached states"""
+
+        for codec, encoded in self.pending_frames:
+            for update in codec.decode(encoded):
+                self.apply(update)
+
+        self.pending_frames = []
+        self.pending_bytes = 0
+
+    def apply(self, update: dict):
+
+        entity_id = update["entity_id"]
+
+        match update["update_type"]:
+
+            case "create":
+                self.states[entity_id] = update
+
+            case "update":
+
+                # updates for entities we never saw created cant be turned into a create
+                if entity_id in self.states:
+                    self.states[entity_id] = merge_update(self.states[entity_id], update)
+
+            case "delete":
+                self.states.pop(entity_id, None)
+
+    def snapshot(self) -> List[dict]:
+        """A create for every cached entity, for clients that just joined"""
+
+        self.fold()
+
+        return list(self.states.values())
+
+    def owned_by(self, updater: str) -> List[str]:
+        """Ids of the cached entities a client is the updater of"""
+
+        self.fold()
+
+        return [
+            entity_id for entity_id, state in self.states.items() if state["data"].get("updater") == updater
+        ]
+
+    def remove(self, entity_id: str):
+
+        self.fold()
+
+        self.states.pop(entity_id, None)
@@ -0,0 +1,126 @@
+import time
+from typing import Callable, Dict, List
+
+
+class ScheduledTask:
+    """A callback that should run a fixed number of times per second"""
+
+    def __init__(self, name: str, rate: float, callback: Callable[[], None], max_catch_up: int, start_time: float):
+
+        self.name = name
+        self.period = 1/rate
+        self.callback = callback
+        self.max_catch_up = max_catch_up # most runs we will do back to back when we fall behind
+        self.next_run = start_time
+
+        self.runs = 0
+        self.overruns = 0 # runs that finished after the next run was already due
+        self.skipped = 0 # runs that were dropped because we were too far behind to catch up
+        self.last_duration: float = 0
+        self.total_duration: float = 0
+
+    def get_stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "last_duration": self.last_duration,
+            "average_duration": self.total_duration / self.runs if self.runs else 0
+        }
+
+
+class TickScheduler:
+    """
+    Runs tasks on fixed timesteps using a monotonic clock
+
+    Between runs it sleeps until the next task is due instead of spinning, then spins for the last
+    spin_threshold seconds because sleep() usually oversleeps by a little
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep, spin_threshold: float = 0.001):
+
+        self.clock = clock
+        self.sleep = sleep
+        self.spin_threshold = spin_threshold
+        self.tasks: List[ScheduledTask] = []
+        self.running = False
+
+    def add_task(self, name: str, rate: float, callback: Callable[[], None], max_catch_up: int = 5) -> ScheduledTask:
+
+        task = ScheduledTask(name, rate, callback, max_catch_up, self.clock())
+
+        self.tasks.append(task)
+
+        return task
+
+    def run_pending(self):
+        """Run every task that is due, catching up on missed runs up to each task's limit"""
+
+        for task in self.tasks:
+
+            catch_up_runs = 0
+
+            while self.clock() >= task.next_run and catch_up_runs < task.max_catch_up:
+
+                start = self.clock()
+
+                task.callback()
+
+                end = self.clock()
+
+                task.next_run += task.period
+                task.runs += 1
+                task.last_duration = end - start
+                task.total_duration += task.last_duration
+
+                if end > task.next_run:
+                    task.overruns += 1
+
+                catch_up_runs += 1
+
+            # still behind after catching up as much as we are allowed, give up on the missed runs
+            if self.clock() >= task.next_run:
+
+                missed_runs = int((self.clock() - task.next_run) / task.period) + 1
+
+                task.skipped += missed_runs
+                task.next_run += missed_runs * task.period
+
+    def time_until_next(self) -> float:
+
+        if not self.tasks:
+            return 0
+
+        return max(0, min(task.next_run for task in self.tasks) - self.clock())
+
+    def sleep_until_next(self):
+
+        remaining = self.time_until_next()
+
+        if remaining > self.spin_threshold:
+            self.sleep(remaining - self.spin_threshold)
+
+        deadline = self.clock() + self.time_until_next()
+
+        while self.clock() < deadline:
+            # yield to other threads and processes while we wait out the last bit
+            self.sleep(0)
+
+    def run(self):
+        """Run tasks until stop() is called"""
+
+        self.running = True
+
+        while self.running:
+
+            self.run_pending()
+
+            self.sleep_until_next()
+
+    def stop(self):
+        self.running = False
+
+    def get_stats(self) -> Dict[str, dict]:
+        return {
+            task.name: task.get_stats() for task in self.tasks
+        }
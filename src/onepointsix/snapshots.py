@@ -0,0 +1,377 @@
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from onepointsix.events import NetworkTick
+from onepointsix.helpers import merge_dicts
+
+if TYPE_CHECKING:
+    from onepointsix.gamemode_client import GamemodeClient
+    from onepointsix.gamemode_server import GamemodeServer
+
+
+REPLICATION_MODES = ["snapshot", "stream"]
+
+# entity id -> {"entity_type": type string, "data": serialized entity}
+WorldState = Dict[str, dict]
+
+
+def state_diff(old: dict, new: dict) -> dict:
+    """Like dict_diff, but keys that only exist in new are included instead of being an error"""
+
+    diff = {}
+
+    for key, value in new.items():
+
+        if key not in old:
+            diff[key] = value
+
+        elif type(value) is dict and type(old[key]) is dict:
+
+            sub_diff = state_diff(old[key], value)
+
+            if sub_diff != {}:
+                diff[key] = sub_diff
+
+        elif old[key] != value:
+            diff[key] = value
+
+    return diff
+
+
+def world_diff(old: WorldState, new: WorldState) -> Dict[str, dict]:
+    """The creates, updates and deletes that turn old into new, keyed by entity id"""
+
+    updates: Dict[str, dict] = {}
+
+    for entity_id, state in new.items():
+
+        old_state = old.get(entity_id)
+
+        if old_state is None or old_state["entity_type"] != state["entity_type"]:
+            updates[entity_id] = {
+                "update_type": "create",
+                "entity_id": entity_id,
+                "entity_type": state["entity_type"],
+                "data": state["data"]
+            }
+
+        elif old_state["data"] is not state["data"] and old_state["data"] != state["data"]:
+            updates[entity_id] = {
+                "update_type": "update",
+                "entity_id": entity_id,
+                "entity_type": None,
+                "data": state_diff(old_state["data"], state["data"])
+            }
+
+    for entity_id in old:
+        if entity_id not in new:
+            updates[entity_id] = {
+                "update_type": "delete",
+                "entity_id": entity_id,
+                "entity_type": None,
+                "data": None
+            }
+
+    return updates
+
+
+def apply_world_updates(state: WorldState, updates: List[dict]) -> WorldState:
+    """Apply creates, updates and deletes to a copy of a world state"""
+
+    new_state = dict(state)
+
+    for update in updates:
+
+        entity_id = update["entity_id"]
+
+        match update["update_type"]:
+
+            case "create":
+                new_state[entity_id] = {"entity_type": update["entity_type"], "data": update["data"]}
+
+            case "update":
+
+                if entity_id in new_state:
+                    new_state[entity_id] = {
+                        "entity_type": new_state[entity_id]["entity_type"],
+                        "data": merge_dicts(new_state[entity_id]["data"], update["data"])
+                    }
+
+            case "delete":
+                new_state.pop(entity_id, None)
+
+    return new_state
+
+
+def snapshot_header(number: int, baseline: int) -> dict:
+    return {
+        "update_type": "snapshot",
+        "entity_id": None,
+        "entity_type": None,
+        "data": {"number": number, "baseline": baseline}
+    }
+
+
+def ack_update(number: int) -> dict:
+    return {
+        "update_type": "ack",
+        "entity_id": None,
+        "entity_type": None,
+        "data": {"number": number}
+    }
+
+
+class Snapshot:
+    """The whole server world at one network tick"""
+
+    def __init__(self, number: int, state: WorldState):
+
+        self.number = number
+        self.state = state
+
+        # updater -> ids of the entities it is the updater of, clients dont get sent their own entities
+        self.owners: Dict[str, Set[str]] = {}
+
+        for entity_id, entity_state in state.items():
+            self.owners.setdefault(entity_state["data"].get("updater"), set()).add(entity_id)
+
+
+class ClientSnapshotState:
+
+    def __init__(self):
+
+        self.acked = 0 # newest snapshot the client told us it has, 0 means nothing
+        self.last_sent = 0
+        self.skipped = 0 # network ticks we didnt send anything because the client was too far behind
+
+
+class SnapshotReplicator:
+    """
+    Sends snapshot clients numbered deltas of the world instead of a stream of updates
+
+    Every network tick the server world is serialized into a snapshot. Each client gets the difference between
+    the newest snapshot it acknowledged (its baseline) and the current one, minus the entities it is the updater of.
+    A client that has more than max_unacked_snapshots in flight isn't sent anything until it catches up,
+    and then gets a single delta straight to the current state.
+    Baselines older than history_size snapshots are forgotten, those clients get the full state again
+    """
+
+    def __init__(self, game: "GamemodeServer", history_size: int = 32, max_unacked_snapshots: int = 10):
+
+        self.game = game
+        self.history_size = history_size
+        self.max_unacked_snapshots = max_unacked_snapshots
+
+        self.snapshots: OrderedDict[int, Snapshot] = OrderedDict()
+        self.clients: Dict[str, ClientSnapshotState] = {}
+        self.number = 0
+
+        # (baseline number, snapshot number) -> world_diff, shared by every client with the same baseline
+        self.delta_cache: Dict[Tuple[int, int], Dict[str, dict]] = {}
+
+    def add_client(self, client_uuid: str):
+        self.clients[client_uuid] = ClientSnapshotState()
+
+    def remove_client(self, client_uuid: str):
+        self.clients.pop(client_uuid, None)
+
+    def is_snapshot_client(self, client_uuid: str) -> bool:
+        return client_uuid in self.clients
+
+    def take_acks(self, client_uuid: str, updates: List[dict]) -> List[dict]:
+        """Record acks from a client and return the rest of its updates"""
+
+        client_state = self.clients.get(client_uuid)
+
+        entity_updates = []
+
+        for update in updates:
+
+            if update["update_type"] != "ack":
+                entity_updates.append(update)
+
+                continue
+
+            # acks can only move forward, and only to snapshots we actually sent
+            if client_state is not None and client_state.acked < update["data"]["number"] <= client_state.last_sent:
+                client_state.acked = update["data"]["number"]
+
+        return entity_updates
+
+    def take_snapshot(self) -> Snapshot:
+
+        self.number += 1
+
+        state = {
+            entity_id: {
+                "entity_type": self.game.lookup_entity_type_string(entity),
+                "data": entity.serialize()
+            }
+            for entity_id, entity in self.game.entities.items()
+        }
+
+        snapshot = Snapshot(self.number, state)
+
+        self.snapshots[self.number] = snapshot
+
+        while len(self.snapshots) > self.history_size:
+            self.snapshots.popitem(last=False)
+
+        # deltas are only ever made to the newest snapshot
+        self.delta_cache.clear()
+
+        return snapshot
+
+    def delta(self, baseline: Optional[Snapshot], snapshot: Snapshot) -> Dict[str, dict]:
+
+        baseline_number = baseline.number if baseline else 0
+
+        key = (baseline_number, snapshot.number)
+
+        try:
+            return self.delta_cache[key]
+
+        except KeyError:
+            delta = world_diff(baseline.state if baseline else {}, snapshot.state)
+
+            self.delta_cache[key] = delta
+
+            return delta
+
+    def updates_for(self, client_uuid: str, baseline: Optional[Snapshot], snapshot: Snapshot) -> List[dict]:
+        """The delta between what the client has at baseline and the current snapshot, without its own entities"""
+
+        owned_then = baseline.owners.get(client_uuid, set()) if baseline else set()
+        owned_now = snapshot.owners.get(client_uuid, set())
+
+        owned = owned_then | owned_now
+
+        updates = [update for entity_id, update in self.delta(baseline, snapshot).items() if entity_id not in owned]
+
+        for entity_id in owned:
+
+            had_it = baseline is not None and entity_id in baseline.state and entity_id not in owned_then
+            has_it = entity_id in snapshot.state and entity_id not in owned_now
+
+            # the entity stopped belonging to this client, so it has to be sent whole
+            if has_it and not had_it:
+                updates.append({
+                    "update_type": "create",
+                    "entity_id": entity_id,
+                    "entity_type": snapshot.state[entity_id]["entity_type"],
+                    "data": snapshot.state[entity_id]["data"]
+                })
+
+            # the entity started belonging to this client, from now on the client's copy is the real one
+            elif had_it and not has_it:
+                updates.append({
+                    "update_type": "update",
+                    "entity_id": entity_id,
+                    "entity_type": None,
+                    "data": {"updater": client_uuid}
+                })
+
+        return updates
+
+    def send_to(self, client_uuid: str, snapshot: Snapshot):
+
+        client_state = self.clients[client_uuid]
+
+        # a baseline that fell out of the history means starting over from nothing
+        baseline = self.snapshots.get(client_state.acked)
+
+        baseline_number = baseline.number if baseline else 0
+
+        packet = [snapshot_header(snapshot.number, baseline_number)] + self.updates_for(client_uuid, baseline, snapshot)
+
+        # the client reads the header off the front of the frame, so the packet cant share one with anything
+        self.game.update_queue.queue_frame(packet, [client_uuid])
+
+        client_state.last_sent = snapshot.number
+
+    def forget_unsent(self, client_uuid: str):
+        """The snapshots queued for a client were thrown away, so the next one has to be a delta from what it acked"""
+
+        client_state = self.clients[client_uuid]
+
+        client_state.last_sent = client_state.acked
+
+    def send_initial_snapshot(self, client_uuid: str):
+        """Give a client that just joined the full world"""
+
+        self.add_client(client_uuid)
+
+        snapshot = self.snapshots.get(self.number) or self.take_snapshot()
+
+        self.send_to(client_uuid, snapshot)
+
+    def send_snapshots(self, event: NetworkTick):
+
+        if not self.clients:
+            return
+
+        snapshot = self.take_snapshot()
+
+        for client_uuid, client_state in self.clients.items():
+
+            if client_state.last_sent - client_state.acked > self.max_unacked_snapshots:
+                client_state.skipped += 1
+
+                continue
+
+            self.send_to(client_uuid, snapshot)
+
+    def get_stats(self) -> Dict[str, dict]:
+        return {
+            client_uuid: {
+                "acked": client_state.acked,
+                "last_sent": client_state.last_sent,
+                "behind": self.number - client_state.acked,
+                "skipped": client_state.skipped
+            }
+            for client_uuid, client_state in self.clients.items()
+        }
+
+
+class SnapshotReceiver:
+    """
+    Rebuilds the server world from snapshot deltas on the client
+
+    Keeps the world as of every snapshot the server might still use as a baseline, turns each delta
+    into normal creates, updates and deletes against the snapshot we applied last, and acks it
+    """
+
+    def __init__(self, game: "GamemodeClient"):
+
+        self.game = game
+
+        self.states: Dict[int, WorldState] = {0: {}}
+        self.latest = 0
+
+    def apply(self, packet: List[dict]) -> List[dict]:
+        """Turn a snapshot packet into the updates the client should load"""
+
+        header = packet[0]["data"]
+
+        number = header["number"]
+        baseline = header["baseline"]
+
+        # old or duplicate snapshots have nothing new in them
+        if number <= self.latest or baseline not in self.states:
+            return []
+
+        new_state = apply_world_updates(self.states[baseline], packet[1:])
+
+        updates = list(world_diff(self.states[self.latest], new_state).values())
+
+        self.states[number] = new_state
+        self.latest = number
+
+        # the server only ever moves our baseline forward, so anything older than this one is useless
+        # except the empty world, which the server falls back to if our baseline is too old
+        for state_number in [state_number for state_number in self.states if 0 < state_number < baseline]:
+            del self.states[state_number]
+
+        self.game.outgoing_updates_queue.append(ack_update(number))
+
+        return updates
@@ -0,0 +1,311 @@
+import math
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from pygame import Rect
+
+if TYPE_CHECKING:
+    from onepointsix.entity import Entity
+    from onepointsix.gamemode_client import GamemodeClient
+    from onepointsix.gamemode_server import GamemodeServer
+
+
+Position = Tuple[float, float]
+
+Cell = Tuple[int, int]
+
+
+class SpatialGrid:
+    """
+    Uniform grid of square cells holding entity ids
+
+    Finding the entities near a point only has to look at the cells around it instead of every entity
+    """
+
+    def __init__(self, cell_size: float):
+
+        self.cell_size = cell_size
+
+        self.cells: Dict[Cell, Set[str]] = {}
+        self.positions: Dict[str, Position] = {}
+        self.entity_cells: Dict[str, Cell] = {}
+
+    def __contains__(self, entity_id: str) -> bool:
+        return entity_id in self.positions
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.positions)
+
+    def cell_of(self, position: Position) -> Cell:
+        return (
+            math.floor(position[0] / self.cell_size),
+            math.floor(position[1] / self.cell_size)
+        )
+
+    def move(self, entity_id: str, position: Position):
+        """Insert an entity, or update its position if it is already in the grid"""
+
+        self.positions[entity_id] = position
+
+        cell = self.cell_of(position)
+
+        previous_cell = self.entity_cells.get(entity_id)
+
+        if previous_cell == cell:
+            return
+
+        if previous_cell is not None:
+            self._remove_from_cell(entity_id, previous_cell)
+
+        self.entity_cells[entity_id] = cell
+
+        self.cells.setdefault(cell, set()).add(entity_id)
+
+    def remove(self, entity_id: str):
+
+        cell = self.entity_cells.pop(entity_id, None)
+
+        if cell is None:
+            return
+
+        del self.positions[entity_id]
+
+        self._remove_from_cell(entity_id, cell)
+
+    def _remove_from_cell(self, entity_id: str, cell: Cell):
+
+        cell_entities = self.cells[cell]
+
+        cell_entities.discard(entity_id)
+
+        # dont keep empty cells around in big sparse levels
+        if not cell_entities:
+            del self.cells[cell]
+
+    def query_radius(self, position: Position, radius: float) -> List[str]:
+        """Every entity within radius of position"""
+
+        x, y = position
+
+        min_cell_x, min_cell_y = self.cell_of((x - radius, y - radius))
+        max_cell_x, max_cell_y = self.cell_of((x + radius, y + radius))
+
+        radius_squared = radius * radius
+
+        found: List[str] = []
+
+        for cell_x in range(min_cell_x, max_cell_x + 1):
+            for cell_y in range(min_cell_y, max_cell_y + 1):
+
+                for entity_id in self.cells.get((cell_x, cell_y), ()):
+
+                    entity_x, entity_y = self.positions[entity_id]
+
+                    if (entity_x - x) ** 2 + (entity_y - y) ** 2 <= radius_squared:
+                        found.append(entity_id)
+
+        return found
+
+    def query_rect(self, rect: Rect) -> List[str]:
+        """Every entity inside rect, using the same edges as Rect.collidepoint"""
+
+        min_cell_x, min_cell_y = self.cell_of((rect.left, rect.top))
+        max_cell_x, max_cell_y = self.cell_of((rect.right, rect.bottom))
+
+        found: List[str] = []
+
+        for cell_x in range(min_cell_x, max_cell_x + 1):
+            for cell_y in range(min_cell_y, max_cell_y + 1):
+
+                for entity_id in self.cells.get((cell_x, cell_y), ()):
+
+                    entity_x, entity_y = self.positions[entity_id]
+
+                    if rect.left <= entity_x < rect.right and rect.top <= entity_y < rect.bottom:
+                        found.append(entity_id)
+
+        return found
+
+    def nearest(self, position: Position, max_distance: Optional[float] = None, where: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """
+        The closest entity to position, or None if there isn't one within max_distance
+
+        where can be used to skip entities, like the one doing the searching.
+        Searches outwards one ring of cells at a time, and stops as soon as no closer entity can be in the next ring.
+        If that would mean going through more cells than there are entities, it checks every entity instead
+        """
+
+        if not self.positions:
+            return None
+
+        x, y = position
+
+        center_x, center_y = self.cell_of(position)
+
+        best_entity_id: Optional[str] = None
+        best_distance_squared = math.inf
+
+        if max_distance is not None:
+            best_distance_squared = max_distance * max_distance
+
+        cells_checked = 0
+
+        # occupied or not, so empty space between us and the entities is bounded too
+        cells_visited = 0
+
+        ring = 0
+
+        while True:
+
+            cells_visited += 8 * ring or 1
+
+            # past this point going outwards would cost more than looking at every entity,
+            # which happens when the entities are far apart or far away from position
+            if cells_visited > len(self.positions):
+                return self._nearest_of_all(position, best_entity_id, best_distance_squared, where)
+
+            for cell in self._ring(center_x, center_y, ring):
+
+                cell_entities = self.cells.get(cell)
+
+                if not cell_entities:
+                    continue
+
+                cells_checked += 1
+
+                for entity_id in cell_entities:
+
+                    entity_x, entity_y = self.positions[entity_id]
+
+                    distance_squared = (entity_x - x) ** 2 + (entity_y - y) ** 2
+
+                    if distance_squared > best_distance_squared or (distance_squared == best_distance_squared and best_entity_id is not None):
+                        continue
+
+                    if where is not None and not where(entity_id):
+                        continue
+
+                    best_entity_id = entity_id
+                    best_distance_squared = distance_squared
+
+            # everything in the next ring is at least this far away
+            next_ring_distance = ring * self.cell_size
+
+            if next_ring_distance * next_ring_distance > best_distance_squared:
+                return best_entity_id
+
+            # looked at every occupied cell, there is nothing further out
+            if cells_checked == len(self.cells):
+                return best_entity_id
+
+            ring += 1
+
+    def _nearest_of_all(self, position: Position, best_entity_id: Optional[str], best_distance_squared: float, where: Optional[Callable[[str], bool]]) -> Optional[str]:
+        """Finish a nearest() search by checking every entity, starting from the best one found in the rings so far"""
+
+        x, y = position
+
+        for entity_id, (entity_x, entity_y) in self.positions.items():
+
+            distance_squared = (entity_x - x) ** 2 + (entity_y - y) ** 2
+
+            if distance_squared > best_distance_squared or (distance_squared == best_distance_squared and best_entity_id is not None):
+                continue
+
+            if where is not None and not where(entity_id):
+                continue
+
+            best_entity_id = entity_id
+            best_distance_squared = distance_squared
+
+        return best_entity_id
+
+    @staticmethod
+    def _ring(center_x: int, center_y: int, ring: int) -> Iterator[Cell]:
+        """The cells ring steps away from the center cell"""
+
+        if ring == 0:
+            yield (center_x, center_y)
+
+            return
+
+        for cell_x in range(center_x - ring, center_x + ring + 1):
+            yield (cell_x, center_y - ring)
+            yield (cell_x, center_y + ring)
+
+        for cell_y in range(center_y - ring + 1, center_y + ring):
+            yield (center_x - ring, cell_y)
+            yield (center_x + ring, cell_y)
+
+
+class SpatialIndex(SpatialGrid):
+    """
+    Grid of every entity in a game that has a position
+
+    Only entities that may have moved are looked at: ones that were created, got a network update or had a
+    networked field assigned are moved to their cell at the start of the next tick, and killed ones are removed
+    straight away. Entities that move some other way, like a plain attribute changed by the game, have to call
+    moved(), which also updates their cell straight away.
+    The query methods return the entities themselves
+    """
+
+    def __init__(self, game: Union["GamemodeClient", "GamemodeServer"], cell_size: float):
+        super().__init__(cell_size)
+
+        self.game = game
+
+        # entity id -> entity, for every entity that may have moved since the last refresh
+        self.stale: Dict[str, "Entity"] = {}
+
+    def entity_changed(self, entity: "Entity"):
+        """Check where the entity is at the next refresh, by then whatever changed it is done"""
+
+        self.stale[entity.id] = entity
+
+    def refresh(self):
+        """Bring the cells of the entities that may have moved since last time up to date"""
+
+        stale = self.stale
+
+        self.stale = {}
+
+        for entity in stale.values():
+            self.entity_moved(entity)
+
+    def remove(self, entity_id: str):
+
+        self.stale.pop(entity_id, None)
+
+        super().remove(entity_id)
+
+    def entity_moved(self, entity: "Entity"):
+
+        position = entity.get_position()
+
+        if position is None:
+            self.remove(entity.id)
+
+        else:
+            self.move(entity.id, position)
+
+    def entities_in_radius(self, position: Position, radius: float) -> List["Entity"]:
+        return [self.game.entities[entity_id] for entity_id in self.query_radius(position, radius)]
+
+    def entities_in_rect(self, rect: Rect) -> List["Entity"]:
+        return [self.game.entities[entity_id] for entity_id in self.query_rect(rect)]
+
+    def nearest_entity(self, position: Position, max_distance: Optional[float] = None, where: Optional[Callable[["Entity"], bool]] = None) -> Optional["Entity"]:
+
+        entity_filter = None
+
+        if where is not None:
+            entity_filter = lambda entity_id: where(self.game.entities[entity_id])
+
+        entity_id = self.nearest(position, max_distance, entity_filter)
+
+        if entity_id is None:
+            return None
+
+        return self.game.entities[entity_id]
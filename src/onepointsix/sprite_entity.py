@@ -83,17 +83,17 @@ class SpriteEntity(DrawableEntity):
 
     @staticmethod
     def deserialize(entity_data: dict, entity_id: str, game: GamemodeClient | GamemodeServer) -> dict:
-        
+
+        deserialized_data = DrawableEntity.deserialize(entity_data, entity_id, game)
+
         if entity_data["active_sprite"] is None:
-            entity_data["active_sprite"] = None
+            deserialized_data["active_sprite"] = None
         else:
-            entity_data["active_sprite"] = game.resources[entity_data["active_sprite"]]
-        
-        entity_data["scale"] = entity_data["scale"]
+            deserialized_data["active_sprite"] = game.resources[entity_data["active_sprite"]]
         
-        entity_data.update(DrawableEntity.deserialize(entity_data, entity_id, game))
+        deserialized_data["scale"] = entity_data["scale"]
 
-        return entity_data
+        return deserialized_data
 
     def draw_onto_body(self):
         """Draw sprite onto pymunk body if the entity has one"""
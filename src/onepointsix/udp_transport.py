@@ -0,0 +1,724 @@
+import heapq
+import random
+import select
+import socket
+import struct
+import time
+import zlib
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from onepointsix.codec import Codec, JsonCodec
+from onepointsix.compression import Compression, OneShotCompression
+from onepointsix.headered_socket import Disconnected, PayloadTooLarge
+from onepointsix.helpers import merge_dicts
+from onepointsix.update_batch import UpdateBatch
+
+Address = Tuple[str, int]
+
+TRANSPORTS = ["tcp", "udp"]
+
+# every datagram starts with: kind, the next reliable sequence we are waiting for,
+# the newest unreliable sequence we got and a bitfield of which of the 32 before it we got
+PACKET_HEADER = struct.Struct(">BIII")
+
+# sequence, index of this fragment in its message, number of fragments in the message
+RELIABLE_HEADER = struct.Struct(">IHH")
+
+# sequence, number of reliable fragments that have to be delivered before this can be applied
+UNRELIABLE_HEADER = struct.Struct(">II")
+
+RELIABLE = 0
+UNRELIABLE = 1
+ACK = 2
+CLOSE = 3
+
+# payload bytes per datagram, small enough that ip doesnt have to fragment it on most links
+MAX_FRAGMENT_SIZE = 1200
+
+# how far ahead of the next expected reliable fragment we buffer, anything further is dropped and resent later
+MAX_RELIABLE_WINDOW = 65536
+
+
+class UdpEndpoint:
+    """
+    A UDP socket shared by every connection that goes through it
+
+    A server endpoint gets one UdpConnection per remote address, handed out by accept() like a listening TCP socket.
+    A client just has the one connection to the server.
+    The endpoint itself never blocks, connections wait on it when they are set to blocking
+
+    Outgoing datagrams can be dropped or delayed on purpose with loss, latency and jitter,
+    so the game can be tested over loopback as if it was on a bad network
+    """
+
+    def __init__(self, loss: float = 0, latency: float = 0, jitter: float = 0, seed: Optional[int] = None, timeout: float = 10, resend_interval: float = 0.1, loss_timeout: float = 0.5):
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+        self.connections: Dict[Address, "UdpConnection"] = {}
+        self.pending_connections: Deque["UdpConnection"] = deque()
+        self.listening = False
+
+        self.timeout = timeout # seconds without hearing from a peer before it counts as disconnected
+        self.resend_interval = resend_interval # seconds before an unacked reliable fragment is sent again
+        self.loss_timeout = loss_timeout # seconds before an unacked unreliable message counts as lost
+
+        # simulated network conditions
+        self.loss = loss # chance of dropping each outgoing datagram
+        self.latency = latency # seconds every outgoing datagram is held back
+        self.jitter = jitter # up to this many extra seconds, picked per datagram
+        self.random = random.Random(seed)
+
+        # (send time, order, datagram, address) of datagrams held back by the simulated latency
+        self.delayed: List[Tuple[float, int, bytes, Address]] = []
+        self.delayed_count = 0
+
+        self.dropped_datagrams = 0
+
+    def bind(self, address: Address):
+        self.socket.bind(address)
+
+    def listen(self, backlog: int = 0):
+        self.listening = True
+
+    def setblocking(self, flag: bool):
+        # only connections can block, the endpoint is shared
+        pass
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
+    def accept(self) -> Tuple["UdpConnection", Address]:
+
+        self.pump()
+
+        if not self.pending_connections:
+            raise BlockingIOError()
+
+        connection = self.pending_connections.popleft()
+
+        return connection, connection.address
+
+    def pump(self, timeout: float = 0):
+        """Send delayed datagrams that are due, then hand every datagram waiting in the socket to its connection"""
+
+        self.send_delayed()
+
+        if timeout > 0:
+            select.select([self.socket], [], [], timeout)
+
+        while True:
+
+            try:
+                datagram, address = self.socket.recvfrom(65535)
+
+            except BlockingIOError:
+                break
+
+            except ConnectionResetError:
+                # windows reports an earlier datagram being refused like this, there is nothing to do about it
+                continue
+
+            connection = self.connections.get(address)
+
+            if connection is None:
+
+                if not self.listening or not is_first_fragment(datagram):
+                    continue
+
+                connection = UdpConnection(self)
+                connection.address = address
+
+                self.connections[address] = connection
+                self.pending_connections.append(connection)
+
+            connection.datagram_received(datagram)
+
+    def send_datagram(self, datagram: bytes, address: Address):
+
+        if self.loss and self.random.random() < self.loss:
+            self.dropped_datagrams += 1
+
+            return
+
+        if self.latency or self.jitter:
+
+            send_time = time.monotonic() + self.latency + self.random.uniform(0, self.jitter)
+
+            heapq.heappush(self.delayed, (send_time, self.delayed_count, datagram, address))
+
+            self.delayed_count += 1
+
+            return
+
+        self._sendto(datagram, address)
+
+    def send_delayed(self):
+
+        now = time.monotonic()
+
+        while self.delayed and self.delayed[0][0] <= now:
+
+            send_time, order, datagram, address = heapq.heappop(self.delayed)
+
+            self._sendto(datagram, address)
+
+    def _sendto(self, datagram: bytes, address: Address):
+
+        try:
+            self.socket.sendto(datagram, address)
+
+        except (BlockingIOError, ConnectionRefusedError):
+            # same as losing it on the way, anything reliable is sent again
+            self.dropped_datagrams += 1
+
+    def forget(self, connection: "UdpConnection"):
+
+        if self.connections.get(connection.address) is connection:
+            del self.connections[connection.address]
+
+    def close(self):
+
+        for connection in list(self.connections.values()):
+            connection.close()
+
+        self.socket.close()
+
+
+def split_channels(updates: List[dict]) -> Tuple[List[dict], List[dict]]:
+    """
+    The updates that have to go over the reliable channel, and the ones that can go over the unreliable one
+
+    Only entity updates can be unreliable, and updates to an entity that is created or deleted in the same list
+    stay reliable, so they can't overtake it
+    """
+
+    reliable_entity_ids = {update["entity_id"] for update in updates if update["update_type"] != "update"}
+
+    reliable_updates = []
+    unreliable_updates = []
+
+    for update in updates:
+
+        if update["update_type"] == "update" and update["entity_id"] not in reliable_entity_ids:
+            unreliable_updates.append(update)
+
+        else:
+            reliable_updates.append(update)
+
+    return reliable_updates, unreliable_updates
+
+
+def is_first_fragment(datagram: bytes) -> bool:
+    """Whether a datagram from an unknown address is the start of a hello, anything else is left over from an old connection"""
+
+    if len(datagram) < PACKET_HEADER.size + RELIABLE_HEADER.size or datagram[0] != RELIABLE:
+        return False
+
+    sequence, index, count = RELIABLE_HEADER.unpack_from(datagram, PACKET_HEADER.size)
+
+    return sequence == 0
+
+
+class UdpConnection:
+    """
+    One peer of a UdpEndpoint, with the same codec, compression, send_headered() and recv_frames() as a HeaderedSocket
+
+    Frames sent with send_headered() go over a reliable, ordered channel: they are split into fragments that are
+    resent until acked and delivered in order, which is what the handshake and creates and deletes need.
+
+    send_updates() also uses a sequenced unreliable channel for entity updates, so a lost datagram doesn't hold up
+    every update after it. The receiver drops unreliable messages older than the newest one it has,
+    and ones that arrive before the creates they depend on.
+    Instead of resending lost messages, the sender resends the current value of every field that was in them,
+    so the receiver always ends up with the latest state even if it never sees some of the steps in between
+    """
+
+    supports_unreliable = True
+
+    def __init__(self, endpoint: Optional[UdpEndpoint] = None):
+
+        # a client makes its own endpoint, the server hands its own to every connection it accepts
+        self.endpoint = endpoint if endpoint is not None else UdpEndpoint()
+        self.address: Optional[Address] = None
+
+        # same wire options as a HeaderedSocket, picked during the handshake
+        # header_format is kept for compatibility, datagrams already have boundaries
+        self.codec: Codec = JsonCodec()
+        self.compression: Compression = OneShotCompression(zlib.Z_BEST_COMPRESSION)
+        self.header_format = "ascii"
+        self.replication = "stream"
+        self.join: Optional[str] = None
+
+        self.blocking = True
+        self.closed = False
+        self.remote_closed = False
+        self.last_received = time.monotonic()
+        self.ack_pending = False
+
+        # complete frames waiting to be returned by recv_frames
+        self.inbox: Deque[bytes] = deque()
+
+        # reliable channel
+        self.next_reliable_sequence = 0
+        self.unacked: OrderedDict[int, Tuple[bytes, float]] = OrderedDict() # sequence -> (fragment, last time it was sent)
+        self.unacked_bytes = 0
+        self.next_expected = 0
+        self.out_of_order: Dict[int, Tuple[int, int, bytes]] = {} # sequence -> (index, count, fragment)
+        self.fragments: List[bytes] = [] # fragments of the message currently being put back together
+
+        # unreliable channel, sequence 0 means nothing
+        self.next_unreliable_sequence = 1
+        self.in_flight: Dict[int, Tuple[float, Dict[str, Set[str]]]] = {} # sequence -> (time sent, entity id -> field keys in it)
+        self.newest_unreliable = 0
+        self.received_bits = 0 # bit n is set if we got newest_unreliable - 1 - n
+
+        # entity id -> everything we have sent about it merged together, lost fields are resent from here
+        self.sent_fields: Dict[str, dict] = {}
+
+        # entity id -> keys of fields that were in lost messages and havent been resent yet
+        self.lost_fields: Dict[str, Set[str]] = {}
+
+        self.resent_fragments = 0
+        self.lost_messages = 0
+        self.stale_messages = 0
+        self.healed_fields = 0
+
+    def connect(self, address: Address):
+
+        host, port = address
+
+        # replies come from the ip, so that is what the endpoint has to look connections up by
+        self.address = (socket.gethostbyname(host), port)
+
+        self.endpoint.connections[self.address] = self
+
+        self.last_received = time.monotonic()
+
+    @property
+    def pending_bytes(self) -> int:
+        """Reliable bytes the peer hasnt acked yet, the udp version of a send buffer that isnt draining"""
+
+        return self.unacked_bytes
+
+    def flush(self) -> bool:
+        # there is no send buffer, resends happen in service()
+        return True
+
+    def shutdown(self, how: int):
+        self.close()
+
+    def setblocking(self, flag: bool):
+        self.blocking = flag
+
+    def getblocking(self) -> bool:
+        return self.blocking
+
+    def fileno(self) -> int:
+        return self.endpoint.fileno()
+
+    def close(self):
+
+        if not self.closed and self.address is not None:
+            self._send_packet(CLOSE, b"")
+
+            self.endpoint.send_delayed()
+
+        self.closed = True
+
+        self.unacked.clear()
+        self.unacked_bytes = 0
+
+        self.endpoint.forget(self)
+
+    def send_headered(self, data, header_size=7):
+        """Send a frame over the reliable channel"""
+
+        self._send_reliable(bytes(data))
+
+    def send_updates(self, updates: List[dict]) -> int:
+        """
+        Encode, compress and send a list of updates, returns the number of payload bytes sent
+
+        Entity updates go over the unreliable channel, everything else over the reliable one, see split_channels()
+        """
+
+        # a snapshot only means something as a whole
+        if updates and updates[0]["update_type"] == "snapshot":
+            return self._send_reliable(self.encode(updates))
+
+        reliable_updates, unreliable_updates = split_channels(updates)
+
+        self.remember_sent(updates)
+
+        sent_bytes = 0
+
+        if reliable_updates:
+            sent_bytes += self._send_reliable(self.encode(reliable_updates))
+
+        # an empty list still has to go out, the other side uses it to know we are here
+        if unreliable_updates or not reliable_updates:
+            sent_bytes += self._send_unreliable(unreliable_updates)
+
+        return sent_bytes
+
+    def send_batch(self, batch: UpdateBatch) -> int:
+        """
+        Like send_updates(), but the split into channels and the payloads are shared with every other client the batch goes to
+
+        Only the sequence numbers and what we remember having sent are per connection
+        """
+
+        updates = list(batch.decoded_updates())
+
+        if updates and updates[0]["update_type"] == "snapshot":
+            return self._send_reliable(batch.payload_for(self))
+
+        if batch.channels is None:
+            reliable_updates, unreliable_updates = split_channels(updates)
+
+            batch.channels = (UpdateBatch(batch.recipients, reliable_updates), UpdateBatch(batch.recipients, unreliable_updates))
+
+        reliable_batch, unreliable_batch = batch.channels
+
+        self.remember_sent(updates)
+
+        sent_bytes = 0
+
+        if reliable_batch.updates:
+            sent_bytes += self._send_reliable(reliable_batch.payload_for(self))
+
+        if unreliable_batch.updates or not reliable_batch.updates:
+            sent_bytes += self._send_unreliable(unreliable_batch.updates, unreliable_batch.payload_for(self))
+
+        return sent_bytes
+
+    def encode(self, updates: List[dict]) -> bytes:
+        return self.compression.compress(self.codec.encode(updates))
+
+    def remember_sent(self, updates: List[dict]):
+
+        for update in updates:
+
+            match update["update_type"]:
+
+                case "create":
+                    self.sent_fields[update["entity_id"]] = update["data"]
+
+                    self.lost_fields.pop(update["entity_id"], None)
+
+                case "update":
+                    self.sent_fields[update["entity_id"]] = merge_dicts(
+                        self.sent_fields.get(update["entity_id"], {}), update["data"]
+                    )
+
+                case "delete":
+                    self.sent_fields.pop(update["entity_id"], None)
+
+                    self.lost_fields.pop(update["entity_id"], None)
+
+    def _send_reliable(self, payload: bytes) -> int:
+
+        fragments = [payload[start:start + MAX_FRAGMENT_SIZE] for start in range(0, len(payload) or 1, MAX_FRAGMENT_SIZE)]
+
+        if len(fragments) > 0xFFFF:
+            raise PayloadTooLarge(f"Payload of {len(payload)} bytes needs more than {0xFFFF} fragments")
+
+        now = time.monotonic()
+
+        for index, fragment in enumerate(fragments):
+
+            body = RELIABLE_HEADER.pack(self.next_reliable_sequence, index, len(fragments)) + fragment
+
+            self.unacked[self.next_reliable_sequence] = (body, now)
+            self.unacked_bytes += len(body)
+            self.next_reliable_sequence += 1
+
+            self._send_packet(RELIABLE, body)
+
+        return len(payload)
+
+    def _send_unreliable(self, updates: List[dict], payload: Optional[bytes] = None) -> int:
+
+        if payload is None:
+            payload = self.encode(updates)
+
+        # losing any fragment would lose the whole thing anyway
+        if len(payload) > MAX_FRAGMENT_SIZE:
+            return self._send_reliable(payload)
+
+        fields: Dict[str, Set[str]] = {}
+
+        for update in updates:
+            fields.setdefault(update["entity_id"], set()).update(update["data"])
+
+        sequence = self.next_unreliable_sequence
+        self.next_unreliable_sequence += 1
+
+        self.in_flight[sequence] = (time.monotonic(), fields)
+
+        self._send_packet(UNRELIABLE, UNRELIABLE_HEADER.pack(sequence, self.next_reliable_sequence) + payload)
+
+        return len(payload)
+
+    def _send_packet(self, kind: int, body: bytes):
+
+        if self.closed:
+            return
+
+        # every packet carries our acks, so they only need their own packet when we have nothing else to send
+        header = PACKET_HEADER.pack(kind, self.next_expected, self.newest_unreliable, self.received_bits)
+
+        self.endpoint.send_datagram(header + body, self.address)
+
+        self.ack_pending = False
+
+    def datagram_received(self, datagram: bytes):
+
+        if len(datagram) < PACKET_HEADER.size:
+            return
+
+        kind, reliable_ack, unreliable_ack, unreliable_ack_bits = PACKET_HEADER.unpack_from(datagram)
+
+        self.last_received = time.monotonic()
+
+        self.reliable_acked(reliable_ack)
+        self.unreliable_acked(unreliable_ack, unreliable_ack_bits)
+
+        body = datagram[PACKET_HEADER.size:]
+
+        if kind == RELIABLE:
+            self.reliable_received(body)
+
+        elif kind == UNRELIABLE:
+            self.unreliable_received(body)
+
+        elif kind == CLOSE:
+            self.remote_closed = True
+
+    def reliable_acked(self, next_expected: int):
+        """The peer has every reliable fragment before next_expected"""
+
+        while self.unacked and next(iter(self.unacked)) < next_expected:
+
+            sequence, (body, last_sent) = self.unacked.popitem(last=False)
+
+            self.unacked_bytes -= len(body)
+
+    def reliable_received(self, body: bytes):
+
+        if len(body) < RELIABLE_HEADER.size:
+            return
+
+        sequence, index, count = RELIABLE_HEADER.unpack_from(body)
+
+        # even a duplicate needs acking, the ack for the first copy might have been lost
+        self.ack_pending = True
+
+        if sequence < self.next_expected or sequence in self.out_of_order or sequence >= self.next_expected + MAX_RELIABLE_WINDOW:
+            return
+
+        self.out_of_order[sequence] = (index, count, body[RELIABLE_HEADER.size:])
+
+        while self.next_expected in self.out_of_order:
+
+            index, count, fragment = self.out_of_order.pop(self.next_expected)
+
+            self.next_expected += 1
+
+            self.fragments.append(fragment)
+
+            if index == count - 1:
+                self.inbox.append(b"".join(self.fragments))
+
+                self.fragments = []
+
+    def unreliable_received(self, body: bytes):
+
+        if len(body) < UNRELIABLE_HEADER.size:
+            return
+
+        sequence, required_reliable = UNRELIABLE_HEADER.unpack_from(body)
+
+        self.ack_pending = True
+
+        # it refers to entities we havent been told about yet, or applying it would roll fields back to older values
+        # either way we dont ack it, and the sender resends the fields it had
+        if required_reliable > self.next_expected or sequence <= self.newest_unreliable:
+            self.stale_messages += 1
+
+            return
+
+        shift = sequence - self.newest_unreliable
+
+        self.received_bits = ((self.received_bits << shift) | (1 << (shift - 1))) & 0xFFFFFFFF if shift <= 32 else 0
+        self.newest_unreliable = sequence
+
+        self.inbox.append(body[UNRELIABLE_HEADER.size:])
+
+    def unreliable_acked(self, newest: int, bits: int):
+        """
+        The peer got newest and the ones set in bits
+
+        It drops anything older than the newest message it has, so every older message that isn't acked by now never will be
+        """
+
+        if newest == 0:
+            return
+
+        for sequence in [sequence for sequence in self.in_flight if sequence <= newest]:
+
+            distance = newest - sequence
+
+            if distance == 0 or (distance <= 32 and bits >> (distance - 1) & 1):
+                del self.in_flight[sequence]
+
+            else:
+                self.unreliable_lost(sequence)
+
+    def unreliable_lost(self, sequence: int):
+
+        sent_time, fields = self.in_flight.pop(sequence)
+
+        self.lost_messages += 1
+
+        for entity_id, keys in fields.items():
+
+            # entities that were deleted since dont need fixing
+            if entity_id in self.sent_fields:
+                self.lost_fields.setdefault(entity_id, set()).update(keys)
+
+    def resend_lost_fields(self):
+        """Send the newest value of every field that was in a lost message"""
+
+        updates = []
+
+        for entity_id, keys in self.lost_fields.items():
+
+            entity_fields = self.sent_fields.get(entity_id)
+
+            if entity_fields is None:
+                continue
+
+            data = {key: entity_fields[key] for key in keys if key in entity_fields}
+
+            if not data:
+                continue
+
+            self.healed_fields += len(data)
+
+            updates.append({
+                "update_type": "update",
+                "entity_id": entity_id,
+                "entity_type": None,
+                "data": data
+            })
+
+        self.lost_fields.clear()
+
+        if updates:
+            self._send_unreliable(updates)
+
+    def service(self):
+        """Resend reliable fragments and lost fields, and ack what we received if nothing else did"""
+
+        now = time.monotonic()
+
+        for sequence, (body, last_sent) in self.unacked.items():
+
+            if now - last_sent < self.endpoint.resend_interval:
+                continue
+
+            self._send_packet(RELIABLE, body)
+
+            self.unacked[sequence] = (body, now)
+
+            self.resent_fragments += 1
+
+        for sequence, (sent_time, fields) in list(self.in_flight.items()):
+            if now - sent_time > self.endpoint.loss_timeout:
+                self.unreliable_lost(sequence)
+
+        if self.lost_fields:
+            self.resend_lost_fields()
+
+        if self.ack_pending:
+            self._send_packet(ACK, b"")
+
+    def check_connected(self):
+
+        if self.closed:
+            raise Disconnected("Connection was closed")
+
+        if self.remote_closed or time.monotonic() - self.last_received > self.endpoint.timeout:
+
+            self.close()
+
+            raise Disconnected("Remote socket disconnected")
+
+    def wait_for_frames(self):
+        """Block until there is at least one complete frame"""
+
+        while not self.inbox:
+
+            self.check_connected()
+
+            self.endpoint.pump(timeout=self.endpoint.resend_interval)
+
+            self.service()
+
+    def recv_headered(self, header_size=7) -> bytes:
+        """Return the next complete frame, used for the handshake"""
+
+        self.endpoint.pump()
+
+        self.service()
+
+        if self.blocking:
+            self.wait_for_frames()
+
+        if not self.inbox:
+            self.check_connected()
+
+            raise BlockingIOError()
+
+        return self.inbox.popleft()
+
+    def recv_frames(self) -> List[bytes]:
+        """
+        Return every frame that has arrived, in the order it should be applied
+
+        Non blocking connections raise BlockingIOError if there isn't a complete frame yet.
+        Blocking connections wait until there is at least one
+        """
+
+        self.endpoint.pump()
+
+        self.service()
+
+        if self.blocking:
+            self.wait_for_frames()
+
+        if not self.inbox:
+            self.check_connected()
+
+            raise BlockingIOError()
+
+        frames = list(self.inbox)
+
+        self.inbox.clear()
+
+        return frames
+
+    def get_stats(self) -> dict:
+        return {
+            "unacked_fragments": len(self.unacked),
+            "resent_fragments": self.resent_fragments,
+            "in_flight_messages": len(self.in_flight),
+            "lost_messages": self.lost_messages,
+            "stale_messages": self.stale_messages,
+            "healed_fields": self.healed_fields,
+            "dropped_datagrams": self.endpoint.dropped_datagrams
+        }
@@ -0,0 +1,303 @@
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple, Union
+
+from onepointsix.codec import Codec
+from onepointsix.compression import Compression
+from onepointsix.update_queue import UpdateQueue
+
+
+class UpdateBatch:
+    """
+    A list of updates going to one or more clients
+
+    The batch is encoded at most once per codec, and compressed at most once per compression mode and level,
+    no matter how many clients it is sent to.
+    Stream compression keeps state per connection, so those clients reuse the encoded bytes but compress them themselves
+    """
+
+    # whether more updates can be added after the batch is queued
+    extendable = True
+
+    def __init__(self, recipients: FrozenSet[str], updates: Iterable[dict] = ()):
+
+        self.recipients = recipients
+
+        # kept exactly as queued, only a backlog merges them
+        self.updates: List[dict] = list(updates)
+
+        self.encoded: Dict[str, bytes] = {}
+        self.compressed: Dict[Tuple[str, str, int], bytes] = {}
+
+        # the reliable and unreliable halves, made by the first udp connection the batch is sent to
+        self.channels: Optional[Tuple["UpdateBatch", "UpdateBatch"]] = None
+
+    def add(self, updates: Iterable[dict]):
+
+        self.updates.extend(updates)
+
+        # anything encoded so far is out of date
+        self.encoded.clear()
+        self.compressed.clear()
+        self.channels = None
+
+    def decoded_updates(self) -> Iterable[dict]:
+        return self.updates
+
+    def encode(self, codec: Codec) -> bytes:
+
+        try:
+            return self.encoded[codec.name]
+
+        except KeyError:
+            encoded = codec.encode(list(self.updates))
+
+            self.encoded[codec.name] = encoded
+
+            return encoded
+
+    def payload_for(self, connection) -> bytes:
+        """The bytes to send to one connection, reusing work done for earlier recipients where possible"""
+
+        codec: Codec = connection.codec
+        compression: Compression = connection.compression
+
+        encoded = self.encode(codec)
+
+        if not compression.shareable:
+            return compression.compress(encoded)
+
+        key = (codec.name, compression.name, compression.level)
+
+        try:
+            compressed = self.compressed[key]
+
+        except KeyError:
+            compressed = compression.compress(encoded)
+
+            self.compressed[key] = compressed
+
+            return compressed
+
+        compression.record_shared(len(encoded), len(compressed))
+
+        return compressed
+
+
+class EncodedBatch(UpdateBatch):
+    """
+    A frame of updates that is relayed as the bytes it arrived as
+
+    It is only decoded if a recipient uses a different codec than the sender, or needs its updates merged into a backlog
+    """
+
+    extendable = False
+
+    def __init__(self, recipients: FrozenSet[str], codec: Codec, encoded: bytes):
+        super().__init__(recipients)
+
+        self.codec = codec
+        self.encoded[codec.name] = encoded
+        self.decoded = False
+
+    def add(self, updates: Iterable[dict]):
+        raise TypeError("Updates cant be added to an encoded batch")
+
+    def decoded_updates(self) -> Iterable[dict]:
+
+        if not self.decoded:
+            self.updates = self.codec.decode(self.encoded[self.codec.name])
+
+            self.decoded = True
+
+        return self.updates
+
+    def encode(self, codec: Codec) -> bytes:
+
+        try:
+            return self.encoded[codec.name]
+
+        except KeyError:
+            encoded = codec.encode(list(self.decoded_updates()))
+
+            self.encoded[codec.name] = encoded
+
+            return encoded
+
+
+class FrameBatch(UpdateBatch):
+    """A list of updates that has to arrive as a frame of its own, like a snapshot packet, so nothing else is added to it"""
+
+    extendable = False
+
+
+class BacklogBatch(UpdateBatch):
+    """
+    The private batch of a client that fell behind
+
+    Unlike other batches, everything added to it is merged per entity, so it only holds the latest state of each one
+    """
+
+    def __init__(self, recipients: FrozenSet[str], updates: Iterable[dict] = ()):
+        super().__init__(recipients)
+
+        self.updates = UpdateQueue(updates)
+
+
+class BatchedUpdateQueue:
+    """
+    Every client's queue of update batches for the next network tick
+
+    Updates queued for the same set of clients in a row go into the same batch,
+    so a broadcast becomes one shared batch and anything sent to a single client becomes its own frame
+
+    A client that is actually behind, because backpressure found it congested or because its updates were held
+    instead of sent on more than one network tick in a row, is backlogged: its batches are merged into one private
+    BacklogBatch, and it stops sharing batches until it is flushed.
+    That way a client that falls behind costs memory and bytes for each live entity, not for each update it missed
+    """
+
+    def __init__(self):
+
+        self.queues: Dict[str, List[UpdateBatch]] = {}
+
+        # clients whose updates were held at the last network tick instead of being sent
+        self.held: Set[str] = set()
+
+        # the private batch of every backlogged client
+        self.backlogs: Dict[str, BacklogBatch] = {}
+
+    def __getitem__(self, client_uuid: str) -> List[UpdateBatch]:
+        return self.queues.setdefault(client_uuid, [])
+
+    def __delitem__(self, client_uuid: str):
+        del self.queues[client_uuid]
+
+        self.held.discard(client_uuid)
+        self.backlogs.pop(client_uuid, None)
+
+    def __contains__(self, client_uuid: str) -> bool:
+        return client_uuid in self.queues
+
+    def pop(self, client_uuid: str, default=None):
+
+        self.held.discard(client_uuid)
+        self.backlogs.pop(client_uuid, None)
+
+        return self.queues.pop(client_uuid, default)
+
+    def items(self):
+        return self.queues.items()
+
+    def queue(self, updates: Union[List[dict], dict], destinations: List[str]):
+
+        if not destinations:
+            return
+
+        if isinstance(updates, dict):
+            updates = [updates]
+
+        if not updates:
+            return
+
+        # backlogged clients get their own copy merged into their backlog
+        for destination in destinations:
+            if destination in self.backlogs:
+                self.backlogs[destination].add(updates)
+
+        recipients = frozenset(
+            destination for destination in destinations if destination not in self.backlogs
+        )
+
+        if not recipients:
+            return
+
+        batch = self.latest_batch(recipients)
+
+        if batch is not None:
+            batch.add(updates)
+
+        else:
+            batch = UpdateBatch(recipients, updates)
+
+            for destination in recipients:
+                self[destination].append(batch)
+
+    def queue_frame(self, updates: List[dict], destinations: List[str]):
+        """Queue updates to be sent as their own frame, instead of being added to whatever else is queued"""
+
+        batch = FrameBatch(frozenset(destinations), updates)
+
+        for destination in destinations:
+
+            if destination in self.backlogs:
+                self.backlogs[destination].add(updates)
+
+                continue
+
+            self[destination].append(batch)
+
+    def queue_encoded(self, codec: Codec, encoded: bytes, destinations: List[str]):
+        """Queue a frame that was already encoded with codec, it is sent to every destination without being decoded"""
+
+        batch = EncodedBatch(frozenset(destinations), codec, encoded)
+
+        for destination in destinations:
+
+            if destination in self.backlogs:
+                self.backlogs[destination].add(batch.decoded_updates())
+
+                continue
+
+            self[destination].append(batch)
+
+    def hold(self, client_uuid: str):
+        """A client's updates are staying queued through this network tick, if they already did through the last one it is behind"""
+
+        if client_uuid in self.held and client_uuid not in self.backlogs:
+            self.compact(client_uuid)
+
+        self.held.add(client_uuid)
+
+    def compact(self, client_uuid: str):
+        """Merge everything queued for a client into one private batch, and keep merging into it until it is flushed"""
+
+        backlog = BacklogBatch(frozenset([client_uuid]))
+
+        for batch in self.queues.get(client_uuid, []):
+            backlog.add(batch.decoded_updates())
+
+        self.queues[client_uuid] = [backlog]
+        self.backlogs[client_uuid] = backlog
+
+    def latest_batch(self, recipients: FrozenSet[str]) -> Optional[UpdateBatch]:
+        """The batch these clients can keep adding to, only if it is the last thing queued for every one of them"""
+
+        batch = None
+
+        for destination in recipients:
+
+            queue = self.queues.get(destination)
+
+            if not queue:
+                return None
+
+            if batch is None:
+                batch = queue[-1]
+
+            if queue[-1] is not batch:
+                return None
+
+        if batch is None or not batch.extendable or batch.recipients != recipients:
+            return None
+
+        return batch
+
+    def take(self, client_uuid: str) -> List[UpdateBatch]:
+        """Remove and return everything queued for a client"""
+
+        batches = self.queues.get(client_uuid, [])
+
+        self.queues[client_uuid] = []
+        self.held.discard(client_uuid)
+        self.backlogs.pop(client_uuid, None)
+
+        return batches
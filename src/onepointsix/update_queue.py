@@ -0,0 +1,131 @@
+from typing import Dict, Iterable, Iterator, Optional
+
+from onepointsix.helpers import merge_dicts
+
+
+def merge_update(existing: dict, update: dict) -> dict:
+    """Fold an update's changed fields into an earlier create or update for the same entity"""
+
+    merged = dict(existing)
+
+    # updates sent by clients leave data out when there is none
+    merged["data"] = merge_dicts(existing.get("data") or {}, update.get("data") or {})
+
+    return merged
+
+
+class UpdateQueue:
+    """
+    Pending updates keyed by entity id, where only the latest state of each entity is kept
+
+    - successive updates are merged field by field
+    - updates are folded into a create that hasn't been sent yet
+    - a delete replaces pending updates, and cancels a pending create entirely
+    - a create after a delete goes after it, so the client removes the old entity first
+    - anything else, like snapshot headers and acks, is kept as it is
+
+    Each entity keeps the position of its first pending update, so creates and deletes go out
+    in the same order they were queued. The queue never holds more than one entry per live entity,
+    plus one for each pending delete
+    """
+
+    def __init__(self, updates: Iterable[dict] = ()):
+
+        # slot number -> update, dicts keep insertion order so slot order is send order
+        self.slots: Dict[int, dict] = {}
+
+        # entity id -> slot holding its latest pending update
+        self.latest_slots: Dict[str, int] = {}
+
+        # slot of a create -> slot of the delete it follows, so cancelling the create falls back to the delete
+        self.previous_slots: Dict[int, int] = {}
+
+        self.next_slot = 0
+
+        self.extend(updates)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self.slots.values())
+
+    def extend(self, updates: Iterable[dict]):
+
+        for update in updates:
+            self.add(update)
+
+    def add(self, update: dict):
+
+        # anything that isnt a create, update or delete, like a snapshot header or an ack, isnt merged with anything
+        if update["update_type"] not in ("create", "update", "delete"):
+            self.append(update, track=False)
+
+            return
+
+        entity_id = update["entity_id"]
+
+        slot = self.latest_slots.get(entity_id)
+
+        if slot is None:
+            self.append(update)
+
+            return
+
+        existing_type = self.slots[slot]["update_type"]
+        update_type = update["update_type"]
+
+        if update_type == "update":
+
+            # the entity is already gone as far as this client is concerned
+            if existing_type == "delete":
+                return
+
+            # dont modify the queued dict, other queues or the server itself might be holding it
+            self.slots[slot] = merge_update(self.slots[slot], update)
+
+        elif update_type == "delete":
+
+            if existing_type == "create":
+                # the client never saw this entity, so it doesnt need to hear about it at all
+                self.remove_slot(entity_id, slot)
+
+            elif existing_type == "update":
+                self.slots[slot] = update
+
+        elif update_type == "create":
+
+            if existing_type == "delete":
+                self.append(update, previous_slot=slot)
+
+            else:
+                # the newer create already contains the whole entity
+                self.remove_slot(entity_id, slot)
+
+                self.append(update)
+
+    def append(self, update: dict, previous_slot: Optional[int] = None, track: bool = True):
+
+        slot = self.next_slot
+
+        self.next_slot += 1
+
+        self.slots[slot] = update
+
+        if track:
+            self.latest_slots[update["entity_id"]] = slot
+
+        if previous_slot is not None:
+            self.previous_slots[slot] = previous_slot
+
+    def remove_slot(self, entity_id: str, slot: int):
+
+        del self.slots[slot]
+
+        previous_slot = self.previous_slots.pop(slot, None)
+
+        if previous_slot is None:
+            del self.latest_slots[entity_id]
+
+        else:
+            self.latest_slots[entity_id] = previous_slot
@@ -0,0 +1,94 @@
+import pytest
+
+from onepointsix.codec import BinaryCodec, CodecError, JsonCodec, UnknownCodec, get_codec
+
+
+UPDATES = [
+    {
+        "update_type": "create",
+        "entity_id": "a1b2c3",
+        "entity_type": "box",
+        "data": {
+            "updater": "4f2e",
+            "position": [12.5, -3.25],
+            "health": 100,
+            "name": "box" * 100,
+            "alive": True,
+            "target": None,
+            "tags": ("red", "heavy")
+        }
+    },
+    {"update_type": "delete", "entity_id": "d4e5f6", "entity_type": None, "data": {}}
+]
+
+
+@pytest.mark.parametrize("codec", [JsonCodec(), BinaryCodec()])
+def test_round_trip(codec):
+
+    decoded = codec.decode(codec.encode(UPDATES))
+
+    # json and the binary codec both turn tuples into lists
+    assert decoded[0]["data"]["tags"] == ["red", "heavy"]
+
+    decoded[0]["data"]["tags"] = tuple(decoded[0]["data"]["tags"])
+
+    assert decoded == UPDATES
+
+
+@pytest.mark.parametrize("value", [
+    0, 127, -128, 128, -129, 32767, -32769, 2**31, -2**31 - 1, 2**63 - 1, -2**63,
+    2**63, -2**64, 10**254, 10**255, -10**300, 10**1000
+])
+def test_int_sizes(value):
+
+    codec = BinaryCodec()
+
+    assert codec.decode(codec.encode([value])) == [value]
+
+
+def test_long_containers():
+
+    codec = BinaryCodec()
+
+    updates = [list(range(300)), {str(index): index for index in range(300)}, "x" * 70000]
+
+    assert codec.decode(codec.encode(updates)) == updates
+
+
+def test_binary_is_smaller_than_json():
+    assert len(BinaryCodec().encode(UPDATES)) < len(JsonCodec().encode(UPDATES))
+
+
+def test_unencodable_value():
+
+    with pytest.raises(CodecError):
+        BinaryCodec().encode([object()])
+
+
+@pytest.mark.parametrize("payload", [
+    b"",
+    b"\x63\x0b\x00",  # unsupported version
+    bytes([1, 0x0B, 2, 0x03]),  # list cut short
+    bytes([1, 0x0B, 0]) + b"\x00",  # trailing bytes
+    bytes([1, 0x7F]),  # unknown tag
+    bytes([1, 0x09, 2]) + b"\xff\xfe",  # invalid utf-8
+    bytes([1, 0x07, 3]) + b"abc"  # big int that isnt a number
+])
+def test_decode_rejects_bad_payloads(payload):
+
+    with pytest.raises(CodecError):
+        BinaryCodec().decode(payload)
+
+
+def test_get_codec():
+
+    assert isinstance(get_codec("binary"), BinaryCodec)
+
+    with pytest.raises(UnknownCodec):
+        get_codec("xml")
+
+
+def test_int_too_large_for_a_string():
+
+    with pytest.raises(CodecError):
+        BinaryCodec().encode([10**5000])
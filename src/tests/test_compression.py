@@ -0,0 +1,57 @@
+import pytest
+
+from onepointsix.compression import NoCompression, OneShotCompression, StreamCompression, UnknownCompressionMode, get_compression
+
+
+PAYLOADS = [b'[{"update_type": "update", "entity_id": "a1b2c3", "data": {"x": %d}}]' % number for number in range(20)]
+
+
+@pytest.mark.parametrize("mode", ["none", "oneshot", "stream"])
+def test_round_trip(mode):
+
+    sender = get_compression(mode)
+    receiver = get_compression(mode)
+
+    assert [receiver.decompress(sender.compress(payload)) for payload in PAYLOADS] == PAYLOADS
+
+    assert sender.stats.uncompressed_bytes_out == sum(len(payload) for payload in PAYLOADS)
+    assert receiver.stats.uncompressed_bytes_in == sender.stats.uncompressed_bytes_out
+
+
+def test_stream_is_smaller_for_similar_payloads():
+
+    stream = StreamCompression()
+    oneshot = OneShotCompression()
+
+    stream_sizes = [len(stream.compress(payload)) for payload in PAYLOADS]
+    oneshot_sizes = [len(oneshot.compress(payload)) for payload in PAYLOADS]
+
+    # the first payload has nothing to refer back to
+    assert sum(stream_sizes[1:]) < sum(oneshot_sizes[1:]) / 2
+
+
+def test_only_stateless_modes_are_shareable():
+
+    assert NoCompression.shareable and OneShotCompression.shareable
+    assert not StreamCompression.shareable
+
+    # so every stream connection compresses the same input differently
+    first = StreamCompression()
+    first.compress(PAYLOADS[0])
+
+    assert first.compress(PAYLOADS[1]) != StreamCompression().compress(PAYLOADS[1])
+
+
+def test_shared_payloads_are_counted():
+
+    compression = OneShotCompression()
+
+    compression.record_shared(100, 40)
+
+    assert compression.stats.as_dict()["ratio"] == 0.4
+
+
+def test_unknown_mode():
+
+    with pytest.raises(UnknownCompressionMode):
+        get_compression("lz4")
@@ -0,0 +1,139 @@
+from onepointsix.dispatch import EventSubscriptions
+from onepointsix.events import Tick, TickStart
+
+
+class Game:
+    uuid = "me"
+
+
+class Owner:
+    """Stands in for an entity, listeners only run locally if we are its updater"""
+
+    def __init__(self, subscriptions: EventSubscriptions, name: str, calls: list, updater: str = "me"):
+
+        self.subscriptions = subscriptions
+        self.name = name
+        self.calls = calls
+        self.updater = updater
+
+        subscriptions[Tick].append(self.on_tick)
+
+    def on_tick(self, event: Tick):
+        self.calls.append(self.name)
+
+    def kill(self):
+        self.subscriptions.unsubscribe_owner(self)
+
+
+def test_dispatch_in_subscription_order():
+
+    subscriptions = EventSubscriptions(Game())
+    calls = []
+
+    owners = [Owner(subscriptions, name, calls) for name in "abc"]
+
+    subscriptions.dispatch(Tick())
+
+    assert calls == ["a", "b", "c"]
+
+    # removing and re-adding moves a listener to the end, like a list
+    subscriptions[Tick].remove(owners[0].on_tick)
+    subscriptions[Tick].append(owners[0].on_tick)
+
+    calls.clear()
+    subscriptions.dispatch(Tick())
+
+    assert calls == ["b", "c", "a"]
+
+
+def test_only_local_listeners_run():
+
+    subscriptions = EventSubscriptions(Game())
+    calls = []
+
+    mine = Owner(subscriptions, "mine", calls)
+    theirs = Owner(subscriptions, "theirs", calls, updater="someone else")
+
+    subscriptions.dispatch(Tick())
+
+    assert calls == ["mine"]
+
+    theirs.updater = "me"
+    subscriptions.owner_changed(theirs)
+
+    calls.clear()
+    subscriptions.dispatch(Tick())
+
+    assert calls == ["mine", "theirs"]
+
+
+def test_killed_during_dispatch_is_not_called():
+
+    subscriptions = EventSubscriptions(Game())
+    calls = []
+
+    first = Owner(subscriptions, "first", calls)
+    second = Owner(subscriptions, "second", calls)
+
+    subscriptions[Tick].insert(0, lambda event: second.kill())
+
+    subscriptions.dispatch(Tick())
+
+    assert calls == ["first"]
+    assert id(second) not in subscriptions.owner_slots
+    assert len(subscriptions[Tick]) == 2
+
+
+def test_kill_only_touches_own_listeners():
+
+    subscriptions = EventSubscriptions(Game())
+    calls = []
+
+    owners = [Owner(subscriptions, str(index), calls) for index in range(5)]
+
+    subscriptions[TickStart].append(owners[2].on_tick)
+
+    owners[2].kill()
+
+    assert len(subscriptions[Tick]) == 4
+    assert len(subscriptions[TickStart]) == 0
+
+    subscriptions.dispatch(Tick())
+    subscriptions.dispatch(TickStart())
+
+    assert calls == ["0", "1", "3", "4"]
+
+
+def test_subscribed_during_dispatch_runs_at_the_end():
+
+    subscriptions = EventSubscriptions(Game())
+    calls = []
+
+    def subscribe_another(event: Tick):
+        calls.append("subscriber")
+
+        if len(calls) == 1:
+            Owner(subscriptions, "late", calls)
+
+    subscriptions[Tick].append(subscribe_another)
+    Owner(subscriptions, "early", calls)
+
+    subscriptions.dispatch(Tick())
+
+    assert calls == ["subscriber", "early", "late"]
+
+
+def test_assigning_a_plain_list():
+
+    subscriptions = EventSubscriptions(Game())
+    calls = []
+
+    subscriptions[Tick] = [lambda event: calls.append("x"), lambda event: calls.append("y")]
+
+    subscriptions.dispatch(Tick())
+
+    subscriptions[Tick].reverse()
+
+    subscriptions.dispatch(Tick())
+
+    assert calls == ["x", "y", "y", "x"]
@@ -0,0 +1,37 @@
+import pytest
+
+from onepointsix import handshake
+
+
+def test_hello_round_trip():
+
+    options = {"codecs": ["binary", "json"], "compression": ["stream"]}
+
+    assert handshake.decode_hello(handshake.encode_hello("c1", options)) == ("c1", options)
+
+
+def test_legacy_hello_is_a_bare_uuid():
+
+    assert handshake.decode_hello(b"4f2e") == ("4f2e", None)
+
+
+@pytest.mark.parametrize("data", [b"{not json", b'{"codecs": []}'])
+def test_invalid_hello(data):
+
+    with pytest.raises(handshake.InvalidHandshake):
+        handshake.decode_hello(data)
+
+
+def test_reply_round_trip():
+
+    assert handshake.decode_reply(handshake.encode_reply({"codec": "binary"})) == {"codec": "binary"}
+
+    with pytest.raises(handshake.InvalidHandshake):
+        handshake.decode_reply(b"nope")
+
+
+def test_pick_option():
+
+    assert handshake.pick_option(["json", "binary"], ["json", "binary"], "binary") == "binary"
+    assert handshake.pick_option(["msgpack", "json"], ["json", "binary"], "binary") == "json"
+    assert handshake.pick_option(["msgpack"], ["json", "binary"], "binary") is None
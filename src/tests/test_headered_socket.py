@@ -0,0 +1,135 @@
+import socket
+
+import pytest
+
+from onepointsix.headered_socket import Disconnected, HeaderedSocket, InvalidHeader, PayloadTooLarge, decode_header, encode_header
+
+
+def socket_pair(header_format: str = "binary", receive_buffer_size: int = 65536):
+    """A connected headered socket to receive on and a plain socket to write raw bytes to it with"""
+
+    receiving, sending = socket.socketpair()
+
+    headered = HeaderedSocket(receiving.family, receiving.type, fileno=receiving.detach(), receive_buffer_size=receive_buffer_size)
+    headered.header_format = header_format
+    headered.setblocking(False)
+
+    return headered, sending
+
+
+def frame(payload: bytes, header_format: str = "binary") -> bytes:
+    return encode_header(len(payload), header_format) + payload
+
+
+@pytest.mark.parametrize("header_format", ["binary", "ascii"])
+def test_header_round_trip(header_format):
+
+    for size in [0, 1, 9_999_999]:
+        assert decode_header(encode_header(size, header_format), header_format) == size
+
+
+def test_bad_headers():
+
+    with pytest.raises(PayloadTooLarge):
+        encode_header(10_000_000, "ascii")
+
+    with pytest.raises(PayloadTooLarge):
+        encode_header(2**32, "binary")
+
+    with pytest.raises(InvalidHeader):
+        decode_header(b"00x0001", "ascii")
+
+
+@pytest.mark.parametrize("header_format", ["binary", "ascii"])
+def test_frames_split_across_reads(header_format):
+
+    headered, sending = socket_pair(header_format)
+
+    data = frame(b"first", header_format) + frame(b"", header_format) + frame(b"second", header_format)
+
+    # the first frame and half of the second header
+    sending.sendall(data[:len(frame(b"first", header_format)) + 2])
+
+    assert [bytes(received) for received in headered.recv_frames()] == [b"first"]
+
+    with pytest.raises(BlockingIOError):
+        headered.recv_frames()
+
+    sending.sendall(data[len(frame(b"first", header_format)) + 2:])
+
+    assert [bytes(received) for received in headered.recv_frames()] == [b"", b"second"]
+
+
+def test_frames_bigger_than_the_buffer():
+
+    headered, sending = socket_pair(receive_buffer_size=16)
+
+    payloads = [b"a" * 10, b"b" * 100, b"c" * 5]
+
+    sending.sendall(b"".join(frame(payload) for payload in payloads))
+
+    received = []
+
+    while len(received) < len(payloads):
+        received += [bytes(received_frame) for received_frame in headered.recv_frames()]
+
+    assert received == payloads
+    assert len(headered.receive_buffer) >= 104
+
+
+def test_frames_stay_valid_until_the_next_call():
+
+    headered, sending = socket_pair(receive_buffer_size=32)
+
+    sending.sendall(frame(b"x" * 20) + frame(b"y" * 20)[:10])
+
+    frames = headered.recv_frames()
+
+    # the rest of the second frame makes the buffer move, the first one still points at the old data
+    sending.sendall(frame(b"y" * 20)[10:])
+
+    assert bytes(frames[0]) == b"x" * 20
+    assert [bytes(received) for received in headered.recv_frames()] == [b"y" * 20]
+
+
+def test_frames_before_a_disconnect_are_returned_first():
+
+    headered, sending = socket_pair()
+
+    sending.sendall(frame(b"last words"))
+    sending.close()
+
+    assert [bytes(received) for received in headered.recv_frames()] == [b"last words"]
+
+    with pytest.raises(Disconnected):
+        headered.recv_frames()
+
+
+def test_non_blocking_sends_are_buffered():
+
+    headered, reader = socket_pair()
+
+    headered.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+
+    payload = b"z" * 100_000
+
+    headered.send_headered(payload)
+
+    assert headered.pending_bytes > 0
+
+    reader.setblocking(False)
+
+    received = bytearray()
+
+    while len(received) < len(payload) + 4:
+
+        headered.flush()
+
+        try:
+            received += reader.recv(65536)
+
+        except BlockingIOError:
+            pass
+
+    assert headered.pending_bytes == 0
+    assert bytes(received) == frame(payload)
@@ -0,0 +1,40 @@
+from onepointsix.codec import JsonCodec
+from onepointsix.joining import WorldSnapshot
+
+
+def create(entity_id: str, size: int = 0) -> dict:
+    return {"update_type": "create", "entity_id": entity_id, "entity_type": "box", "data": {"blob": "x" * size}}
+
+
+def test_chunks_hold_at_most_chunk_size_entities():
+
+    creates = [create(str(number)) for number in range(10)]
+
+    snapshot = WorldSnapshot(creates, JsonCodec(), chunk_size=4)
+
+    assert snapshot.entity_count == 10
+    assert [len(chunk.decoded_updates()) for chunk in snapshot.chunks] == [4, 4, 2]
+    assert [update for chunk in snapshot.chunks for update in chunk.decoded_updates()] == creates
+
+
+def test_big_chunks_are_split_by_size():
+
+    codec = JsonCodec()
+
+    creates = [create(str(number), size=1000) for number in range(8)] + [create("huge", size=10_000)]
+
+    snapshot = WorldSnapshot(creates, codec, chunk_size=256, max_chunk_bytes=3000)
+
+    # everything fits except the one entity that is too big on its own
+    assert all(len(chunk.encode(codec)) <= 3000 for chunk in snapshot.chunks[:-1])
+    assert snapshot.chunks[-1].decoded_updates() == [creates[-1]]
+
+    assert [update for chunk in snapshot.chunks for update in chunk.decoded_updates()] == creates
+
+
+def test_empty_world():
+
+    snapshot = WorldSnapshot([], JsonCodec())
+
+    assert snapshot.entity_count == 0
+    assert snapshot.chunks == []
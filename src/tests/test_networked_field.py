@@ -0,0 +1,49 @@
+import pytest
+
+from onepointsix.networked_field import NetworkedField
+
+
+class Player:
+    """Stands in for an entity, only mark_dirty is needed"""
+
+    position = NetworkedField(serializer=list)
+    health = NetworkedField(key="hp")
+
+    def __init__(self):
+
+        # assigned before there is anywhere to record it, like before Entity.__init__
+        self.position = (0, 0)
+
+        self.dirty = []
+
+        self.health = 100
+
+    def mark_dirty(self, key: str):
+        self.dirty.append(key)
+
+
+def test_assigning_marks_the_key_dirty():
+
+    player = Player()
+
+    player.position = (1, 2)
+    player.health = 50
+
+    assert player.dirty == ["hp", "position", "hp"]
+    assert player.position == (1, 2)
+
+
+def test_serialize_uses_the_serializer():
+
+    player = Player()
+
+    assert Player.position.serialize(player) == [0, 0]
+    assert Player.health.serialize(player) == 100
+
+
+def test_unassigned_field():
+
+    player = Player.__new__(Player)
+
+    with pytest.raises(AttributeError):
+        player.health
@@ -0,0 +1,131 @@
+import struct
+
+import pytest
+
+from onepointsix.recording import DT, FILE_HEADER, NETWORK_TICK, RECEIVED, SENT, TICK, InvalidRecording, Recorder, read_recording, replay
+
+
+class Game:
+    """Stands in for a client, replay only runs its ticks and hands it frames"""
+
+    def __init__(self):
+        self.tick_count = 0
+        self.fixed_dt = None
+        self.dts = []
+        self.network_ticks = []
+        self.server = None
+
+    def game_tick(self):
+        self.tick_count += 1
+        self.dts.append(self.fixed_dt)
+
+    def network_tick(self):
+
+        try:
+            frames = self.server.recv_frames()
+
+        except BlockingIOError:
+            frames = []
+
+        self.network_ticks.append((self.tick_count, frames))
+
+
+def test_records_round_trip(tmp_path):
+
+    path = str(tmp_path / "game.rec")
+
+    recorder = Recorder(path)
+
+    recorder.record(SENT, 1, "c1", "json", b"[]")
+    recorder.record(NETWORK_TICK, 2)
+    recorder.close()
+
+    # recordings are appended to
+    recorder = Recorder(path)
+    recorder.record(RECEIVED, 3, "c2", "binary", memoryview(b"\x01\x0b\x00"))
+    recorder.close()
+
+    records = [(record.kind, record.tick, record.peer, record.codec_name, record.payload) for record in read_recording(path)]
+
+    assert records == [(SENT, 1, "c1", "json", b"[]"), (NETWORK_TICK, 2, "", "", b""), (RECEIVED, 3, "c2", "binary", b"\x01\x0b\x00")]
+    assert recorder.get_stats()["records"] == 1
+
+
+def test_cut_off_record_is_ignored(tmp_path):
+
+    path = str(tmp_path / "game.rec")
+
+    recorder = Recorder(path)
+    recorder.record(SENT, 1, payload=b"whole")
+    recorder.record(SENT, 2, payload=b"cut off")
+    recorder.close()
+
+    with open(path, "r+b") as file:
+        file.truncate(file.seek(0, 2) - 3)
+
+    assert [record.payload for record in read_recording(path)] == [b"whole"]
+
+
+@pytest.mark.parametrize("contents", [b"1.6", b"notrec\x01", FILE_HEADER.pack(b"1.6rec", 99)])
+def test_not_a_recording(tmp_path, contents):
+
+    path = tmp_path / "game.rec"
+    path.write_bytes(contents)
+
+    with pytest.raises(InvalidRecording):
+        list(read_recording(str(path)))
+
+
+def test_replay_uses_recorded_dts(tmp_path):
+
+    path = str(tmp_path / "game.rec")
+
+    recorder = Recorder(path)
+    recorder.record(TICK, 0, payload=DT.pack(0.5))
+    recorder.record(TICK, 1, payload=DT.pack(0.25))
+    recorder.record(RECEIVED, 2, codec_name="json", payload=b"[]")
+    recorder.record(TICK, 2, payload=DT.pack(0.125))
+    recorder.record(NETWORK_TICK, 3)
+    recorder.close()
+
+    game = Game()
+    game.fixed_dt = 1
+
+    stats = replay(game, path)
+
+    assert game.dts == [0.5, 0.25, 0.125]
+    assert game.network_ticks == [(3, [b"[]"])]
+    assert stats["ticks"] == 3
+    assert stats["received_frames"] == 1
+
+    assert game.fixed_dt == 1
+
+
+def test_fixed_dt_is_restored_when_replay_fails(tmp_path):
+
+    path = str(tmp_path / "game.rec")
+
+    recorder = Recorder(path)
+    recorder.record(TICK, 0, payload=DT.pack(0.5))
+    recorder.record(TICK, 1, payload=b"bad")
+    recorder.close()
+
+    game = Game()
+
+    with pytest.raises(struct.error):
+        replay(game, path)
+
+    assert game.fixed_dt is None
+
+
+def test_replay_without_dts_needs_fixed_dt(tmp_path):
+
+    path = str(tmp_path / "game.rec")
+
+    recorder = Recorder(path)
+    recorder.record(NETWORK_TICK, 0)
+    recorder.record(NETWORK_TICK, 2)
+    recorder.close()
+
+    with pytest.raises(ValueError):
+        replay(Game(), path)
@@ -0,0 +1,124 @@
+from onepointsix.references import PendingReferences
+from onepointsix.unresolved import Unresolved
+
+
+class Entity:
+
+    def __init__(self, game: "Game", id: str, **attributes):
+
+        self.id = id
+        self.__dict__.update(attributes)
+
+        game.entities[id] = self
+
+
+class Game:
+    """Stands in for a client or server, the references only need its entities and tick count"""
+
+    def __init__(self):
+        self.entities = {}
+        self.tick_count = 0
+
+
+def test_existing_targets_resolve_straight_away():
+
+    game = Game()
+    references = PendingReferences(game)
+
+    target = Entity(game, "target")
+    holder = Entity(game, "holder", target=Unresolved("target"))
+
+    references.track(holder)
+
+    assert holder.target is target
+    assert len(references) == 0
+
+
+def test_waiting_reference_resolves_when_the_target_is_created():
+
+    game = Game()
+    references = PendingReferences(game)
+
+    holder = Entity(game, "holder", target=Unresolved("target"), other=Unresolved("target"))
+
+    references.track(holder)
+
+    assert len(references) == 2
+
+    target = Entity(game, "target")
+    references.entity_created(target)
+
+    assert holder.target is target and holder.other is target
+    assert len(references) == 0
+    assert not references.holder_targets
+
+
+def test_reassigned_attribute_isnt_overwritten():
+
+    game = Game()
+    references = PendingReferences(game)
+
+    holder = Entity(game, "holder", target=Unresolved("old"))
+
+    references.track(holder)
+
+    holder.target = Unresolved("new")
+
+    references.entity_created(Entity(game, "old"))
+
+    assert holder.target.uuid == "new"
+
+
+def test_retracking_keeps_how_long_a_reference_waited():
+
+    game = Game()
+    references = PendingReferences(game, stale_after_ticks=10)
+
+    holder = Entity(game, "holder", target=Unresolved("target"))
+
+    references.track(holder)
+
+    game.tick_count = 10
+    references.track(holder)
+    references.check_stale()
+
+    assert [reference.uuid for reference in references.unresolvable()] == ["target"]
+
+
+def test_killed_holder_stops_waiting():
+
+    game = Game()
+    references = PendingReferences(game)
+
+    holder = Entity(game, "holder", target=Unresolved("target"))
+
+    references.track(holder)
+    references.entity_killed(holder)
+
+    assert len(references) == 0
+    assert not references.holder_targets
+
+
+def test_references_to_deleted_entities_are_reported():
+
+    game = Game()
+    references = PendingReferences(game, remembered_deletes=1)
+
+    waiting = Entity(game, "waiting", target=Unresolved("doomed"))
+    references.track(waiting)
+
+    doomed = Entity(game, "doomed")
+    del game.entities["doomed"]
+
+    # killed before it was ever created here, like a create and delete that were merged away
+    references.entity_killed(doomed)
+
+    late = Entity(game, "late", target=Unresolved("doomed"))
+    references.track(late)
+
+    assert {reference.holder.id for reference in references.unresolvable()} == {"waiting", "late"}
+
+    # only the newest deletes are remembered
+    references.entity_killed(Entity(game, "another"))
+
+    assert "doomed" not in references.deleted_ids
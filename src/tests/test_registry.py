@@ -0,0 +1,94 @@
+from onepointsix.registry import EntityRegistry, EntityTypeMap
+
+
+class Entity:
+
+    def __init__(self, id: str):
+        self.id = id
+
+
+class Box(Entity):
+    pass
+
+
+class Crate(Box):
+    pass
+
+
+class Tree(Entity):
+    pass
+
+
+def test_type_map_keeps_the_reverse_map():
+
+    type_map = EntityTypeMap({"box": Box})
+
+    type_map["tree"] = Tree
+    type_map.update(crate=Crate)
+
+    assert type_map.type_strings == {Box: "box", Tree: "tree", Crate: "crate"}
+
+    type_map["tree"] = Box
+
+    assert Tree not in type_map.type_strings
+    assert type_map.type_strings[Box] in ("box", "tree")
+
+    # another string still points at the class
+    del type_map["box"]
+
+    assert type_map.type_strings[Box] == "tree"
+
+    assert type_map.pop("tree") is Box
+    assert Box not in type_map.type_strings
+
+    type_map.clear()
+
+    assert not type_map.type_strings
+
+
+def test_of_type_includes_subclasses_in_creation_order():
+
+    registry = EntityRegistry()
+
+    entities = [Box("a"), Tree("b"), Crate("c"), Box("d")]
+
+    for entity in entities:
+        registry.add(entity)
+
+    assert [entity.id for entity in registry.of_type(Box)] == ["a", "c", "d"]
+    assert [entity.id for entity in registry.of_type(Entity)] == ["a", "b", "c", "d"]
+    assert registry.count(Crate) == 1
+
+
+def test_new_class_updates_cached_lookups():
+
+    registry = EntityRegistry()
+
+    registry.add(Box("a"))
+
+    assert registry.count(Entity) == 1
+
+    registry.add(Tree("b"))
+
+    assert registry.count(Entity) == 2
+
+
+def test_remove_only_removes_that_entity():
+
+    registry = EntityRegistry()
+
+    old = Box("a")
+    registry.add(old)
+
+    # replaced by a newer entity with the same id, which goes to the end
+    new = Box("a")
+    registry.add(Box("b"))
+    registry.add(new)
+
+    registry.remove(old)
+
+    assert registry.of_type(Box) == [registry.by_class[Box]["b"][1], new]
+
+    registry.remove(new)
+
+    assert [entity.id for entity in registry.of_type(Box)] == ["b"]
@@ -0,0 +1,82 @@
+from onepointsix.codec import BinaryCodec, JsonCodec
+from onepointsix.relay import RelayCache
+
+
+def update(entity_id: str, **data) -> dict:
+    return {"update_type": "update", "entity_id": entity_id, "entity_type": None, "data": data}
+
+
+def create(entity_id: str, **data) -> dict:
+    return {"update_type": "create", "entity_id": entity_id, "entity_type": "box", "data": data}
+
+
+def delete(entity_id: str) -> dict:
+    return {"update_type": "delete", "entity_id": entity_id, "entity_type": None, "data": {}}
+
+
+class CountingCodec(BinaryCodec):
+
+    def __init__(self):
+        self.decodes = 0
+
+    def decode(self, encoded: bytes) -> list:
+        self.decodes += 1
+
+        return super().decode(encoded)
+
+
+def test_frames_are_decoded_once_when_needed():
+
+    codec = CountingCodec()
+    cache = RelayCache()
+
+    cache.record(codec, codec.encode([create("a", updater="c1", x=0)]))
+    cache.record(codec, codec.encode([update("a", x=1), create("b", updater="c2", x=0)]))
+
+    assert codec.decodes == 0
+
+    assert cache.snapshot() == [create("a", updater="c1", x=1), create("b", updater="c2", x=0)]
+    assert codec.decodes == 2
+
+    cache.snapshot()
+
+    assert codec.decodes == 2
+
+
+def test_fold_threshold():
+
+    codec = CountingCodec()
+    cache = RelayCache(max_pending_bytes=0)
+
+    cache.record(codec, codec.encode([create("a", x=0)]))
+
+    assert codec.decodes == 1
+    assert not cache.pending_frames
+    assert cache.pending_bytes == 0
+
+
+def test_frames_from_different_codecs():
+
+    cache = RelayCache()
+
+    cache.record(JsonCodec(), JsonCodec().encode([create("a", updater="c1", x=0)]))
+    cache.record(BinaryCodec(), BinaryCodec().encode([update("a", x=2), update("unknown", x=1), delete("b")]))
+
+    # updates for entities that were never created are dropped
+    assert cache.snapshot() == [create("a", updater="c1", x=2)]
+
+
+def test_owned_by_and_remove():
+
+    codec = BinaryCodec()
+    cache = RelayCache()
+
+    cache.record(codec, codec.encode([create("a", updater="c1"), create("b", updater="c2"), create("c", updater="c1")]))
+
+    assert cache.owned_by("c1") == ["a", "c"]
+
+    cache.record(codec, codec.encode([delete("c")]))
+    cache.remove("a")
+
+    assert cache.owned_by("c1") == []
+    assert [state["entity_id"] for state in cache.snapshot()] == ["b"]
@@ -0,0 +1,85 @@
+from onepointsix.scheduler import TickScheduler
+
+
+class FakeClock:
+    """Time only moves when something sleeps or a task says it took a while"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+
+        # yielding with sleep(0) still takes a moment
+        self.now += seconds or 0.0001
+
+
+def test_tasks_run_at_their_rate():
+
+    clock = FakeClock()
+    scheduler = TickScheduler(clock, clock.sleep, spin_threshold=0)
+
+    runs = []
+
+    scheduler.add_task("game", 10, lambda: runs.append(("game", clock.now)))
+    scheduler.add_task("network", 5, lambda: runs.append(("network", clock.now)))
+
+    for _ in range(4):
+        scheduler.run_pending()
+        scheduler.sleep_until_next()
+
+    assert [name for name, time in runs] == ["game", "network", "game", "game", "network", "game"]
+    assert scheduler.get_stats()["game"]["runs"] == 4
+    assert scheduler.get_stats()["network"]["overruns"] == 0
+
+
+def test_sleeps_instead_of_spinning():
+
+    clock = FakeClock()
+    scheduler = TickScheduler(clock, clock.sleep, spin_threshold=0.001)
+
+    scheduler.add_task("game", 10, lambda: None)
+
+    scheduler.run_pending()
+    scheduler.sleep_until_next()
+
+    # one real sleep for most of the wait, then yields for the last bit
+    assert abs(clock.sleeps[0] - 0.099) < 1e-9
+    assert all(seconds == 0 for seconds in clock.sleeps[1:])
+
+
+def test_catch_up_is_limited():
+
+    clock = FakeClock()
+    scheduler = TickScheduler(clock, clock.sleep)
+
+    task = scheduler.add_task("game", 10, lambda: None, max_catch_up=3)
+
+    # a second behind is ten missed runs
+    clock.now = 0.95
+
+    scheduler.run_pending()
+
+    assert task.runs == 3
+    assert task.skipped == 7
+    assert scheduler.time_until_next() > 0
+
+
+def test_slow_runs_count_as_overruns():
+
+    clock = FakeClock()
+    scheduler = TickScheduler(clock, clock.sleep)
+
+    def slow():
+        clock.now += 0.15
+
+    task = scheduler.add_task("game", 10, slow, max_catch_up=1)
+
+    scheduler.run_pending()
+
+    assert task.overruns == 1
+    assert task.get_stats()["last_duration"] == 0.15
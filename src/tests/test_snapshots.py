@@ -0,0 +1,103 @@
+from onepointsix.snapshots import SnapshotReceiver, SnapshotReplicator, apply_world_updates, world_diff
+from onepointsix.update_batch import BatchedUpdateQueue
+
+
+class Entity:
+
+    def __init__(self, updater: str, **data):
+        self.updater = updater
+        self.data = data
+
+    def serialize(self) -> dict:
+        return {"updater": self.updater, **self.data}
+
+
+class Game:
+    """Stands in for the server, the replicator only reads its entities and queues to it"""
+
+    def __init__(self):
+        self.entities = {}
+        self.update_queue = BatchedUpdateQueue()
+
+    def lookup_entity_type_string(self, entity) -> str:
+        return "box"
+
+
+class Client:
+
+    def __init__(self):
+        self.outgoing_updates_queue = []
+
+
+def test_world_diff_round_trip():
+
+    old = {"a": {"entity_type": "box", "data": {"x": 1, "stats": {"hp": 1, "mp": 1}}}, "b": {"entity_type": "box", "data": {}}}
+    new = {"a": {"entity_type": "box", "data": {"x": 1, "stats": {"hp": 2, "mp": 1}}}, "c": {"entity_type": "tree", "data": {"y": 2}}}
+
+    diff = world_diff(old, new)
+
+    assert diff["a"]["data"] == {"stats": {"hp": 2}}
+    assert diff["b"]["update_type"] == "delete"
+    assert diff["c"]["update_type"] == "create"
+
+    assert apply_world_updates(old, list(diff.values())) == new
+
+
+def test_every_snapshot_is_its_own_frame():
+
+    game = Game()
+    replicator = SnapshotReplicator(game)
+
+    game.entities["a"] = Entity("server", x=0)
+
+    replicator.add_client("c1")
+
+    replicator.send_snapshots(None)
+
+    game.entities["a"].data["x"] = 1
+
+    replicator.send_snapshots(None)
+
+    batches = game.update_queue.take("c1")
+
+    assert [batch.decoded_updates()[0]["data"] for batch in batches] == [{"number": 1, "baseline": 0}, {"number": 2, "baseline": 0}]
+
+    # the client applies them in order and acks the newest
+    client = Client()
+    receiver = SnapshotReceiver(client)
+
+    assert [update["update_type"] for update in receiver.apply(batches[0].decoded_updates())] == ["create"]
+    assert receiver.apply(batches[1].decoded_updates()) == [{"update_type": "update", "entity_id": "a", "entity_type": None, "data": {"x": 1}}]
+
+    replicator.take_acks("c1", client.outgoing_updates_queue)
+
+    assert replicator.clients["c1"].acked == 2
+
+
+def test_clients_dont_get_their_own_entities():
+
+    game = Game()
+    replicator = SnapshotReplicator(game)
+
+    game.entities["theirs"] = Entity("c1")
+    game.entities["ours"] = Entity("server")
+
+    replicator.send_initial_snapshot("c1")
+
+    (batch,) = game.update_queue.take("c1")
+
+    assert [update["entity_id"] for update in batch.decoded_updates()] == [None, "ours"]
+
+
+def test_clients_that_dont_ack_are_skipped():
+
+    game = Game()
+    replicator = SnapshotReplicator(game, max_unacked_snapshots=2)
+
+    replicator.add_client("c1")
+
+    for _ in range(5):
+        replicator.send_snapshots(None)
+
+    assert len(game.update_queue.take("c1")) == 3
+    assert replicator.get_stats()["c1"]["skipped"] == 2
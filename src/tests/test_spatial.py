@@ -0,0 +1,127 @@
+from pygame import Rect
+
+from onepointsix.spatial import SpatialGrid, SpatialIndex
+
+
+class Entity:
+    """Stands in for an entity, the index only needs its id and position"""
+
+    def __init__(self, entity_id: str, position):
+        self.id = entity_id
+        self.position = position
+
+    def get_position(self):
+        return self.position
+
+
+class Game:
+
+    def __init__(self):
+        self.entities = {}
+
+
+def test_move_between_cells():
+
+    grid = SpatialGrid(10)
+
+    grid.move("a", (1, 1))
+    grid.move("a", (25, 1))
+
+    assert grid.query_radius((25, 1), 1) == ["a"]
+    assert grid.query_radius((1, 1), 1) == []
+    assert list(grid.cells) == [(2, 0)]
+
+    grid.remove("a")
+    grid.remove("a")
+
+    assert not grid.cells
+    assert "a" not in grid
+
+
+def test_query_rect_edges():
+
+    grid = SpatialGrid(10)
+
+    for entity_id, position in {"inside": (0, 0), "right": (20, 5), "bottom": (5, 20), "last": (19.5, 19.5)}.items():
+        grid.move(entity_id, position)
+
+    assert sorted(grid.query_rect(Rect(0, 0, 20, 20))) == ["inside", "last"]
+
+
+def test_nearest():
+
+    grid = SpatialGrid(10)
+
+    grid.move("near", (12, 0))
+    grid.move("far", (40, 0))
+
+    assert grid.nearest((0, 0)) == "near"
+    assert grid.nearest((0, 0), where=lambda entity_id: entity_id != "near") == "far"
+    assert grid.nearest((0, 0), max_distance=12) == "near"
+    assert grid.nearest((0, 0), max_distance=11) is None
+
+
+def test_nearest_in_a_sparse_world():
+
+    grid = SpatialGrid(1)
+
+    grid.move("a", (100_000, 0))
+    grid.move("b", (-100_000, 1))
+
+    # the rings in between are empty, this would take forever going one ring at a time
+    assert grid.nearest((0, 0)) == "a"
+    assert grid.nearest((0, 0), where=lambda entity_id: entity_id == "b") == "b"
+    assert grid.nearest((0, 0), max_distance=1000) is None
+
+
+def test_index_only_refreshes_changed_entities():
+
+    game = Game()
+    index = SpatialIndex(game, 10)
+
+    entities = [Entity(str(number), (number * 10, 0)) for number in range(3)]
+
+    for entity in entities:
+        game.entities[entity.id] = entity
+        index.entity_changed(entity)
+
+    assert not index.positions
+
+    index.refresh()
+
+    assert [entity.id for entity in index.entities_in_radius((0, 0), 15)] == ["0", "1"]
+
+    # moved without telling the index
+    entities[0].position = (100, 0)
+    index.refresh()
+
+    assert index.positions["0"] == (0, 0)
+
+    index.entity_changed(entities[0])
+    index.refresh()
+
+    assert index.nearest_entity((95, 0)) is entities[0]
+
+
+def test_index_forgets_removed_entities():
+
+    game = Game()
+    index = SpatialIndex(game, 10)
+
+    entity = Entity("a", (0, 0))
+    game.entities["a"] = entity
+
+    index.entity_moved(entity)
+    index.entity_changed(entity)
+
+    index.remove("a")
+    index.refresh()
+
+    assert "a" not in index
+
+    # entities without a position aren't indexed
+    entity.position = None
+    index.entity_changed(entity)
+    index.refresh()
+
+    assert "a" not in index
@@ -0,0 +1,175 @@
+import time
+
+from onepointsix.codec import JsonCodec
+from onepointsix.helpers import merge_dicts
+from onepointsix.udp_transport import UdpConnection, UdpEndpoint, split_channels
+from onepointsix.update_batch import UpdateBatch
+
+
+def update(entity_id: str, **data) -> dict:
+    return {"update_type": "update", "entity_id": entity_id, "entity_type": None, "data": data}
+
+
+def create(entity_id: str, **data) -> dict:
+    return {"update_type": "create", "entity_id": entity_id, "entity_type": "box", "data": data}
+
+
+class CountingCodec(JsonCodec):
+
+    def __init__(self):
+        self.encodes = 0
+
+    def encode(self, updates: list) -> bytes:
+        self.encodes += 1
+
+        return super().encode(updates)
+
+
+def bad_network() -> UdpEndpoint:
+    return UdpEndpoint(loss=0.3, latency=0.01, jitter=0.02, seed=1, resend_interval=0.02, loss_timeout=0.1)
+
+
+def connect():
+    """A server endpoint and a client connected to it over loopback, both losing and delaying datagrams"""
+
+    server = bad_network()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    client = UdpConnection(bad_network())
+    client.setblocking(False)
+    client.connect(server.socket.getsockname())
+
+    return server, client
+
+
+def pump(server: UdpEndpoint, client: UdpConnection):
+
+    for endpoint in [server, client.endpoint]:
+        endpoint.pump(timeout=0.001)
+
+    for connection in [client, *server.connections.values()]:
+        connection.service()
+
+
+def run_until(condition, server: UdpEndpoint, client: UdpConnection, timeout: float = 10):
+
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+
+        assert time.monotonic() < deadline, "gave up waiting"
+
+        pump(server, client)
+
+
+def test_split_channels():
+
+    updates = [create("a", x=0), update("a", x=1), update("b", x=1), {"update_type": "ack", "entity_id": None, "entity_type": None, "data": {"number": 1}}]
+
+    assert split_channels(updates) == ([updates[0], updates[1], updates[3]], [updates[2]])
+
+
+def test_batches_are_split_and_encoded_once():
+
+    codec = CountingCodec()
+
+    # everything is dropped, we only care about what gets encoded
+    connections = [UdpConnection(UdpEndpoint(loss=1)) for _ in range(3)]
+
+    for connection in connections:
+        connection.codec = codec
+
+    batch = UpdateBatch(frozenset(["c1", "c2", "c3"]), [create("a", x=0), update("b", x=1)])
+
+    for connection in connections:
+        connection.send_batch(batch)
+
+    assert codec.encodes == 2
+
+    # but what was sent is still remembered per connection, for healing lost fields
+    assert all(connection.sent_fields == {"a": {"x": 0}, "b": {"x": 1}} for connection in connections)
+
+
+def test_reliable_frames_arrive_in_order():
+
+    server, client = connect()
+
+    frames = [f"frame {number}".encode() * (number + 1) * 20 for number in range(50)]
+
+    for frame in frames:
+        client.send_headered(frame)
+
+    received = []
+
+    def receive():
+
+        if server.connections:
+            (connection,) = server.connections.values()
+
+            received.extend(connection.inbox)
+            connection.inbox.clear()
+
+        return len(received) == len(frames)
+
+    run_until(receive, server, client)
+
+    assert received == frames
+    assert client.resent_fragments > 0
+
+    client.endpoint.close()
+    server.close()
+
+
+def test_lost_unreliable_fields_are_resent():
+
+    server, client = connect()
+
+    client.send_headered(b"hello")
+
+    run_until(lambda: server.pending_connections, server, client)
+
+    connection, address = server.accept()
+    connection.setblocking(False)
+
+    world = {}
+
+    def receive():
+
+        for frame in client.inbox:
+            for received in client.codec.decode(client.compression.decompress(frame)):
+
+                if received["update_type"] == "create":
+                    world[received["entity_id"]] = received["data"]
+
+                elif received["entity_id"] in world:
+                    world[received["entity_id"]] = merge_dicts(world[received["entity_id"]], received["data"])
+
+        client.inbox.clear()
+
+    connection.send_batch(UpdateBatch(frozenset(["c1"]), [create("a", x=0, y=0)]))
+
+    for number in range(1, 100):
+
+        # only one field changes at a time, so a lost message is the only place its value was
+        field = "x" if number % 2 else "y"
+
+        connection.send_batch(UpdateBatch(frozenset(["c1"]), [update("a", **{field: number})]))
+
+        pump(server, client)
+
+        receive()
+
+    def healed() -> bool:
+
+        receive()
+
+        return world.get("a") == {"x": 99, "y": 98}
+
+    run_until(healed, server, client)
+
+    assert connection.lost_messages > 0
+    assert connection.healed_fields > 0
+
+    client.endpoint.close()
+    server.close()
@@ -0,0 +1,170 @@
+from onepointsix.codec import JsonCodec
+from onepointsix.compression import NoCompression, OneShotCompression
+from onepointsix.update_batch import BacklogBatch, BatchedUpdateQueue, EncodedBatch, UpdateBatch
+
+
+def update(entity_id: str, **data) -> dict:
+    return {"update_type": "update", "entity_id": entity_id, "entity_type": None, "data": data}
+
+
+def create(entity_id: str, **data) -> dict:
+    return {"update_type": "create", "entity_id": entity_id, "entity_type": "box", "data": data}
+
+
+def delete(entity_id: str) -> dict:
+    return {"update_type": "delete", "entity_id": entity_id, "entity_type": None, "data": {}}
+
+
+class CountingCodec(JsonCodec):
+
+    def __init__(self):
+        self.encodes = 0
+
+    def encode(self, updates: list) -> bytes:
+        self.encodes += 1
+
+        return super().encode(updates)
+
+
+class Connection:
+
+    def __init__(self, codec, compression):
+        self.codec = codec
+        self.compression = compression
+
+
+def test_batch_keeps_updates_as_queued():
+
+    updates = [create("a", x=0), update("a", x=1), update("a", x=2), delete("a"), {"update_type": "ack", "entity_id": None, "data": {"number": 3}}]
+
+    batch = UpdateBatch(frozenset(["c1"]), updates[:2])
+    batch.add(updates[2:])
+
+    assert list(batch.decoded_updates()) == updates
+
+
+def test_batch_is_encoded_once_for_every_recipient():
+
+    codec = CountingCodec()
+
+    batch = UpdateBatch(frozenset(["c1", "c2", "c3"]), [update("a", x=1)])
+
+    payloads = {batch.payload_for(Connection(codec, OneShotCompression())) for _ in range(3)}
+
+    assert codec.encodes == 1
+    assert len(payloads) == 1
+
+    # adding to the batch makes it encode again
+    batch.add([update("a", x=2)])
+    batch.payload_for(Connection(codec, NoCompression()))
+
+    assert codec.encodes == 2
+
+
+def test_encoded_batch_is_only_decoded_when_needed():
+
+    codec = JsonCodec()
+    updates = [update("a", x=1), update("a", x=2)]
+
+    batch = EncodedBatch(frozenset(["c1"]), codec, codec.encode(updates))
+
+    assert batch.payload_for(Connection(JsonCodec(), NoCompression())) == codec.encode(updates)
+    assert not batch.decoded
+
+    assert list(batch.decoded_updates()) == updates
+
+
+def test_backlog_merges_per_entity():
+
+    backlog = BacklogBatch(frozenset(["c1"]), [update("a", x=1), create("b", x=0)])
+    backlog.add([update("a", y=2), delete("b")])
+
+    assert list(backlog.decoded_updates()) == [update("a", x=1, y=2)]
+
+
+def test_broadcasts_share_one_batch():
+
+    queue = BatchedUpdateQueue()
+
+    queue.queue(update("a", x=1), ["c1", "c2"])
+    queue.queue(update("a", x=2), ["c1", "c2"])
+
+    assert queue["c1"] == queue["c2"]
+    assert len(queue["c1"]) == 1
+    assert len(queue["c1"][0].decoded_updates()) == 2
+
+    # something for one client starts its own batch, and the next broadcast cant extend the old one
+    queue.queue(update("b", x=1), ["c1"])
+    queue.queue(update("a", x=3), ["c1", "c2"])
+
+    assert len(queue["c1"]) == 3
+    assert len(queue["c2"]) == 2
+    assert queue["c1"][2] is queue["c2"][1]
+
+
+def test_compact_merges_into_a_private_backlog():
+
+    queue = BatchedUpdateQueue()
+
+    queue.queue([create("a", x=0), update("a", x=1)], ["c1", "c2"])
+
+    queue.compact("c1")
+
+    queue.queue(update("a", x=2), ["c1", "c2"])
+
+    assert [list(batch.decoded_updates()) for batch in queue["c1"]] == [[create("a", x=2)]]
+    assert [list(batch.decoded_updates()) for batch in queue["c2"]] == [[create("a", x=0), update("a", x=1)], [update("a", x=2)]]
+
+    # taking the queue ends the backlog
+    queue.take("c1")
+    queue.queue(update("a", x=3), ["c1"])
+
+    assert type(queue["c1"][0]) is UpdateBatch
+
+
+def test_busy_tick_does_not_backlog():
+
+    queue = BatchedUpdateQueue()
+
+    for index in range(1000):
+        queue.queue(update(str(index), x=index), ["c1", "c2"])
+
+    assert not queue.backlogs
+    assert len(queue["c1"]) == 1
+    assert queue["c1"] == queue["c2"]
+
+
+def test_held_through_two_network_ticks_is_backlogged():
+
+    queue = BatchedUpdateQueue()
+
+    queue.queue([update("a", x=1), update("a", x=2)], ["c1", "c2"])
+
+    queue.hold("c1")
+
+    assert not queue.backlogs
+
+    queue.queue(update("a", x=3), ["c1", "c2"])
+
+    queue.hold("c1")
+
+    assert list(queue.backlogs) == ["c1"]
+    assert [list(batch.decoded_updates()) for batch in queue["c1"]] == [[update("a", x=3)]]
+
+    # once it is sent it starts over
+    queue.take("c1")
+    queue.hold("c1")
+
+    assert not queue.backlogs
+
+
+def test_frames_are_not_shared_or_extended():
+
+    queue = BatchedUpdateQueue()
+
+    queue.queue(update("a", x=1), ["c1"])
+    queue.queue_frame([update("b", x=1)], ["c1"])
+    queue.queue(update("a", x=2), ["c1"])
+    queue.queue_frame([update("b", x=2)], ["c1"])
+
+    assert [list(batch.decoded_updates()) for batch in queue["c1"]] == [[update("a", x=1)], [update("b", x=1)], [update("a", x=2)], [update("b", x=2)]]
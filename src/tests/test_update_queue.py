@@ -0,0 +1,95 @@
+from onepointsix.update_queue import UpdateQueue
+
+
+def update(entity_id: str, **data) -> dict:
+    return {"update_type": "update", "entity_id": entity_id, "entity_type": None, "data": data}
+
+
+def create(entity_id: str, **data) -> dict:
+    return {"update_type": "create", "entity_id": entity_id, "entity_type": "box", "data": data}
+
+
+def delete(entity_id: str) -> dict:
+    return {"update_type": "delete", "entity_id": entity_id, "entity_type": None, "data": {}}
+
+
+def ack(number: int) -> dict:
+    return {"update_type": "ack", "entity_id": None, "entity_type": None, "data": {"number": number}}
+
+
+def test_updates_merge_field_by_field():
+
+    queue = UpdateQueue([update("a", x=1, y=1), update("a", x=2)])
+
+    assert list(queue) == [update("a", x=2, y=1)]
+
+
+def test_nested_data_is_merged():
+
+    queue = UpdateQueue([update("a", stats={"hp": 1, "mp": 1}), update("a", stats={"hp": 2})])
+
+    assert list(queue) == [update("a", stats={"hp": 2, "mp": 1})]
+
+
+def test_queued_dicts_are_not_modified():
+
+    first = update("a", x=1)
+
+    UpdateQueue([first, update("a", x=2)])
+
+    assert first == update("a", x=1)
+
+
+def test_updates_fold_into_an_unsent_create():
+
+    queue = UpdateQueue([create("a", x=0, y=0), update("a", x=5)])
+
+    assert list(queue) == [create("a", x=5, y=0)]
+
+
+def test_delete_replaces_updates():
+
+    queue = UpdateQueue([update("a", x=1), delete("a"), update("a", x=2)])
+
+    assert list(queue) == [delete("a")]
+
+
+def test_delete_cancels_an_unsent_create():
+
+    queue = UpdateQueue([create("a", x=0), update("a", x=1), delete("a")])
+
+    assert list(queue) == []
+
+
+def test_create_after_delete_goes_after_it():
+
+    queue = UpdateQueue([update("a", x=1), delete("a"), create("a", x=9)])
+
+    assert list(queue) == [delete("a"), create("a", x=9)]
+
+    # cancelling the new create leaves the delete for the old entity
+    queue.add(delete("a"))
+
+    assert list(queue) == [delete("a")]
+
+
+def test_newer_create_replaces_the_pending_one():
+
+    queue = UpdateQueue([create("a", x=0), update("b", x=1), create("a", x=3)])
+
+    assert list(queue) == [update("b", x=1), create("a", x=3)]
+
+
+def test_entities_keep_the_position_of_their_first_update():
+
+    queue = UpdateQueue([update("a", x=1), update("b", x=1), update("a", x=2), create("c"), update("b", x=2)])
+
+    assert [queued["entity_id"] for queued in queue] == ["a", "b", "c"]
+
+
+def test_control_updates_are_kept_as_they_are():
+
+    queue = UpdateQueue([ack(1), update("a", x=1), ack(2), update("a", x=2)])
+
+    assert list(queue) == [ack(1), update("a", x=2), ack(2)]
+    assert len(queue) == 3